@@ -0,0 +1,194 @@
+import sys
+from sqlalchemy import select, delete, func
+from models import (db, Product, Order, OrderItem, InventoryItem, UserData, DistributionCenter,
+                    ProductSalesStat, ProductInventoryStat, AggregateTotal)
+from db_utils import upsert_statement
+from cache import invalidate_dataset_caches
+
+# Tables whose row counts are kept in aggregate_totals
+COUNTED_TABLES = [Product, Order, OrderItem, InventoryItem, UserData, DistributionCenter]
+AVAILABLE_INVENTORY = 'inventory_items_available'
+
+# Number of product ids refreshed per query
+REFRESH_BATCH_SIZE = 1000
+
+def _increment(table, key, values):
+    """Add counter deltas to an aggregate table, creating rows as needed"""
+    if not values:
+        return
+    columns = [name for name in values[0] if name != key]
+    db.session.execute(
+        upsert_statement(table, [key], set_=lambda excluded: {
+            name: table.c[name] + excluded[name] for name in columns
+        }),
+        values
+    )
+
+def _increment_totals(deltas):
+    _increment(AggregateTotal.__table__, 'name', [
+        {'name': name, 'value': int(value)} for name, value in deltas.items() if value
+    ])
+
+def apply_loaded_chunk(model, df):
+    """
+    Fold a chunk of freshly inserted rows into the aggregates.
+    Only valid for pure inserts (bulk loads); syncs that update or delete rows
+    go through refresh_products instead.
+    """
+    totals = {model.__tablename__: len(df)}
+
+    if model is OrderItem:
+        counts = df['product_id'].dropna().value_counts()
+        _increment(ProductSalesStat.__table__, 'product_id', [
+            {'product_id': int(product_id), 'sales_count': int(count)} for product_id, count in counts.items()
+        ])
+
+    elif model is InventoryItem:
+        grouped = df.assign(available=df['sold_at'].isna()).groupby('product_id')['available'].agg(['size', 'sum'])
+        _increment(ProductInventoryStat.__table__, 'product_id', [
+            {'product_id': int(product_id), 'total_count': int(row['size']), 'available_count': int(row['sum'])}
+            for product_id, row in grouped.iterrows()
+        ])
+        totals[AVAILABLE_INVENTORY] = int(df['sold_at'].isna().sum())
+
+    _increment_totals(totals)
+
+def refresh_products(product_ids):
+    """Recompute the per-product aggregates for a set of products from the base tables"""
+    product_ids = sorted({int(p) for p in product_ids if p is not None})
+
+    for start in range(0, len(product_ids), REFRESH_BATCH_SIZE):
+        batch = product_ids[start:start + REFRESH_BATCH_SIZE]
+
+        db.session.execute(delete(ProductSalesStat).where(ProductSalesStat.product_id.in_(batch)))
+        sales = db.session.execute(
+            select(OrderItem.product_id, func.count(OrderItem.id))
+            .where(OrderItem.product_id.in_(batch))
+            .group_by(OrderItem.product_id)
+        ).all()
+        if sales:
+            db.session.execute(ProductSalesStat.__table__.insert(), [
+                {'product_id': product_id, 'sales_count': count} for product_id, count in sales
+            ])
+
+        db.session.execute(delete(ProductInventoryStat).where(ProductInventoryStat.product_id.in_(batch)))
+        inventory = db.session.execute(
+            select(
+                InventoryItem.product_id,
+                func.count(InventoryItem.id),
+                func.count(InventoryItem.id).filter(InventoryItem.sold_at.is_(None))
+            )
+            .where(InventoryItem.product_id.in_(batch))
+            .group_by(InventoryItem.product_id)
+        ).all()
+        if inventory:
+            db.session.execute(ProductInventoryStat.__table__.insert(), [
+                {'product_id': product_id, 'total_count': total, 'available_count': available}
+                for product_id, total, available in inventory
+            ])
+
+def refresh_totals():
+    """Recount every table-wide total from the base tables"""
+    values = [
+        {'name': model.__tablename__, 'value': db.session.query(func.count()).select_from(model).scalar()}
+        for model in COUNTED_TABLES
+    ]
+    values.append({
+        'name': AVAILABLE_INVENTORY,
+        'value': InventoryItem.query.filter(InventoryItem.sold_at.is_(None)).count()
+    })
+    db.session.execute(upsert_statement(AggregateTotal.__table__, ['name']), values)
+
+def rebuild_aggregates():
+    """Full rebuild of every aggregate table, for recovery or after out-of-band writes"""
+    db.session.execute(delete(ProductSalesStat))
+    db.session.execute(
+        ProductSalesStat.__table__.insert().from_select(
+            ['product_id', 'sales_count'],
+            select(OrderItem.product_id, func.count(OrderItem.id))
+            .where(OrderItem.product_id.isnot(None))
+            .group_by(OrderItem.product_id)
+        )
+    )
+
+    db.session.execute(delete(ProductInventoryStat))
+    db.session.execute(
+        ProductInventoryStat.__table__.insert().from_select(
+            ['product_id', 'total_count', 'available_count'],
+            select(
+                InventoryItem.product_id,
+                func.count(InventoryItem.id),
+                func.count(InventoryItem.id).filter(InventoryItem.sold_at.is_(None))
+            )
+            .where(InventoryItem.product_id.isnot(None))
+            .group_by(InventoryItem.product_id)
+        )
+    )
+
+    refresh_totals()
+    db.session.commit()
+    invalidate_dataset_caches()
+
+def top_selling_products(limit):
+    """Top products by units sold, read from the sales aggregate"""
+    return db.session.query(
+        Product.name,
+        Product.brand,
+        Product.category,
+        ProductSalesStat.sales_count
+    ).join(Product, Product.id == ProductSalesStat.product_id)\
+     .order_by(ProductSalesStat.sales_count.desc())\
+     .limit(limit).all()
+
+def _product_counts(column, limit):
+    """(value, product count) of the most common values of a product column"""
+    return db.session.query(
+        column,
+        func.count(Product.id).label('count')
+    ).filter(column.isnot(None))\
+     .group_by(column)\
+     .order_by(func.count(Product.id).desc())\
+     .limit(limit).all()
+
+def top_categories(limit):
+    """Categories with the most products"""
+    return _product_counts(Product.category, limit)
+
+def top_brands(limit):
+    """Brands with the most products"""
+    return _product_counts(Product.brand, limit)
+
+def product_inventory(product_id):
+    """(total, available) inventory for one product"""
+    stat = db.session.get(ProductInventoryStat, product_id)
+    if not stat:
+        return 0, 0
+    return stat.total_count, stat.available_count
+
+def get_total(name):
+    """Current value of a table-wide counter, 0 if it has never been computed"""
+    total = db.session.get(AggregateTotal, name)
+    return total.value if total else 0
+
+def inventory_summary():
+    """Product count, total inventory and available inventory"""
+    return {
+        'products': get_total(Product.__tablename__),
+        'inventory_items': get_total(InventoryItem.__tablename__),
+        'available': get_total(AVAILABLE_INVENTORY)
+    }
+
+if __name__ == "__main__":
+    from app import create_app
+    from config import Config
+    app = create_app(engine_options=Config.BATCH_ENGINE_OPTIONS)
+    command = sys.argv[1] if len(sys.argv) > 1 else 'rebuild'
+
+    with app.app_context():
+        if command == 'rebuild':
+            db.create_all()
+            rebuild_aggregates()
+            print("Aggregate tables rebuilt successfully!")
+        else:
+            print("Usage: python aggregates.py rebuild")
+            sys.exit(2)
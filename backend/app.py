@@ -1,14 +1,35 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
+from werkzeug.http import is_resource_modified
 from models import db, User, Conversation, Message, Product, Order, OrderItem, InventoryItem, UserData, DistributionCenter
 from config import Config
 from chat_service import ChatService
+from chat_batch import ChatBatch, parse_batch
+from cache import context_cache
+from llm_cache import response_cache
+from history import (history_buffer, activity_statement, conversation_page_statement,
+                     message_page_statement, message_position, iter_messages)
+from pagination import encode_cursor, decode_cursor, page_size
+from stats import fast_stats, exact_stats, exact_refresher
+from summaries import summarizer
 import uuid
+import json
+import hashlib
+import hmac
+import time
 from datetime import datetime
+from metrics import registry
+import tracing
+from query_profiler import query_profiler
+from persistence import write_behind
+from archive import rehydrate
+from snapshot import analytics_snapshot
 
-def create_app():
+def create_app(engine_options=None):
     app = Flask(__name__)
     app.config.from_object(Config)
+    if engine_options is not None:
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
     
     # Initialize extensions
     db.init_app(app)
@@ -17,7 +38,29 @@ def create_app():
     return app
 
 app = create_app()
+tracing.init_app(app)
+query_profiler.init_app(app)
+exact_refresher.init_app(app)
 chat_service = ChatService()
+summarizer.init_app(app, chat_service.llm_service)
+write_behind.init_app(app)
+
+def request_budget():
+    """
+    Seconds allowed for one LLM call of this request. Clients may ask for a
+    shorter budget with an X-Request-Timeout header; it is capped by
+    CHAT_REQUEST_DEADLINE.
+    """
+    budget = Config.CHAT_REQUEST_DEADLINE
+    try:
+        budget = min(budget, float(request.headers.get('X-Request-Timeout', budget)))
+    except ValueError:
+        pass
+    return max(budget, 0)
+
+def request_deadline():
+    """Monotonic deadline for the LLM work of this request"""
+    return time.monotonic() + request_budget()
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -33,6 +76,8 @@ def health_check():
         'status': 'healthy',
         'message': 'Conversational AI Backend Service is running',
         'database': db_status,
+        'write_behind': write_behind.stats() if write_behind.enabled else None,
+        'analytics_snapshot': analytics_snapshot.report(),
         'timestamp': datetime.utcnow().isoformat()
     })
 
@@ -53,7 +98,8 @@ def chat():
         result = chat_service.process_chat_message(
             user_message=user_message,
             conversation_id=conversation_id,
-            user_id=user_id
+            user_id=user_id,
+            deadline=request_deadline()
         )
         
         # Check if result is an error tuple
@@ -65,6 +111,68 @@ def chat():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Streaming chat endpoint - relays the AI response as Server-Sent Events"""
+    try:
+        data = request.get_json()
+        
+        if not data or 'message' not in data:
+            return jsonify({'error': 'message is required'}), 400
+        
+        result = chat_service.stream_chat_message(
+            user_message=data['message'],
+            conversation_id=data.get('conversation_id'),
+            user_id=data.get('user_id'),
+            deadline=request_deadline()
+        )
+        
+        if isinstance(result, tuple):
+            return jsonify(result[0]), result[1]
+        
+        def generate():
+            for event in result:
+                yield f"event: {event.pop('type')}\ndata: {json.dumps(event)}\n\n"
+        
+        return Response(
+            stream_with_context(generate()),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/chat/batch', methods=['POST'])
+def chat_batch():
+    """
+    Batch chat endpoint - answers many {message, conversation_id|user_id}
+    items and streams one NDJSON result line per item as it completes,
+    followed by a summary line once all messages are saved
+    """
+    try:
+        try:
+            items = parse_batch(request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        batch = ChatBatch(chat_service, items)
+        batch.prepare()
+        
+        def generate():
+            for result in batch.results(request_budget()):
+                yield json.dumps(result) + '\n'
+        
+        return Response(
+            stream_with_context(generate()),
+            mimetype='application/x-ndjson',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/users', methods=['POST'])
 def create_user():
     """Create a new user"""
@@ -133,33 +241,125 @@ def create_conversation():
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+def message_dict(row):
+    return {
+        'id': row.id,
+        'role': row.role,
+        'content': row.content,
+        'created_at': row.created_at.isoformat()
+    }
+
+def conversation_validators(conversation, representation):
+    """
+    ETag and Last-Modified of a conversation view. Every message write bumps
+    message_count and updated_at, so they change whenever the view could.
+    The ETag also covers the negotiated representation (json or ndjson) and
+    is the authoritative validator: Last-Modified has whole-second
+    resolution, so If-Modified-Since alone can miss a second write within
+    the same second.
+    """
+    version = (f"{conversation.id}:{conversation.message_count}:{conversation.updated_at.isoformat()}:"
+               f"{representation}:{request.query_string.decode()}")
+    return hashlib.sha1(version.encode()).hexdigest(), conversation.updated_at.replace(microsecond=0)
+
 @app.route('/api/conversations/<conversation_id>', methods=['GET'])
 def get_conversation(conversation_id):
-    """Get conversation with all messages"""
+    """
+    Get a conversation with a page of its messages, oldest first. By default
+    the latest page; before=<message id | ISO timestamp> pages backwards and
+    after=<...> forwards, limit sets the page size. format=ndjson (or
+    Accept: application/x-ndjson) streams every message as an export.
+    Supports conditional GET with If-None-Match / If-Modified-Since.
+    """
     try:
-        conversation = Conversation.query.get(conversation_id)
+        limit = page_size(request.args.get('limit'), Config.MESSAGES_PAGE_SIZE, Config.MESSAGES_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'error': 'limit must be a number'}), 400
+    
+    try:
+        write_behind.barrier(conversation_id)
+        conversation = db.session.get(Conversation, conversation_id)
         if not conversation:
             return jsonify({'error': 'Conversation not found'}), 404
-        
-        messages = []
-        for message in conversation.messages:
-            messages.append({
-                'id': message.id,
-                'role': message.role,
-                'content': message.content,
-                'created_at': message.created_at.isoformat()
-            })
-        
-        return jsonify({
-            'conversation_id': conversation.id,
-            'title': conversation.title,
-            'created_at': conversation.created_at.isoformat(),
-            'messages': messages
-        })
+        rehydrate(db.session, conversation)
+        
+        # Polling clients get a 304 without any message being read
+        export = request.args.get('format') == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson'
+        etag, last_modified = conversation_validators(conversation, 'ndjson' if export else 'json')
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            response = Response(status=304)
+        elif export:
+            response = export_conversation(conversation)
+        else:
+            response = conversation_page(conversation, limit)
+            if isinstance(response, tuple):
+                return response
+        
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.vary.add('Accept')
+        response.cache_control.no_cache = True
+        return response
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def conversation_page(conversation, limit):
+    """JSON response with one page of a conversation's messages"""
+    positions = {}
+    for name in ('before', 'after'):
+        value = request.args.get(name)
+        if value:
+            positions[name] = message_position(conversation.id, value)
+            if positions[name] is None:
+                return jsonify({'error': f'{name} must be a message id of this conversation or an ISO timestamp'}), 400
+    
+    # One extra row tells whether the page is cut short
+    rows = db.session.execute(message_page_statement(
+        conversation.id, limit + 1,
+        before_position=positions.get('before'),
+        after_position=positions.get('after')
+    )).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if 'after' not in positions:
+        rows.reverse()
+    
+    return jsonify({
+        'conversation_id': conversation.id,
+        'title': conversation.title,
+        'created_at': conversation.created_at.isoformat(),
+        'message_count': conversation.message_count,
+        'messages': [message_dict(row) for row in rows],
+        # Ids to pass as before/after for the neighbouring pages
+        'page': {
+            'limit': limit,
+            'has_more': has_more,
+            'before': rows[0].id if rows else None,
+            'after': rows[-1].id if rows else None
+        }
+    })
+
+def export_conversation(conversation):
+    """Streamed NDJSON export: a conversation header line, then one line per message"""
+    header = {
+        'conversation_id': conversation.id,
+        'title': conversation.title,
+        'created_at': conversation.created_at.isoformat(),
+        'message_count': conversation.message_count
+    }
+    
+    def generate():
+        yield json.dumps(header) + '\n'
+        for row in iter_messages(conversation.id, Config.EXPORT_CHUNK_SIZE):
+            yield json.dumps(message_dict(row)) + '\n'
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename="conversation-{conversation.id}.ndjson"'}
+    )
+
 @app.route('/api/conversations/<conversation_id>/messages', methods=['POST'])
 def add_message(conversation_id):
     """Add a message to a conversation"""
@@ -169,10 +369,12 @@ def add_message(conversation_id):
         if not data or 'role' not in data or 'content' not in data:
             return jsonify({'error': 'role and content are required'}), 400
         
-        # Verify conversation exists
+        # Verify conversation exists; queued chat exchanges go first
+        write_behind.barrier(conversation_id)
         conversation = Conversation.query.get(conversation_id)
         if not conversation:
             return jsonify({'error': 'Conversation not found'}), 404
+        rehydrate(db.session, conversation)
         
         # Create new message
         message = Message(
@@ -182,7 +384,11 @@ def add_message(conversation_id):
         )
         
         db.session.add(message)
+        db.session.flush()
+        row = (message.id, message.role, message.content)
+        db.session.execute(activity_statement(conversation_id, 1, message.content))
         db.session.commit()
+        history_buffer.append(conversation_id, [row])
         
         return jsonify({
             'message': 'Message added successfully',
@@ -198,26 +404,45 @@ def add_message(conversation_id):
 
 @app.route('/api/users/<user_id>/conversations', methods=['GET'])
 def get_user_conversations(user_id):
-    """Get all conversations for a user"""
+    """
+    Get a page of a user's conversations, most recently active first.
+    Query parameters: limit (page size, capped) and cursor (next_cursor of
+    the previous page).
+    """
+    try:
+        limit = page_size(request.args.get('limit'), Config.CONVERSATIONS_PAGE_SIZE, Config.CONVERSATIONS_MAX_PAGE_SIZE)
+        cursor = request.args.get('cursor')
+        position = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     try:
         # Verify user exists
-        user = User.query.get(user_id)
+        user = db.session.get(User, user_id)
         if not user:
             return jsonify({'error': 'User not found'}), 404
+        write_behind.barrier()
+        
+        # One extra row tells whether another page follows
+        page = db.session.execute(conversation_page_statement(user_id, position, limit + 1)).scalars().all()
+        has_more = len(page) > limit
+        page = page[:limit]
         
         conversations = []
-        for conv in user.conversations:
+        for conv in page:
             conversations.append({
                 'id': conv.id,
                 'title': conv.title,
                 'created_at': conv.created_at.isoformat(),
                 'updated_at': conv.updated_at.isoformat(),
-                'message_count': len(conv.messages)
+                'message_count': conv.message_count,
+                'last_message_preview': conv.last_message_preview
             })
         
         return jsonify({
             'user_id': user_id,
-            'conversations': conversations
+            'conversations': conversations,
+            'next_cursor': encode_cursor(page[-1].updated_at, page[-1].id) if has_more else None
         })
         
     except Exception as e:
@@ -226,29 +451,80 @@ def get_user_conversations(user_id):
 # Database statistics endpoints for testing
 @app.route('/api/stats', methods=['GET'])
 def get_database_stats():
-    """Get database statistics"""
+    """
+    Get database statistics. mode=fast (default) serves maintained counters
+    and planner estimates; mode=exact serves background COUNT(*) results and
+    refreshes them when stale. Each number is reported with its source.
+    """
     try:
-        stats = {
-            'users': User.query.count(),
-            'conversations': Conversation.query.count(),
-            'messages': Message.query.count(),
-            'products': Product.query.count(),
-            'orders': Order.query.count(),
-            'order_items': OrderItem.query.count(),
-            'inventory_items': InventoryItem.query.count(),
-            'user_data': UserData.query.count(),
-            'distribution_centers': DistributionCenter.query.count()
-        }
+        mode = request.args.get('mode', 'fast')
+        refreshing = False
+        if mode == 'fast':
+            entries = fast_stats()
+        elif mode == 'exact':
+            entries, refreshing = exact_stats()
+        else:
+            return jsonify({'error': 'mode must be fast or exact'}), 400
+        
+        stats = {name: entry['value'] for name, entry in entries.items()}
+        stats['mode'] = mode
+        stats['sources'] = {name: entry['source'] for name, entry in entries.items()}
+        stats['as_of'] = {name: entry['as_of'] for name, entry in entries.items()}
+        if mode == 'exact':
+            stats['refreshing'] = refreshing
         
         return jsonify(stats)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Get hit/miss counters for the database context, LLM response and history caches"""
+    return jsonify({
+        'context_cache': context_cache.stats(),
+        'llm_response_cache': response_cache.stats() if response_cache else None,
+        'history_buffer': history_buffer.stats()
+    })
+
+def admin_allowed():
+    """Whether the request may use admin endpoints: ADMIN_TOKEN as a bearer token, or testing mode without one"""
+    token = app.config.get('ADMIN_TOKEN')
+    if token:
+        return hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    # DEBUG defaults to on, so it does not open admin endpoints by itself
+    return app.testing
+
+@app.route('/api/profiler/queries', methods=['GET', 'PUT'])
+def query_profiler_settings():
+    """Query profiler settings and the latest slow queries; PUT changes settings at runtime. Admin only."""
+    if not admin_allowed():
+        return jsonify({'error': 'admin access required'}), 403
+    if request.method == 'PUT':
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'a JSON object of settings is required'}), 400
+        try:
+            query_profiler.configure(**data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'settings': query_profiler.settings(),
+        'slow_queries': list(query_profiler.recent_slow)
+    })
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Process metrics in the Prometheus text format"""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
-    with app.app_context():
-        # Create all tables
-        db.create_all()
-        print("Database tables created successfully!")
+    # Development server; production runs under gunicorn (gunicorn.conf.py)
+    import serving
+    serving.prepare_database()
+    print("Database tables created successfully!")
+    
+    # Open connections and build caches before serving traffic
+    serving.warm_up(app, chat_service)
     
     app.run(debug=True, host='0.0.0.0', port=5000) 
\ No newline at end of file
@@ -0,0 +1,331 @@
+"""
+Lifecycle of stored messages. On PostgreSQL the messages table is split
+into monthly partitions (migration 7), created ahead of time here. Idle
+conversations are archived: their messages move into one compressed row
+of conversation_archives and come back transparently the next time the
+conversation is read. Conversations idle past the retention period are
+purged in small batches that only touch old rows.
+
+    python archive.py run            # partitions, archive and purge; schedule it daily
+    python archive.py archive [idle days]
+    python archive.py purge [retention days]
+    python archive.py partitions
+    python archive.py status
+"""
+import json
+import sys
+import time
+import zlib
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, update, delete, func, text
+from models import db, Conversation, Message, ConversationArchive
+from config import Config
+from history import iter_messages
+from metrics import Counter, Histogram
+
+CODEC = 'zlib-jsonl'
+
+archive_operations = Counter(
+    'conversation_archive_operations_total',
+    'Conversations archived, rehydrated and purged',
+    labelnames=('operation',)
+)
+rehydrate_seconds = Histogram(
+    'conversation_rehydrate_seconds',
+    'Time to restore the messages of an archived conversation'
+)
+
+messages_table = Message.__table__
+archives_table = ConversationArchive.__table__
+conversations_table = Conversation.__table__
+
+def pack(rows):
+    """Compressed JSON lines of message rows"""
+    lines = '\n'.join(
+        json.dumps([row.id, row.role, row.content, row.created_at.isoformat()], separators=(',', ':'))
+        for row in rows
+    )
+    return zlib.compress(lines.encode('utf-8'), Config.ARCHIVE_COMPRESSION_LEVEL)
+
+def unpack(conversation_id, payload):
+    """Message rows (dicts) of a packed archive"""
+    rows = []
+    for line in zlib.decompress(payload).decode('utf-8').splitlines():
+        message_id, role, content, created_at = json.loads(line)
+        rows.append({'id': message_id, 'conversation_id': conversation_id, 'role': role,
+                     'content': content, 'created_at': datetime.fromisoformat(created_at)})
+    return rows
+
+def month_start(moment):
+    return datetime(moment.year, moment.month, 1)
+
+def next_month(moment):
+    return datetime(moment.year + moment.month // 12, moment.month % 12 + 1, 1)
+
+def partition_name(month):
+    return f"messages_p{month:%Y_%m}"
+
+def is_partitioned(connection, table='messages'):
+    if connection.dialect.name != 'postgresql':
+        return False
+    return connection.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = :table AND pg_table_is_visible(c.oid)"
+    ), {'table': table}).first() is not None
+
+def ensure_partitions(connection, first_month=None, months_ahead=None, table='messages'):
+    """
+    Create the monthly partitions from first_month (default: this month)
+    through months_ahead months from now. Returns the names created.
+    """
+    months_ahead = Config.MESSAGE_PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    month = month_start(first_month or datetime.utcnow())
+    last = month_start(datetime.utcnow())
+    for _ in range(months_ahead):
+        last = next_month(last)
+    existing = set(connection.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = :table"
+    ), {'table': table}).scalars())
+    created = []
+    while month <= last:
+        name = partition_name(month)
+        if name not in existing:
+            connection.execute(text(
+                f"CREATE TABLE {name} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{next_month(month):%Y-%m-%d}')"
+            ))
+            created.append(name)
+        month = next_month(month)
+    return created
+
+def drop_empty_partitions(connection, before):
+    """
+    Drop the monthly partitions that end before a cutoff and hold no rows
+    any more. The brief lock on the parent is bounded by a lock timeout;
+    a partition that cannot get it is left for the next run.
+    """
+    dropped = []
+    names = connection.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = 'messages' AND c.relname LIKE 'messages_p%'"
+    )).scalars().all()
+    for name in sorted(names):
+        try:
+            month = datetime.strptime(name, 'messages_p%Y_%m')
+        except ValueError:
+            continue  # the default partition
+        if next_month(month) > before:
+            continue
+        empty = connection.execute(text(f"SELECT 1 FROM {name} LIMIT 1")).first() is None
+        connection.commit()
+        if not empty:
+            continue
+        try:
+            with connection.begin():
+                connection.execute(text("SET LOCAL lock_timeout = '2s'"))
+                connection.execute(text(f"ALTER TABLE messages DETACH PARTITION {name}"))
+                connection.execute(text(f"DROP TABLE {name}"))
+            dropped.append(name)
+        except Exception as e:
+            print(f"Could not drop partition {name}, will retry next run: {str(e)}")
+    return dropped
+
+def maintain_partitions():
+    """Create upcoming partitions; returns the names created"""
+    with db.engine.begin() as connection:
+        if not is_partitioned(connection):
+            return []
+        # Attaching locks the parent table; better to retry tomorrow than to queue requests behind it
+        connection.execute(text("SET LOCAL lock_timeout = '2s'"))
+        return ensure_partitions(connection)
+
+def archive_conversation(conversation_id, idle_before):
+    """
+    Move a conversation's messages into an archive row, unless it became
+    active again. Returns the number of messages archived, or None.
+    """
+    conversation = db.session.execute(
+        select(Conversation.id, Conversation.updated_at)
+        .where(Conversation.id == conversation_id, Conversation.archived_at.is_(None),
+               Conversation.updated_at < idle_before)
+        .with_for_update()
+    ).first()
+    if conversation is None:
+        return None
+    rows = list(iter_messages(conversation_id, Config.EXPORT_CHUNK_SIZE))
+    if rows:
+        db.session.execute(insert(archives_table).values(
+            conversation_id=conversation_id,
+            message_count=len(rows),
+            first_message_at=rows[0].created_at,
+            last_message_at=rows[-1].created_at,
+            codec=CODEC,
+            payload=pack(rows),
+            archived_at=datetime.utcnow()
+        ))
+        # The created_at bounds let PostgreSQL skip every partition outside them
+        db.session.execute(
+            delete(messages_table).where(
+                messages_table.c.conversation_id == conversation_id,
+                messages_table.c.created_at.between(rows[0].created_at, rows[-1].created_at)
+            )
+        )
+    db.session.execute(
+        update(conversations_table).where(conversations_table.c.id == conversation_id)
+        .values(archived_at=datetime.utcnow(), updated_at=conversation.updated_at)
+    )
+    return len(rows)
+
+def archive_idle_conversations(idle_days=None, batch_size=None):
+    """Archive conversations idle for more than idle_days, one transaction per batch; returns (conversations, messages)"""
+    idle_days = Config.ARCHIVE_IDLE_DAYS if idle_days is None else idle_days
+    batch_size = batch_size or Config.ARCHIVE_BATCH_SIZE
+    if idle_days <= 0:
+        return 0, 0
+    idle_before = datetime.utcnow() - timedelta(days=idle_days)
+    conversations = messages = 0
+    while True:
+        archived_before = conversations
+        candidates = db.session.execute(
+            select(Conversation.id)
+            .where(Conversation.archived_at.is_(None), Conversation.updated_at < idle_before,
+                   Conversation.message_count > 0)
+            .order_by(Conversation.updated_at)
+            .limit(batch_size)
+        ).scalars().all()
+        for conversation_id in candidates:
+            archived = archive_conversation(conversation_id, idle_before)
+            if archived is not None:
+                conversations += 1
+                messages += archived
+        db.session.commit()
+        archive_operations.inc(conversations - archived_before, operation='archived')
+        if len(candidates) < batch_size:
+            return conversations, messages
+        time.sleep(Config.PURGE_PAUSE)
+
+def rehydrate(session, conversation):
+    """
+    Put the messages of an archived conversation back, in the session's
+    transaction, and commit. Returns how many were restored; a conversation
+    that is not archived costs nothing. Concurrent calls restore it once:
+    only the one that deletes the archive row inserts the messages.
+    """
+    if conversation is None or conversation.archived_at is None:
+        return 0
+    started = time.perf_counter()
+    archive = session.execute(
+        delete(archives_table)
+        .where(archives_table.c.conversation_id == conversation.id)
+        .returning(archives_table.c.payload)
+    ).first()
+    rows = unpack(conversation.id, archive.payload) if archive is not None else []
+    for start in range(0, len(rows), 1000):
+        session.execute(insert(messages_table).values(rows[start:start + 1000]))
+    session.execute(
+        update(conversations_table).where(conversations_table.c.id == conversation.id)
+        .values(archived_at=None, updated_at=conversation.updated_at)
+    )
+    session.commit()
+    archive_operations.inc(operation='rehydrated')
+    rehydrate_seconds.observe(time.perf_counter() - started)
+    return len(rows)
+
+def purge_expired(retention_days=None, batch_size=None):
+    """
+    Delete conversations idle for more than retention_days, with their
+    messages and archives. Deletes run in batches of batch_size rows, each
+    its own short transaction, and only reach rows older than the cutoff,
+    so the current partition and the indexes of active conversations are
+    not locked. Returns (conversations, messages) deleted.
+    """
+    retention_days = Config.RETENTION_DAYS if retention_days is None else retention_days
+    batch_size = batch_size or Config.PURGE_BATCH_SIZE
+    if retention_days <= 0:
+        return 0, 0
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    conversations = messages = 0
+    while True:
+        expired = db.session.execute(
+            select(Conversation.id).where(Conversation.updated_at < cutoff)
+            .order_by(Conversation.updated_at).limit(batch_size)
+        ).scalars().all()
+        if not expired:
+            break
+        while True:
+            batch = select(messages_table.c.id).where(
+                messages_table.c.conversation_id.in_(expired), messages_table.c.created_at < cutoff
+            ).limit(batch_size)
+            deleted = db.session.execute(delete(messages_table).where(messages_table.c.id.in_(batch))).rowcount
+            db.session.commit()
+            messages += deleted
+            if deleted < batch_size:
+                break
+            time.sleep(Config.PURGE_PAUSE)
+        db.session.execute(delete(archives_table).where(archives_table.c.conversation_id.in_(expired)))
+        # A message written since the batch was read keeps its conversation
+        live = select(messages_table.c.conversation_id).where(messages_table.c.conversation_id.in_(expired))
+        conversations += db.session.execute(
+            delete(conversations_table).where(conversations_table.c.id.in_(expired),
+                                              conversations_table.c.updated_at < cutoff,
+                                              conversations_table.c.id.not_in(live))
+        ).rowcount
+        db.session.commit()
+        if len(expired) < batch_size:
+            break
+        time.sleep(Config.PURGE_PAUSE)
+    archive_operations.inc(conversations, operation='purged')
+
+    with db.engine.connect() as connection:
+        partitioned = is_partitioned(connection)
+        connection.commit()
+        if partitioned:
+            dropped = drop_empty_partitions(connection, month_start(cutoff))
+            if dropped:
+                print(f"Dropped empty partitions: {', '.join(dropped)}")
+    return conversations, messages
+
+def archive_status():
+    """Counts and sizes of the archive, and the message partitions"""
+    row = db.session.execute(select(
+        func.count(), func.coalesce(func.sum(ConversationArchive.message_count), 0),
+        func.coalesce(func.sum(func.length(ConversationArchive.payload)), 0)
+    )).first()
+    status = {'archived_conversations': row[0], 'archived_messages': row[1], 'archive_bytes': row[2], 'partitions': []}
+    with db.engine.connect() as connection:
+        if is_partitioned(connection):
+            status['partitions'] = connection.execute(text(
+                "SELECT c.relname, pg_total_relation_size(c.oid) FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+                "WHERE p.relname = 'messages' ORDER BY c.relname"
+            )).all()
+    return status
+
+if __name__ == "__main__":
+    from app import create_app
+    app = create_app(engine_options=Config.BATCH_ENGINE_OPTIONS)
+    command = sys.argv[1] if len(sys.argv) > 1 else 'run'
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    with app.app_context():
+        if command in ('run', 'partitions'):
+            created = maintain_partitions()
+            print(f"Created partitions: {', '.join(created) or 'none'}")
+        if command in ('run', 'archive'):
+            started = time.perf_counter()
+            conversations, messages = archive_idle_conversations(days if command == 'archive' else None)
+            print(f"Archived {conversations} conversations ({messages} messages) in {time.perf_counter() - started:.1f}s")
+        if command in ('run', 'purge'):
+            started = time.perf_counter()
+            conversations, messages = purge_expired(days if command == 'purge' else None)
+            print(f"Purged {conversations} conversations ({messages} messages) in {time.perf_counter() - started:.1f}s")
+        if command == 'status':
+            status = archive_status()
+            print(f"{status['archived_conversations']} archived conversations, {status['archived_messages']} messages "
+                  f"in {status['archive_bytes'] / 1024 / 1024:.1f} MB")
+            for name, size in status['partitions']:
+                print(f"  {name:24s} {size / 1024 / 1024:10.1f} MB")
+        if command not in ('run', 'archive', 'purge', 'partitions', 'status'):
+            print("Usage: python archive.py [run|archive|purge|partitions|status] [days]")
+            sys.exit(2)
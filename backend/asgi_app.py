@@ -0,0 +1,158 @@
+"""
+ASGI serving path for the chat API. The chat endpoints run on asyncio with an
+async database driver and an async HTTP client for the LLM, so a worker is
+not tied up while a reply is generated:
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5001 --workers 2
+
+Every other endpoint stays on the Flask app (app.py), which keeps working
+unchanged; route /api/chat and /api/chat/stream here from the proxy.
+"""
+import json
+import time
+import contextlib
+from datetime import datetime
+from sqlalchemy import text
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from config import Config
+from async_chat import AsyncChatService
+from llm_cache import response_cache
+from history import history_buffer
+from metrics import registry
+from tracing import TracingMiddleware
+from query_profiler import query_profiler
+
+chat_service = None
+query_profiler.install()
+
+def request_deadline(request):
+    """Same deadline rules as app.request_deadline"""
+    budget = Config.CHAT_REQUEST_DEADLINE
+    try:
+        budget = min(budget, float(request.headers.get('X-Request-Timeout', budget)))
+    except ValueError:
+        pass
+    return time.monotonic() + max(budget, 0)
+
+async def read_chat_request(request):
+    """Parsed chat request body, or None if it has no message"""
+    try:
+        data = await request.json()
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or 'message' not in data:
+        return None
+    return data
+
+async def health_check(request):
+    """Health check endpoint"""
+    try:
+        async with chat_service.engine.connect() as connection:
+            await connection.execute(text('SELECT 1'))
+        db_status = 'connected'
+    except Exception as e:
+        db_status = f'error: {str(e)}'
+
+    return JSONResponse({
+        'status': 'healthy',
+        'message': 'Conversational AI async chat service is running',
+        'database': db_status,
+        'timestamp': datetime.utcnow().isoformat()
+    })
+
+async def chat(request):
+    """Primary chat endpoint - accepts user message and optional conversation_id"""
+    try:
+        data = await read_chat_request(request)
+        if not data:
+            return JSONResponse({'error': 'message is required'}, status_code=400)
+
+        result = await chat_service.process_chat_message_async(
+            user_message=data['message'],
+            conversation_id=data.get('conversation_id'),
+            user_id=data.get('user_id'),
+            deadline=request_deadline(request)
+        )
+
+        if isinstance(result, tuple):
+            return JSONResponse(result[0], status_code=result[1])
+        return JSONResponse(result)
+
+    except Exception as e:
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+async def chat_stream(request):
+    """Streaming chat endpoint - relays the AI response as Server-Sent Events"""
+    try:
+        data = await read_chat_request(request)
+        if not data:
+            return JSONResponse({'error': 'message is required'}, status_code=400)
+
+        result = await chat_service.stream_chat_message_async(
+            user_message=data['message'],
+            conversation_id=data.get('conversation_id'),
+            user_id=data.get('user_id'),
+            deadline=request_deadline(request)
+        )
+
+        if isinstance(result, tuple):
+            return JSONResponse(result[0], status_code=result[1])
+
+        async def generate():
+            async for event in result:
+                yield f"event: {event.pop('type')}\ndata: {json.dumps(event)}\n\n"
+
+        return StreamingResponse(
+            generate(),
+            media_type='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
+    except Exception as e:
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+async def get_cache_stats(request):
+    """Get hit/miss counters for this worker's context, LLM response and history caches"""
+    return JSONResponse({
+        'context_cache': chat_service.context_cache.stats(),
+        'llm_response_cache': response_cache.stats() if response_cache else None,
+        'history_buffer': history_buffer.stats()
+    })
+
+async def get_metrics(request):
+    """Process metrics in the Prometheus text format"""
+    return Response(registry.render(), media_type='text/plain; version=0.0.4')
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    global chat_service
+    chat_service = AsyncChatService()
+    try:
+        yield
+    finally:
+        await chat_service.close()
+
+routes = [
+    Route('/api/health', health_check, methods=['GET']),
+    Route('/api/chat', chat, methods=['POST']),
+    Route('/api/chat/stream', chat_stream, methods=['POST']),
+    Route('/api/cache/stats', get_cache_stats, methods=['GET']),
+    Route('/api/metrics', get_metrics, methods=['GET']),
+]
+
+app = Starlette(
+    routes=routes,
+    middleware=[
+        Middleware(TracingMiddleware, routes=[route.path for route in routes]),
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])
+    ],
+    lifespan=lifespan
+)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run('asgi_app:app', host='0.0.0.0', port=5001)
@@ -0,0 +1,380 @@
+import asyncio
+import time
+from datetime import datetime
+import anyio
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from models import User, Conversation, Product, ProductSalesStat, AggregateTotal, CacheVersion, InventoryItem
+from config import Config
+from chat_service import ChatService
+from llm_service import AsyncLLMService
+from cache import LRUCache, DATASET_VERSION
+from aggregates import AVAILABLE_INVENTORY
+from metrics import chat_stream_ttft, chat_streams
+from tracing import span, traced, clear_trace
+from history import history_buffer, newest_message_statement, window_statement, as_history
+from persistence import Exchange, exchange_statements, new_conversation, pending_row, chat_write_latency
+from archive import rehydrate
+from snapshot import analytics_snapshot
+from summaries import (needs_summary, conversation_summaries, summary_state_statement, summary_position_statement,
+                       pending_messages_statement, store_summary_statement, as_messages)
+
+# Async drivers for the sync database URLs used by the Flask app
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'postgresql+psycopg2': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+def async_database_url(url):
+    """The configured database URL with its driver swapped for an asyncio one"""
+    scheme, sep, rest = url.partition('://')
+    return ASYNC_DRIVERS.get(scheme, scheme) + sep + rest
+
+def create_engine_for(url):
+    options = {}
+    if not url.startswith('sqlite'):
+        options = {
+            'pool_size': Config.ASYNC_DB_POOL_SIZE,
+            'max_overflow': Config.ASYNC_DB_MAX_OVERFLOW,
+            'pool_timeout': Config.DB_POOL_TIMEOUT,
+            'pool_recycle': Config.DB_POOL_RECYCLE,
+            'pool_pre_ping': True
+        }
+        if Config.DB_STATEMENT_TIMEOUT_MS and url.startswith('postgresql'):
+            options['connect_args'] = {'server_settings': {'statement_timeout': str(Config.DB_STATEMENT_TIMEOUT_MS)}}
+    return create_async_engine(async_database_url(url), **options)
+
+class AsyncContextCache(LRUCache):
+    """
+    LRUCache of context strings that follows the dataset version counter,
+    like cache.context_cache, but reads the counter over the async engine.
+    """
+
+    def __init__(self, max_size, ttl, check_interval=None):
+        super().__init__(max_size, ttl)
+        self.check_interval = Config.CACHE_VERSION_CHECK_INTERVAL if check_interval is None else check_interval
+        self.version = None
+        self._next_check = 0.0
+
+    async def check_version(self, session):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+
+        try:
+            version = (await session.execute(
+                select(CacheVersion.version).where(CacheVersion.name == DATASET_VERSION)
+            )).scalar() or 0
+        except Exception as e:
+            print(f"Error reading cache version {DATASET_VERSION}: {str(e)}")
+            return
+        if version != self.version:
+            self.clear()
+            self.version = version
+
+    def stats(self):
+        stats = super().stats()
+        stats['version'] = self.version
+        return stats
+
+class AsyncChatService(ChatService):
+    """
+    asyncio variant of ChatService for the ASGI app. Database work runs on an
+    async engine and the LLM call on an async HTTP client; no database
+    connection is held while waiting for the LLM, so one worker can keep
+    thousands of chats in flight with a small connection pool.
+    """
+
+    def __init__(self, database_url=None):
+        self.llm_service = AsyncLLMService()
+        self.engine = create_engine_for(database_url or Config.SQLALCHEMY_DATABASE_URI)
+        self.sessions = async_sessionmaker(self.engine, expire_on_commit=False)
+        self.context_cache = AsyncContextCache(Config.CONTEXT_CACHE_SIZE, Config.CONTEXT_CACHE_TTL)
+        self.summary_tasks = {}  # conversation id -> running summary update
+
+    async def close(self):
+        for task in list(self.summary_tasks.values()):
+            task.cancel()
+        await self.llm_service.aclose()
+        await self.engine.dispose()
+
+    async def process_chat_message_async(self, user_message, conversation_id=None, user_id=None, deadline=None):
+        """Async counterpart of process_chat_message"""
+        try:
+            asked_at = datetime.utcnow()
+            prepared, error = await self._prepare(user_message, conversation_id, user_id)
+            if error:
+                return error
+            conversation, conversation_history, missing_info, context, prompt, counts = prepared
+            conversation_id = conversation.id
+
+            if missing_info:
+                ai_response = await self.llm_service.ask_clarifying_question_async(user_message, missing_info, deadline=deadline)
+            else:
+                ai_response = await self.llm_service.generate_response_async(
+                    user_message=user_message,
+                    conversation_history=conversation_history,
+                    context=context,
+                    deadline=deadline,
+                    prompt=prompt
+                )
+
+            exchange = await self._save_exchange_async(conversation, user_message, ai_response, asked_at)
+            self._summarize_if_needed(conversation_id, counts, len(exchange.messages), prompt)
+
+            return {
+                "conversation_id": conversation_id,
+                "user_message": user_message,
+                "ai_response": ai_response,
+                "prompt_tokens": prompt.report() if prompt else None,
+                "write_ms": exchange.write_ms,
+                "analytics": analytics_snapshot.report(),
+                "timestamp": datetime.utcnow().isoformat()
+            }
+
+        except Exception as e:
+            return {"error": str(e)}, 500
+
+    async def stream_chat_message_async(self, user_message, conversation_id=None, user_id=None, deadline=None):
+        """
+        Async counterpart of stream_chat_message: returns an async generator of
+        events or an (error, status) tuple.
+        """
+        try:
+            started = time.perf_counter()
+            asked_at = datetime.utcnow()
+            prepared, error = await self._prepare(user_message, conversation_id, user_id)
+            if error:
+                return error
+            conversation, conversation_history, missing_info, context, prompt, counts = prepared
+
+            if missing_info:
+                chunks = self._single_chunk(
+                    self.llm_service.ask_clarifying_question_async(user_message, missing_info, deadline=deadline)
+                )
+            else:
+                chunks = self.llm_service.stream_response_async(
+                    user_message=user_message,
+                    conversation_history=conversation_history,
+                    context=context,
+                    deadline=deadline,
+                    prompt=prompt
+                )
+
+            return self._relay_stream_async(conversation, user_message, chunks, started, prompt, counts, asked_at)
+
+        except Exception as e:
+            return {"error": str(e)}, 500
+
+    async def _prepare(self, user_message, conversation_id, user_id):
+        """
+        Resolve the conversation and gather history and context in one short
+        session, then pack the prompt. Returns ((conversation, history,
+        missing_info, context, prompt, counts), None) or (None, (error, status)).
+        """
+        async with self.sessions() as session:
+            conversation, error = await self._resolve_conversation_async(session, conversation_id, user_id)
+            if error:
+                return None, error
+            counts = self._summary_counts(conversation)
+            conversation_history = []
+            if pending_row(conversation) is None:
+                conversation_history = await self._conversation_history_async(session, conversation.id)
+
+            missing_info = self._check_missing_information(user_message)
+            context = None
+            prompt = None
+            if not missing_info:
+                context = await self._get_database_context_async(session, user_message)
+                prompt = self._pack_prompt(conversation, user_message, conversation_history, context)
+            return (conversation, conversation_history, missing_info, context, prompt, counts), None
+
+    async def _single_chunk(self, awaitable):
+        yield await awaitable
+
+    async def _relay_stream_async(self, conversation, user_message, chunks, started, prompt=None, counts=(0, 0), asked_at=None):
+        """Async counterpart of _relay_stream"""
+        conversation_id = conversation.id
+        parts = []
+        ttft = None
+        saved = False
+        try:
+            yield {'type': 'start', 'conversation_id': conversation_id}
+
+            with span('llm.stream'):
+                async for delta in chunks:
+                    if ttft is None:
+                        ttft = time.perf_counter() - started
+                        chat_stream_ttft.observe(ttft)
+                    parts.append(delta)
+                    yield {'type': 'delta', 'content': delta}
+
+            exchange = await self._save_exchange_async(conversation, user_message, ''.join(parts), asked_at)
+            saved = True
+            chat_streams.inc(outcome='completed')
+            self._summarize_if_needed(conversation_id, counts, len(exchange.messages), prompt)
+
+            yield {
+                'type': 'done',
+                'conversation_id': conversation_id,
+                'ttft_ms': round(ttft * 1000, 1) if ttft is not None else None,
+                'prompt_tokens': prompt.report() if prompt else None,
+                'write_ms': exchange.write_ms,
+                'analytics': analytics_snapshot.report(),
+                'timestamp': datetime.utcnow().isoformat()
+            }
+        finally:
+            # A client disconnect cancels this task; shield the cleanup so the partial exchange is still saved
+            with anyio.CancelScope(shield=True):
+                await chunks.aclose()
+                if not saved:
+                    chat_streams.inc(outcome='cancelled')
+                    try:
+                        await self._save_exchange_async(conversation, user_message, ''.join(parts), asked_at)
+                    except Exception as e:
+                        print(f"Error saving cancelled stream: {str(e)}")
+
+    @traced('chat.save_exchange')
+    async def _save_exchange_async(self, conversation, user_message, ai_response, asked_at=None):
+        """
+        Async counterpart of _save_exchange. Always writes through: the
+        write-behind flusher belongs to the Flask app.
+        """
+        exchange = Exchange.build(conversation.id, user_message, ai_response, asked_at,
+                                  conversation=pending_row(conversation))
+        started = time.perf_counter()
+        async with self.sessions() as session:
+            for statement, parameters in exchange_statements(self.engine.dialect.name, [exchange]):
+                await session.execute(statement, parameters)
+            await session.commit()
+        elapsed = time.perf_counter() - started
+        chat_write_latency.observe(elapsed, mode='sync')
+        exchange.write_ms = round(elapsed * 1000, 2)
+        history_buffer.append(conversation.id, exchange.history_rows())
+        return exchange
+
+    def _summarize_if_needed(self, conversation_id, counts, written, prompt):
+        """Start a summary update as a background task instead of on the Flask summarizer's threads"""
+        message_count, summary_message_count = counts
+        dropped = prompt.dropped_messages if prompt else 0
+        if needs_summary(message_count + written, summary_message_count, dropped) and conversation_id not in self.summary_tasks:
+            task = asyncio.create_task(self._summarize_async(conversation_id))
+            self.summary_tasks[conversation_id] = task
+            task.add_done_callback(lambda _: self.summary_tasks.pop(conversation_id, None))
+
+    async def _summarize_async(self, conversation_id):
+        """Async counterpart of ConversationSummarizer: fold batches until only the kept tail is left"""
+        # The task runs in a copy of the request's context; keep its work out of that trace
+        clear_trace()
+        try:
+            while await self._summarize_batch_async(conversation_id):
+                pass
+        except Exception as e:
+            conversation_summaries.inc(outcome='error')
+            print(f"Error summarizing conversation {conversation_id}: {str(e)}")
+
+    async def _summarize_batch_async(self, conversation_id):
+        async with self.sessions() as session:
+            conversation = (await session.execute(summary_state_statement(conversation_id))).first()
+            if conversation is None:
+                return False
+            position = None
+            if conversation.summary_last_message_id:
+                position = (await session.execute(summary_position_statement(conversation.summary_last_message_id))).first()
+            statement = pending_messages_statement(conversation, position)
+            rows = (await session.execute(statement)).all() if statement is not None else []
+        if not rows:
+            return False
+
+        summary = await self.llm_service.summarize_async(conversation.summary, as_messages(rows))
+        async with self.sessions() as session:
+            stored = (await session.execute(store_summary_statement(conversation, summary, rows))).rowcount
+            await session.commit()
+        conversation_summaries.inc(outcome='stored' if stored else 'conflict')
+        return bool(stored)
+
+    @traced('chat.resolve_conversation')
+    async def _resolve_conversation_async(self, session, conversation_id, user_id):
+        """Async counterpart of _resolve_conversation"""
+        if not conversation_id and user_id:
+            if await session.get(User, user_id) is None:
+                return None, ({"error": "User not found"}, 404)
+            conversation = new_conversation(user_id)
+        elif conversation_id:
+            conversation = await session.get(Conversation, conversation_id)
+            if not conversation:
+                return None, ({"error": "Conversation not found"}, 404)
+            if conversation.archived_at is not None:
+                await session.run_sync(rehydrate, conversation)
+        else:
+            return None, ({"error": "Either conversation_id or user_id is required"}, 400)
+        return conversation, None
+
+    @traced('chat.history')
+    async def _conversation_history_async(self, session, conversation_id):
+        """Async counterpart of history.recent_history"""
+        newest_id = (await session.execute(newest_message_statement(conversation_id))).scalar()
+        if newest_id is None:
+            return []
+        rows = history_buffer.get(conversation_id, newest_id)
+        if rows is None:
+            rows = (await session.execute(window_statement(conversation_id, history_buffer.window))).all()
+            rows = [tuple(row) for row in reversed(rows)]
+            history_buffer.put(conversation_id, rows)
+        return as_history(rows)
+
+    @traced('chat.database_context')
+    async def _get_database_context_async(self, session, user_message):
+        """Async counterpart of _get_database_context"""
+        try:
+            await self.context_cache.check_version(session)
+            context_parts = []
+            for key in self._context_keys(user_message):
+                found, value = self.context_cache.get(key)
+                if not found:
+                    value = await self._build_context_async(session, key)
+                    self.context_cache.set(key, value)
+                context_parts.append(value)
+            return self._join_context(context_parts)
+
+        except Exception as e:
+            print(f"Error getting database context: {str(e)}")
+            return None
+
+    async def _build_context_async(self, session, key):
+        snapshot = analytics_snapshot.current()
+        if snapshot is not None:
+            # In-process array operations; no database round trip to await
+            return self._build_context(key, snapshot)
+        kind, *args = key
+        if kind == 'top_products':
+            rows = (await session.execute(
+                select(Product.name, Product.brand, ProductSalesStat.sales_count)
+                .join(Product, Product.id == ProductSalesStat.product_id)
+                .order_by(ProductSalesStat.sales_count.desc())
+                .limit(args[0])
+            )).all()
+            return self._format_top_products(rows)
+
+        if kind == 'categories':
+            rows = (await session.execute(
+                select(Product.category, func.count(Product.id).label('count'))
+                .where(Product.category.isnot(None))
+                .group_by(Product.category)
+                .order_by(func.count(Product.id).desc())
+                .limit(args[0])
+            )).all()
+            return self._format_categories(rows)
+
+        totals = dict((await session.execute(
+            select(AggregateTotal.name, AggregateTotal.value).where(AggregateTotal.name.in_([
+                Product.__tablename__, InventoryItem.__tablename__, AVAILABLE_INVENTORY
+            ]))
+        )).all())
+        return self._format_inventory({
+            'products': totals.get(Product.__tablename__, 0),
+            'inventory_items': totals.get(InventoryItem.__tablename__, 0),
+            'available': totals.get(AVAILABLE_INVENTORY, 0)
+        })
@@ -0,0 +1,110 @@
+"""
+Analytic chat context (top products, categories, brands, inventory) from
+the database against the columnar snapshot of snapshot.py. Loads a
+synthetic dataset through load_data.py, exports the snapshot, then times
+every query three ways:
+
+- group-by: aggregation over the row tables (order_items, inventory_items)
+- aggregates: the maintained aggregate tables ChatService reads by default
+- snapshot: NumPy/pandas over the memory-mapped Arrow files (first call,
+  which maps the files and derives the arrays, reported separately)
+
+    python benchmarks/bench_analytics.py --products 20000
+    python benchmarks/bench_analytics.py --database-url postgresql://localhost/bench
+"""
+import argparse
+import os
+import tempfile
+import time
+import common
+
+def group_by_queries(limit):
+    """The same answers computed from the row tables"""
+    from sqlalchemy import func
+    from models import db, Product, OrderItem, InventoryItem
+    return {
+        'top products': lambda: db.session.query(Product.name, Product.brand, Product.category, func.count(OrderItem.id))
+            .join(Product, Product.id == OrderItem.product_id).group_by(Product.id)
+            .order_by(func.count(OrderItem.id).desc()).limit(limit).all(),
+        'categories': lambda: db.session.query(Product.category, func.count(Product.id))
+            .filter(Product.category.isnot(None)).group_by(Product.category)
+            .order_by(func.count(Product.id).desc()).limit(limit).all(),
+        'product inventory': lambda: db.session.query(
+            func.count(InventoryItem.id), func.count(InventoryItem.id).filter(InventoryItem.sold_at.is_(None))
+        ).filter(InventoryItem.product_id == 1).one(),
+        'inventory summary': lambda: (db.session.query(func.count(Product.id)).scalar(),
+                                      db.session.query(func.count(InventoryItem.id)).scalar(),
+                                      db.session.query(func.count(InventoryItem.id))
+                                      .filter(InventoryItem.sold_at.is_(None)).scalar()),
+    }
+
+def source_queries(source, limit):
+    """The queries ChatService sends to an analytics source (aggregates module or Snapshot)"""
+    return {
+        'top products': lambda: source.top_selling_products(limit),
+        'categories': lambda: source.top_categories(limit),
+        'product inventory': lambda: source.product_inventory(1),
+        'inventory summary': lambda: source.inventory_summary(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=10000, help='catalog size; other tables scale with it')
+    parser.add_argument('--limit', type=int, default=5)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--database-url', help='benchmark on this (empty) database instead of SQLite')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.database_url:
+            os.environ['DATABASE_URL'] = args.database_url
+        else:
+            common.use_sqlite(os.path.join(tmp, 'analytics.db'))
+        os.environ['ANALYTICS_SNAPSHOT_DIR'] = os.path.join(tmp, 'snapshot')
+
+        from app import app
+        from models import db
+        from migrations import run_migrations
+        import aggregates
+        import load_data
+        from snapshot import export_snapshot, read_manifest, Snapshot, snapshot_status
+        from config import Config
+
+        with app.app_context():
+            db.create_all()
+            run_migrations()
+            dataset_dir = os.path.join(tmp, 'dataset')
+            os.makedirs(dataset_dir)
+            counts = common.write_synthetic_dataset(dataset_dir, args.products, seed=args.seed)
+            for name, loader in [('products.csv', load_data.load_products), ('orders.csv', load_data.load_orders),
+                                 ('order_items.csv', load_data.load_order_items),
+                                 ('inventory_items.csv', load_data.load_inventory_items)]:
+                loader(os.path.join(dataset_dir, name))
+            db.session.commit()
+            print(f"Dataset: {counts}")
+
+            started = time.perf_counter()
+            export_snapshot()
+            status = snapshot_status()
+            print(f"Snapshot export: {time.perf_counter() - started:.2f}s, {status['bytes'] / 1024 / 1024:.1f} MB")
+
+            directory = Config.ANALYTICS_SNAPSHOT_DIR
+            started = time.perf_counter()
+            snapshot = Snapshot(directory, read_manifest(directory))
+            for query in source_queries(snapshot, args.limit).values():
+                query()
+            print(f"Snapshot first use (map files, derive arrays): {(time.perf_counter() - started) * 1000:.1f}ms")
+
+            sources = {
+                'group-by': group_by_queries(args.limit),
+                'aggregates': source_queries(aggregates, args.limit),
+                'snapshot': source_queries(snapshot, args.limit),
+            }
+            for query in sources['snapshot']:
+                print(f"\n{query}")
+                for name, queries in sources.items():
+                    common.print_summary(f'  {name}', common.measure(queries[query], args.iterations))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Load test of the chat endpoint on the async (ASGI) serving path against the
+synchronous Flask app. Both servers talk to the local fake LLM provider with
+a fixed latency and to the same SQLite database; the script fires waves of
+concurrent POST /api/chat requests and reports throughput, latency
+percentiles and the server's resident memory.
+
+    python benchmarks/bench_async_chat.py --concurrency 50 200 500 --llm-latency 0.5
+
+Pass --targets async to skip the Flask server, e.g. when measuring the async
+path alone at high concurrency.
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import common
+
+import httpx
+
+def server_command(target, port):
+    if target == 'async':
+        return [sys.executable, '-m', 'uvicorn', 'asgi_app:app', '--host', '127.0.0.1',
+                '--port', str(port), '--log-level', 'warning', '--no-access-log']
+    return [sys.executable, '-c',
+            f"from app import app; app.run(host='127.0.0.1', port={port}, threaded=True)"]
+
+def seed_database(path):
+    """Create the schema and one user to chat as"""
+    common.use_sqlite(path)
+    from app import app
+    from models import db, User
+    with app.app_context():
+        db.create_all()
+        user = User(email='bench@example.com', first_name='Bench')
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+async def fire(base_url, user_id, concurrency):
+    """Send one request per concurrent client; returns (latencies_ms, errors, wall_seconds)"""
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        async def one(i):
+            started = time.perf_counter()
+            response = await client.post('/api/chat', json={
+                'message': f'What are your most popular products? ({i})', 'user_id': user_id
+            })
+            ok = response.status_code == 200 and 'ai_response' in response.json()
+            return (time.perf_counter() - started) * 1000, ok
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(one(i) for i in range(concurrency)), return_exceptions=True)
+        wall = time.perf_counter() - started
+
+    latencies = [r[0] for r in results if not isinstance(r, BaseException) and r[1]]
+    return latencies, len(results) - len(latencies), wall
+
+async def sample_rss(pid, peak, stop):
+    while not stop.is_set():
+        peak[0] = max(peak[0], common.rss_mb(pid))
+        await asyncio.sleep(0.05)
+
+async def run_target(target, port, pid, user_id, concurrency_levels):
+    base_url = f'http://127.0.0.1:{port}'
+    common.wait_for(f'{base_url}/api/health')
+    await fire(base_url, user_id, 5)  # warm up connections, caches and imports
+
+    print(f"\n{target} server (idle RSS {common.rss_mb(pid):.1f} MB)")
+    for concurrency in concurrency_levels:
+        peak, stop = [0.0], asyncio.Event()
+        sampler = asyncio.create_task(sample_rss(pid, peak, stop))
+        latencies, errors, wall = await fire(base_url, user_id, concurrency)
+        stop.set()
+        await sampler
+        s = common.summarize(latencies)
+        print(f"  c={concurrency:<5d} {len(latencies) / wall:8.1f} req/s  p50={s['p50_ms']:8.1f}ms "
+              f"p95={s['p95_ms']:8.1f}ms p99={s['p99_ms']:8.1f}ms  errors={errors:<4d} peak RSS={peak[0]:.1f} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='fake LLM seconds per completion')
+    parser.add_argument('--targets', nargs='+', choices=['async', 'sync'], default=['async', 'sync'])
+    args = parser.parse_args()
+
+    # The fake provider gets its own process so it does not compete with the load generator
+    llm_server, llm_url = common.start_fake_llm(args.llm_latency)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        user_id = seed_database(db_path)
+        env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_path}', GROQ_API_URL=llm_url,
+                   GROQ_API_KEY='fake', DEBUG='False', LLM_BREAKER_THRESHOLD='1000000',
+                   LLM_CACHE_ENABLED='False')
+
+        for target in args.targets:
+            port = common.free_port()
+            process = subprocess.Popen(server_command(target, port), cwd=common.BACKEND_DIR, env=env,
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                asyncio.run(run_target(target, port, process.pid, user_id, args.concurrency))
+            finally:
+                common.stop(process)
+
+    common.stop(llm_server)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Per-turn cost of loading conversation history as a conversation grows.
+Compares the old relationship load (conversation.messages[-10:]) with the
+keyset window query alone and with the ring buffer in front of it.
+
+    python benchmarks/bench_history.py --sizes 10 100 1000 5000
+"""
+import argparse
+import uuid
+from datetime import datetime, timedelta
+import common
+
+common.use_sqlite()
+
+from app import app
+from models import db, User, Conversation, Message
+from migrations import run_migrations
+from history import history_buffer, recent_history
+
+def grow(conversation_id, start, count):
+    """Append count alternating user/assistant messages after message number start"""
+    base = datetime(2024, 1, 1)
+    db.session.execute(Message.__table__.insert(), [
+        {
+            'id': str(uuid.uuid4()),
+            'conversation_id': conversation_id,
+            'role': 'user' if i % 2 == 0 else 'assistant',
+            'content': f"message {i} " + 'lorem ipsum ' * 20,
+            'created_at': base + timedelta(seconds=i)
+        }
+        for i in range(start, start + count)
+    ])
+    db.session.commit()
+
+def relationship_history(conversation_id):
+    conversation = db.session.get(Conversation, conversation_id)
+    return [{'role': m.role, 'content': m.content} for m in conversation.messages[-10:]]
+
+def keyset_history(conversation_id):
+    history_buffer.put(conversation_id, [('', '', '')])  # force a window reload
+    return recent_history(conversation_id)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 5000])
+    parser.add_argument('--iterations', type=int, default=50)
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        run_migrations()
+        user = User(email='history@example.com')
+        conversation = Conversation(user=user, title='Long thread')
+        db.session.add_all([user, conversation])
+        db.session.commit()
+        conversation_id = conversation.id
+
+        size = 0
+        for target in sorted(args.sizes):
+            grow(conversation_id, size, target - size)
+            size = target
+            print(f"\n{size} messages")
+
+            def fresh(fn):
+                # Every turn is a new request with an empty identity map
+                def turn():
+                    db.session.remove()
+                    fn(conversation_id)
+                return turn
+
+            expected = relationship_history(conversation_id)
+            assert keyset_history(conversation_id) == expected == recent_history(conversation_id)
+            common.print_summary('  relationship load, slice [-10:]', common.measure(fresh(relationship_history), args.iterations))
+            common.print_summary('  keyset window query', common.measure(fresh(keyset_history), args.iterations))
+            common.print_summary('  ring buffer (validated)', common.measure(fresh(recent_history), args.iterations))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+Message ids: random UUIDv4 text (the old scheme) against time-ordered
+UUIDv7, as text and stored natively (models.UUIDString: uuid on PostgreSQL,
+16 bytes elsewhere). Every scheme gets its own copy of the messages table
+with the keyset index, filled with messages spread over many conversations
+the way chats arrive, then read back:
+
+- insert rate as the table grows (random ids scatter writes over the whole
+  primary key index; time-ordered ones append to its right edge)
+- size on disk (SQLite) or of the table and its indexes (PostgreSQL)
+- point lookups by id, the latest page of a conversation and the newest 1%
+  of all messages (an id range for v7, a created_at scan for v4)
+
+    python benchmarks/bench_ids.py --messages 1000000 --cache-mb 16
+    python benchmarks/bench_ids.py --database-url postgresql://localhost/bench
+
+A small SQLite page cache (--cache-mb) shows what happens once the index no
+longer fits in memory.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+import common
+
+from sqlalchemy import (create_engine, event, MetaData, Table, Column, String, Text, DateTime, Index,
+                        select, insert, func, text)
+from models import UUIDString, uuid7
+
+SCHEMES = {
+    'uuid4-text': (lambda: String(36), lambda: str(uuid.uuid4())),
+    'uuid7-text': (lambda: String(36), lambda: str(uuid7())),
+    'uuid7-native': (UUIDString, lambda: str(uuid7())),
+}
+
+def messages_table(metadata, scheme):
+    id_type = SCHEMES[scheme][0]
+    name = 'messages_' + scheme.replace('-', '_')
+    return Table(
+        name, metadata,
+        Column('id', id_type(), primary_key=True),
+        Column('conversation_id', id_type(), nullable=False),
+        Column('role', String(20), nullable=False),
+        Column('content', Text, nullable=False),
+        Column('created_at', DateTime),
+        Index(f'ix_{name}_keyset', 'conversation_id', 'created_at', 'id'),
+    )
+
+def engine_for(args, tmp, scheme):
+    if args.database_url:
+        return create_engine(args.database_url)
+    engine = create_engine(f"sqlite:///{os.path.join(tmp, scheme + '.db')}")
+
+    @event.listens_for(engine, 'connect')
+    def pragmas(dbapi_connection, record):
+        dbapi_connection.execute(f'PRAGMA cache_size = -{args.cache_mb * 1024}')
+        dbapi_connection.execute('PRAGMA journal_mode = WAL')
+        dbapi_connection.execute('PRAGMA synchronous = NORMAL')
+    return engine
+
+def fill(engine, table, scheme, args):
+    """Insert the messages in transactions of args.batch; returns per-tenth insert rates and sample rows"""
+    make_id = SCHEMES[scheme][1]
+    rng = random.Random(args.seed)
+    conversations = [make_id() for _ in range(args.conversations)]
+    base = datetime(2024, 1, 1)
+    content = 'lorem ipsum dolor sit amet ' * 8
+    rates = []
+    samples = []
+    tenth = max(args.messages // 10, args.batch)
+    tenth_started = time.perf_counter()
+    tenth_rows = 0
+    for start in range(0, args.messages, args.batch):
+        rows = []
+        for i in range(start, min(start + args.batch, args.messages)):
+            rows.append({'id': make_id(), 'conversation_id': rng.choice(conversations),
+                         'role': 'user' if i % 2 == 0 else 'assistant', 'content': content,
+                         'created_at': base + timedelta(milliseconds=i)})
+        with engine.begin() as connection:
+            connection.execute(insert(table), rows)
+        if rng.random() < 0.05:
+            samples.append(rows[rng.randrange(len(rows))])
+        tenth_rows += len(rows)
+        if tenth_rows >= tenth or start + args.batch >= args.messages:
+            rates.append(tenth_rows / (time.perf_counter() - tenth_started))
+            tenth_started = time.perf_counter()
+            tenth_rows = 0
+    return rates, samples
+
+def storage_mb(engine, table):
+    with engine.connect() as connection:
+        if engine.dialect.name == 'postgresql':
+            size = connection.execute(select(func.pg_total_relation_size(table.name))).scalar()
+        else:
+            page_size = connection.exec_driver_sql('PRAGMA page_size').scalar()
+            size = connection.exec_driver_sql('PRAGMA page_count').scalar() * page_size
+    return size / 1024 / 1024
+
+def reads(engine, table, scheme, samples, args):
+    """Latencies of the read patterns, in milliseconds"""
+    rng = random.Random(args.seed)
+    results = {}
+    with engine.connect() as connection:
+        results['point lookup by id'] = common.measure(
+            lambda: connection.execute(select(table.c.content).where(table.c.id == rng.choice(samples)['id'])).first(),
+            args.iterations)
+        results['latest page of a conversation'] = common.measure(
+            lambda: connection.execute(
+                select(table.c.id, table.c.role, table.c.content)
+                .where(table.c.conversation_id == rng.choice(samples)['conversation_id'])
+                .order_by(table.c.created_at.desc(), table.c.id.desc())
+                .limit(50)
+            ).all(),
+            args.iterations)
+
+        count = connection.execute(select(func.count()).select_from(table)).scalar()
+        offset = int(count * 0.99)
+        if scheme.startswith('uuid7'):
+            # Time-ordered ids make "newest" a primary key range
+            bound = connection.execute(select(table.c.id).order_by(table.c.id).offset(offset).limit(1)).scalar()
+            newest = select(func.count()).select_from(table).where(table.c.id >= bound)
+        else:
+            bound = connection.execute(select(table.c.created_at).order_by(table.c.created_at).offset(offset).limit(1)).scalar()
+            newest = select(func.count()).select_from(table).where(table.c.created_at >= bound)
+        results['newest 1% of messages'] = common.measure(lambda: connection.execute(newest).scalar(),
+                                                          max(args.iterations // 10, 3))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--schemes', nargs='+', choices=list(SCHEMES), default=list(SCHEMES))
+    parser.add_argument('--messages', type=int, default=500000)
+    parser.add_argument('--conversations', type=int, default=20000)
+    parser.add_argument('--batch', type=int, default=1000, help='messages per insert transaction')
+    parser.add_argument('--cache-mb', type=int, default=16, help='SQLite page cache per connection')
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--database-url', help='benchmark on this database instead of SQLite files')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for scheme in args.schemes:
+            engine = engine_for(args, tmp, scheme)
+            metadata = MetaData()
+            table = messages_table(metadata, scheme)
+            metadata.drop_all(engine)
+            metadata.create_all(engine)
+
+            started = time.perf_counter()
+            rates, samples = fill(engine, table, scheme, args)
+            elapsed = time.perf_counter() - started
+            if engine.dialect.name == 'postgresql':
+                with engine.begin() as connection:
+                    connection.execute(text(f'ANALYZE {table.name}'))
+
+            print(f"\n{scheme}: {args.messages} messages in {elapsed:.1f}s ({args.messages / elapsed:,.0f}/s), "
+                  f"{storage_mb(engine, table):.1f} MB")
+            print("  inserts/s per tenth of the table: " + ' '.join(f"{rate:,.0f}" for rate in rates))
+            for label, latencies in reads(engine, table, scheme, samples, args).items():
+                common.print_summary(f'  {label}', latencies)
+
+            if args.database_url:
+                metadata.drop_all(engine)
+            engine.dispose()
+
+if __name__ == '__main__':
+    main()
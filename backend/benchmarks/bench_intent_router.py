@@ -0,0 +1,104 @@
+"""
+Accuracy and cost of classifying chat messages. First checks the intent
+router and every call site using it against the labelled corpus in
+intent_corpus.jsonl (exits non-zero on any mismatch), then times one pass
+over the corpus with the keyword scans each call site used to run on its
+own against a single router pass per message.
+
+    python benchmarks/bench_intent_router.py --iterations 2000
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import common
+
+common.use_sqlite()
+
+from chat_service import ChatService
+from intent_router import router, route
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'intent_corpus.jsonl')
+
+def load_corpus():
+    with open(CORPUS_PATH) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def legacy_classify(message):
+    """The separate keyword scans the four call sites used to run, one after another"""
+    message_lower = message.lower()
+
+    # _check_missing_information
+    if any(word in message_lower for word in ['order', 'status', 'track']) and not re.search(r'\d+', message):
+        pass
+    elif any(word in message_lower for word in ['stock', 'inventory', 'available', 'left']) and not any(word in message_lower for word in ['product', 'item', 't-shirt', 'shirt', 'pants', 'dress']):
+        pass
+
+    # _context_keys
+    any(word in message_lower for word in ['top', 'best', 'most sold', 'popular'])
+    'product' in message_lower or 'category' in message_lower
+    any(word in message_lower for word in ['stock', 'inventory', 'available'])
+
+    # _generate_response and _fallback_response
+    for _ in range(2):
+        message_lower = message.lower()
+        if any(word in message_lower for word in ['top', 'best', 'most sold', 'popular']):
+            continue
+        elif any(word in message_lower for word in ['order', 'status', 'track']):
+            re.search(r'(\d+)', message_lower)
+        elif any(word in message_lower for word in ['stock', 'inventory', 'available', 'left']):
+            continue
+        elif any(word in message_lower for word in ['product', 'item', 'catalog']):
+            continue
+
+def check_accuracy(corpus, chat_service):
+    failures = []
+    for case in corpus:
+        message = case['message']
+        result = route(message)
+        actual = {
+            'intent': result.intent,
+            'order_id': result.order_id,
+            'missing_info': chat_service._check_missing_information(message),
+            'context': [key[0] for key in chat_service._context_keys(message)]
+        }
+        expected = {field: case[field] for field in actual}
+        if actual != expected:
+            failures.append((message, expected, actual))
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    messages = [case['message'] for case in corpus]
+
+    failures = check_accuracy(corpus, ChatService())
+    for message, expected, actual in failures:
+        print(f"MISMATCH {message!r}\n  expected {expected}\n  actual   {actual}")
+    print(f"accuracy: {len(corpus) - len(failures)}/{len(corpus)} corpus messages routed as labelled")
+    if failures:
+        sys.exit(1)
+
+    def legacy():
+        for message in messages:
+            legacy_classify(message)
+
+    def single_pass():
+        for message in messages:
+            router.route(message)
+
+    def cached():
+        for message in messages:
+            route(message)
+
+    print(f"\none pass over {len(messages)} messages")
+    common.print_summary('  per-call-site keyword scans', common.measure(legacy, args.iterations))
+    common.print_summary('  compiled router, uncached', common.measure(single_pass, args.iterations))
+    common.print_summary('  compiled router, cached', common.measure(cached, args.iterations))
+
+if __name__ == '__main__':
+    main()
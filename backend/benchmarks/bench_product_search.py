@@ -0,0 +1,68 @@
+"""
+Compare product lookup latency of the in-memory search index against the
+legacy per-word ILIKE scans.
+
+    python benchmarks/bench_product_search.py                 # configured database
+    python benchmarks/bench_product_search.py --synthetic 30000
+"""
+import argparse
+import common
+
+MESSAGES = [
+    "How many Classic T-Shirts are left in stock?",
+    "is the vintage cargo pants still available",
+    "do you have any oversized fleece hoodies in inventory",
+    "check stock for the Levi's slim jeans please, I need them for a wedding next weekend",
+    "how many premium wool sweaters and organic cotton socks are available right now",
+    "any stretch leggings?",
+]
+
+def ilike_lookup(message):
+    """The original lookup: one ILIKE '%word%' query per word longer than 3 characters"""
+    from models import Product
+    for word in message.lower().split():
+        if len(word) > 3:
+            product = Product.query.filter(Product.name.ilike(f'%{word}%')).first()
+            if product:
+                return product.name
+    return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--synthetic', type=int, metavar='N', help='benchmark against N synthetic products in SQLite')
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        common.use_sqlite()
+
+    from app import app
+    from models import db, Product
+    from product_search import ProductSearchIndex
+
+    with app.app_context():
+        if args.synthetic:
+            db.create_all()
+            db.session.execute(Product.__table__.insert(), list(common.synthetic_products(args.synthetic)))
+            db.session.commit()
+
+        catalog_size = Product.query.count()
+        print(f"Catalog size: {catalog_size} products")
+
+        build = common.measure(lambda: ProductSearchIndex.from_database(), 3)
+        common.print_summary('index build', build)
+        index = ProductSearchIndex.from_database()
+
+        ilike, indexed = [], []
+        for message in MESSAGES:
+            ilike += common.measure(lambda: ilike_lookup(message), args.iterations)
+            indexed += common.measure(lambda: index.search(message, limit=5), args.iterations)
+            print(f"  {message!r}\n    ILIKE: {ilike_lookup(message)}\n    index: {index.search(message, limit=1)}")
+
+        common.print_summary('ILIKE per-word lookup', ilike)
+        common.print_summary('search index lookup', indexed)
+        speedup = common.summarize(ilike)['mean_ms'] / max(common.summarize(indexed)['mean_ms'], 1e-9)
+        print(f"Mean speedup: {speedup:.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+Production serving (gunicorn.conf.py) against the current entry point, the
+Werkzeug server of app.py. Seeds the load test dataset once, then for every
+server measures the boot time until /api/health answers, the latency of the
+first requests (which warmup moves out of the request path) and throughput,
+latency percentiles and memory under the mixed load test workload.
+
+    python benchmarks/bench_serving.py --servers flask gunicorn-sync gunicorn-threaded --clients 20
+
+Needs gunicorn (and gevent for gunicorn-gevent); servers whose packages are
+missing are skipped. Every server uses the same SQLite file, which serializes
+writes across worker processes, so the multi-process numbers understate what
+the workers gain on PostgreSQL.
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+import common
+import loadtest
+
+import httpx
+
+REQUIRED_PACKAGES = {
+    'gunicorn-sync': ['gunicorn'],
+    'gunicorn-threaded': ['gunicorn'],
+    'gunicorn-gevent': ['gunicorn', 'gevent'],
+}
+
+async def first_requests(base_url, fixture):
+    """Milliseconds of the first chat, stats and conversation requests a fresh server answers"""
+    requests = [
+        ('chat', 'POST', '/api/chat', {'user_id': fixture['user_ids'][0], 'message': 'What are the top 5 most sold products?'}),
+        ('stats', 'GET', '/api/stats', None),
+        ('conversation', 'GET', f"/api/conversations/{fixture['conversation_ids'][0]}", None),
+    ]
+    timings = {}
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        for name, method, path, body in requests:
+            started = time.perf_counter()
+            response = await client.request(method, path, json=body)
+            timings[name] = (time.perf_counter() - started) * 1000 if response.status_code == 200 else None
+    return timings
+
+def run_server(target, env, fixture, args):
+    port = common.free_port()
+    command, server_settings = loadtest.server_command(target, port)
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=common.BACKEND_DIR, env=dict(env, **server_settings),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        common.wait_for(f'{base_url}/api/health', timeout=120)
+        boot = time.perf_counter() - started
+        first = asyncio.run(first_requests(base_url, fixture))
+        asyncio.run(loadtest.run_phase(base_url, process.pid, fixture, loadtest.WORKLOADS['mixed'],
+                                       args.clients, args.warmup, args.seed))
+        phase = asyncio.run(loadtest.run_phase(base_url, process.pid, fixture, loadtest.WORKLOADS['mixed'],
+                                               args.clients, args.duration, args.seed))
+    finally:
+        common.stop(process)
+    return {'boot_s': boot, 'first_requests_ms': first, 'load': phase}
+
+def print_result(target, result):
+    first = ', '.join(f"{name} {ms:.1f}ms" if ms is not None else f"{name} failed"
+                      for name, ms in result['first_requests_ms'].items())
+    print(f"\n{target}: ready in {result['boot_s']:.2f}s; first requests: {first}")
+    loadtest.print_phase('mixed', result['load'])
+
+def print_comparison(results):
+    baseline_name = next(iter(results))
+    baseline = results[baseline_name]['load']['total']
+    print(f"\nChange vs {baseline_name}")
+    for target, result in results.items():
+        total = result['load']['total']
+        def delta(key):
+            return (total[key] - baseline[key]) / baseline[key] * 100 if baseline[key] else 0.0
+        print(f"  {target:18s} req/s {delta('throughput_rps'):+7.1f}%  p50 {delta('p50_ms'):+7.1f}%  "
+              f"p95 {delta('p95_ms'):+7.1f}%  p99 {delta('p99_ms'):+7.1f}%  "
+              f"peak RSS {result['load']['memory_mb']['peak']:.0f} MB  errors {total['errors']}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--servers', nargs='+', choices=loadtest.SERVERS,
+                        default=['flask', 'gunicorn-sync', 'gunicorn-threaded'], help='the first one is the baseline')
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--chat-users', type=int, default=50)
+    parser.add_argument('--conversations-per-user', type=int, default=4)
+    parser.add_argument('--messages-per-conversation', type=int, default=40)
+    parser.add_argument('--clients', type=int, default=20, help='concurrent closed-loop clients')
+    parser.add_argument('--duration', type=float, default=20, help='seconds of measured load per server')
+    parser.add_argument('--warmup', type=float, default=3, help='seconds of load before measuring')
+    parser.add_argument('--llm-latency', type=float, default=0.3, help='fake LLM seconds before the first byte')
+    parser.add_argument('--token-delay', type=float, default=0.01, help='fake LLM seconds between streamed tokens')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='results file (default: benchmarks/results/serving-<time>.json)')
+    args = parser.parse_args()
+
+    servers = []
+    for target in args.servers:
+        missing = [name for name in REQUIRED_PACKAGES.get(target, []) if importlib.util.find_spec(name) is None]
+        if missing:
+            print(f"Skipping {target}: {', '.join(missing)} not installed")
+        else:
+            servers.append(target)
+    if not servers:
+        return
+
+    llm_server, llm_url = common.start_fake_llm(args.llm_latency, args.token_delay)
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, 'serving.db')
+            common.use_sqlite(db_path)
+            fixture = loadtest.seed(args, tmp)
+            env = loadtest.server_env(db_path, llm_url, tmp)
+            for target in servers:
+                results[target] = run_server(target, env, fixture, args)
+                print_result(target, results[target])
+    finally:
+        common.stop(llm_server)
+    print_comparison(results)
+
+    output = args.output or os.path.join(loadtest.RESULTS_DIR, f"serving-{datetime.utcnow():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({
+            'meta': {
+                'timestamp': datetime.utcnow().isoformat(),
+                'git_commit': loadtest.git_commit(),
+                'python': platform.python_version(),
+                'cpus': os.cpu_count(),
+                'args': vars(args),
+                'dataset': fixture['counts'],
+            },
+            'servers': results
+        }, f, indent=2)
+    print(f"\nResults written to {output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Exercise the pooled LLM client against the local fake provider: connection
+reuse, retries on transient errors, circuit breaking during an outage and
+per-request deadlines. Exits non-zero if any scenario misbehaves.
+
+    python benchmarks/check_llm_client.py
+"""
+import time
+import common
+
+from fake_llm_server import start_fake_llm_server
+from config import Config
+from llm_client import LLMClient, CircuitBreaker, CircuitOpenError, DeadlineExceededError, LLMUnavailableError
+
+PAYLOAD = {'model': 'fake', 'messages': [{'role': 'user', 'content': 'hi'}], 'max_tokens': 20}
+
+def scenario(name):
+    def wrap(fn):
+        fn.scenario = name
+        return fn
+    return wrap
+
+@scenario('keep-alive pool reuses connections')
+def check_pooling(url, config):
+    client = LLMClient(url, 'fake')
+    latencies = common.measure(lambda: client.post_completion(PAYLOAD, timeout=5).json(), 50)
+    common.print_summary('  pooled request', latencies)
+    assert config.connections == 1, f"expected 1 connection, server saw {config.connections}"
+
+@scenario('transient 503s are retried')
+def check_retries(url, config):
+    client = LLMClient(url, 'fake')
+    config.fail_next = 2
+    response = client.post_completion(PAYLOAD, timeout=5)
+    assert response.status_code == 200
+    assert config.requests == 3, f"expected 3 attempts, server saw {config.requests}"
+
+@scenario('outage trips the circuit breaker')
+def check_breaker(url, config):
+    client = LLMClient(url, 'fake')
+    config.error_rate = 1.0
+    for _ in range(Config.LLM_BREAKER_THRESHOLD):
+        try:
+            client.post_completion(PAYLOAD, timeout=5)
+        except CircuitOpenError:
+            break
+        except LLMUnavailableError:
+            pass
+    assert client.breaker.state == CircuitBreaker.OPEN
+    seen = config.requests
+    started = time.perf_counter()
+    try:
+        client.post_completion(PAYLOAD, timeout=5)
+        raise AssertionError('call went through an open circuit')
+    except CircuitOpenError:
+        pass
+    print(f"  open circuit rejected in {(time.perf_counter() - started) * 1000:.3f}ms")
+    assert config.requests == seen, 'open circuit still reached the provider'
+
+    # After the reset timeout a single trial call closes the circuit again
+    config.error_rate = 0.0
+    client.breaker.opened_at -= client.breaker.reset_timeout
+    client.post_completion(PAYLOAD, timeout=5)
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+@scenario('deadline bounds a slow provider')
+def check_deadline(url, config):
+    client = LLMClient(url, 'fake')
+    config.latency = 2.0
+    started = time.perf_counter()
+    try:
+        client.post_completion(PAYLOAD, timeout=30, deadline=time.monotonic() + 0.3)
+        raise AssertionError('slow call did not hit its deadline')
+    except DeadlineExceededError:
+        pass
+    elapsed = time.perf_counter() - started
+    print(f"  gave up after {elapsed:.2f}s")
+    assert elapsed < 1.0
+
+def main():
+    Config.LLM_BACKOFF_BASE = 0.01
+    failures = 0
+    for check in [check_pooling, check_retries, check_breaker, check_deadline]:
+        server, config, url = start_fake_llm_server()
+        try:
+            check(url, config)
+            print(f"✅ {check.scenario}")
+        except AssertionError as e:
+            failures += 1
+            print(f"❌ {check.scenario}: {e}")
+        finally:
+            server.shutdown()
+    raise SystemExit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+"""Shared helpers for the benchmark scripts in this directory"""
+import csv
+import os
+import random
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+ADJECTIVES = ['Classic', 'Slim', 'Relaxed', 'Vintage', 'Essential', 'Premium', 'Cotton', 'Wool',
+              'Linen', 'Stretch', 'Cropped', 'Oversized', 'Striped', 'Printed', 'Organic', 'Fleece']
+GARMENTS = ['T-Shirt', 'Jeans', 'Hoodie', 'Sweater', 'Dress', 'Cargo Pants', 'Shorts', 'Jacket',
+            'Blazer', 'Polo', 'Skirt', 'Leggings', 'Socks', 'Cardigan', 'Parka', 'Swim Trunks']
+CATEGORIES = ['Tops & Tees', 'Jeans', 'Fashion Hoodies & Sweatshirts', 'Sweaters', 'Dresses',
+              'Pants', 'Shorts', 'Outerwear & Coats', 'Suits & Sport Coats', 'Active', 'Skirts',
+              'Leggings', 'Socks', 'Intimates', 'Swim', 'Accessories']
+BRANDS = ['Acme', 'Northwind', 'Calvin Klein', 'Levi\'s', 'Columbia', 'Carhartt', 'Hanes',
+          'Patagonia', 'Allegra K', 'Nautica', 'Champion', 'Dockers', 'Quiksilver', 'Volcom']
+
+def use_sqlite(path=None):
+    """Point the app at a throwaway SQLite database; must run before importing config"""
+    os.environ['DATABASE_URL'] = f"sqlite:///{path}" if path else 'sqlite://'
+
+def synthetic_products(count, seed=42):
+    """Product rows shaped like products.csv"""
+    rng = random.Random(seed)
+    for product_id in range(1, count + 1):
+        garment = rng.choice(GARMENTS)
+        cost = round(rng.uniform(2, 80), 2)
+        yield {
+            'id': product_id,
+            'cost': cost,
+            'category': CATEGORIES[GARMENTS.index(garment)],
+            'name': f"{rng.choice(BRANDS)} {rng.choice(ADJECTIVES)} {rng.choice(ADJECTIVES)} {garment} {product_id}",
+            'brand': rng.choice(BRANDS),
+            'retail_price': round(cost * rng.uniform(1.5, 3), 2),
+            'department': rng.choice(['Men', 'Women']),
+            'sku': f"SKU{product_id:08d}",
+            'distribution_center_id': rng.randint(1, 10)
+        }
+
+def measure(fn, iterations):
+    """Call fn repeatedly and return per-call latencies in milliseconds"""
+    latencies = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def summarize(latencies):
+    return {
+        'count': len(latencies),
+        'mean_ms': statistics.fmean(latencies) if latencies else 0.0,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+    }
+
+def print_summary(label, latencies):
+    s = summarize(latencies)
+    print(f"{label:40s} n={s['count']:<6d} mean={s['mean_ms']:8.3f}ms "
+          f"p50={s['p50_ms']:8.3f}ms p95={s['p95_ms']:8.3f}ms p99={s['p99_ms']:8.3f}ms")
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def stop(process):
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+def rss_mb(pid):
+    """Resident memory of a process and its children, from /proc"""
+    pids = [pid]
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                        pids.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                pass
+    total_kb = 0
+    for p in pids:
+        try:
+            with open(f'/proc/{p}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total_kb += int(line.split()[1])
+        except OSError:
+            pass
+    return total_kb / 1024
+
+def wait_for(url, timeout=20):
+    """Poll url until it answers 200"""
+    import httpx
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"server at {url} did not come up")
+
+def start_fake_llm(latency, token_delay=0.0):
+    """Start fake_llm_server.py in its own process; returns (process, completions URL)"""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, 'fake_llm_server.py', '--port', str(port), '--latency', str(latency),
+         '--token-delay', str(token_delay)],
+        cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    return process, f'http://127.0.0.1:{port}/openai/v1/chat/completions'
+
+def write_synthetic_dataset(directory, products, seed=42):
+    """
+    Write the six e-commerce CSVs (products, orders, order_items,
+    inventory_items, users, distribution_centers) for a catalog of
+    `products` products. Other tables scale with it: 5 inventory items and
+    about 1.5 order items per product, 2 order items per order, and one
+    customer per 2 orders. Returns the row count of each file.
+    """
+    rng = random.Random(seed)
+    base = datetime(2023, 1, 1)
+    catalog = list(synthetic_products(products, seed))
+    counts = {}
+
+    def write(name, fields, rows):
+        with open(os.path.join(directory, name), 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            count = 0
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        counts[name] = count
+
+    def stamp(days):
+        return (base + timedelta(days=days, seconds=rng.randint(0, 86399))).strftime('%Y-%m-%d %H:%M:%S UTC')
+
+    write('distribution_centers.csv', ['id', 'name', 'latitude', 'longitude'], (
+        {'id': i, 'name': f"Center {i}", 'latitude': round(rng.uniform(25, 48), 4),
+         'longitude': round(rng.uniform(-122, -71), 4)}
+        for i in range(1, 11)
+    ))
+    write('products.csv', list(catalog[0].keys()) if catalog else ['id'], catalog)
+
+    inventory = []
+    for product in catalog:
+        for _ in range(5):
+            inventory.append({
+                'id': len(inventory) + 1,
+                'product_id': product['id'],
+                'created_at': stamp(rng.randint(0, 300)),
+                'sold_at': None,
+                'cost': product['cost'],
+                'product_category': product['category'],
+                'product_name': product['name'],
+                'product_brand': product['brand'],
+                'product_retail_price': product['retail_price'],
+                'product_department': product['department'],
+                'product_sku': product['sku'],
+                'product_distribution_center_id': product['distribution_center_id']
+            })
+
+    orders = max(1, products * 3 // 4)
+    customers = max(1, orders // 2)
+    order_rows, item_rows = [], []
+    for order_id in range(1, orders + 1):
+        day = rng.randint(0, 360)
+        status = rng.choice(['Complete', 'Shipped', 'Processing', 'Cancelled', 'Returned'])
+        user_id = rng.randint(1, customers)
+        order_rows.append({
+            'order_id': order_id, 'user_id': user_id, 'status': status,
+            'gender': rng.choice(['M', 'F']), 'created_at': stamp(day),
+            'returned_at': stamp(day + 10) if status == 'Returned' else None,
+            'shipped_at': stamp(day + 1) if status != 'Processing' else None,
+            'delivered_at': stamp(day + 4) if status in ('Complete', 'Returned') else None,
+            'num_of_item': 2
+        })
+        for _ in range(2):
+            # Skewed towards low ids so the catalog has clear best sellers
+            item = inventory[min(int(rng.paretovariate(1.2)) - 1, len(inventory) - 1) if rng.random() < 0.3
+                             else rng.randrange(len(inventory))]
+            if item['sold_at']:
+                continue
+            item['sold_at'] = stamp(day)
+            item_rows.append({
+                'id': len(item_rows) + 1, 'order_id': order_id, 'user_id': user_id,
+                'product_id': item['product_id'], 'inventory_item_id': item['id'], 'status': status,
+                'created_at': stamp(day), 'shipped_at': None, 'delivered_at': None, 'returned_at': None
+            })
+
+    write('inventory_items.csv', list(inventory[0].keys()) if inventory else ['id'], inventory)
+    write('orders.csv', list(order_rows[0].keys()), order_rows)
+    write('order_items.csv', list(item_rows[0].keys()) if item_rows else ['id'], item_rows)
+    write('users.csv', ['id', 'first_name', 'last_name', 'email', 'age', 'gender', 'state', 'street_address',
+                        'postal_code', 'city', 'country', 'latitude', 'longitude', 'traffic_source', 'created_at'], (
+        {'id': i, 'first_name': f"First{i}", 'last_name': f"Last{i}", 'email': f"customer{i}@example.com",
+         'age': rng.randint(18, 70), 'gender': rng.choice(['M', 'F']), 'state': 'California',
+         'street_address': f"{i} Main St", 'postal_code': f"{90000 + i % 1000}", 'city': 'Los Angeles',
+         'country': 'United States', 'latitude': 34.05, 'longitude': -118.24,
+         'traffic_source': rng.choice(['Search', 'Organic', 'Email', 'Facebook']), 'created_at': stamp(0)}
+        for i in range(1, customers + 1)
+    ))
+    return counts
@@ -0,0 +1,361 @@
+"""
+End-to-end load test of the Flask app. Seeds a throwaway database with a
+synthetic dataset shaped like the e-commerce CSVs (loaded through
+load_data.py, so aggregates are built as in production) plus chat users,
+conversations and messages; starts the local fake LLM provider and the
+server; then drives closed-loop workloads of concurrent clients and reports
+per-endpoint throughput, p50/p95/p99 latency and server memory.
+
+    python benchmarks/loadtest.py --products 20000 --clients 20 --duration 30
+    python benchmarks/loadtest.py --workloads chat-heavy --isolate --compare benchmarks/results/previous.json
+
+Every run is written as JSON (--output, by default under benchmarks/results/)
+so releases can be compared with --compare.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+import common
+
+import httpx
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# Operation weights of each workload
+WORKLOADS = {
+    'mixed': {'chat': 30, 'chat_stream': 10, 'conversation': 25, 'conversations': 20, 'stats': 10, 'chat_batch': 5},
+    'chat-heavy': {'chat': 60, 'chat_stream': 30, 'conversation': 10},
+    'read-heavy': {'conversation': 45, 'conversations': 35, 'stats': 20},
+}
+
+CHAT_TEMPLATES = [
+    "What are the top 5 most sold products?",
+    "What's the status of order {order_id}?",
+    "How many {product} are left in stock?",
+    "Tell me about your product categories",
+    "Do you offer gift wrapping?",
+    "Track my order please",
+]
+
+# Production serving (gunicorn.conf.py) by worker model
+GUNICORN_WORKER_CLASSES = {'gunicorn-sync': 'sync', 'gunicorn-threaded': 'threaded', 'gunicorn-gevent': 'gevent'}
+SERVERS = ['flask'] + list(GUNICORN_WORKER_CLASSES)
+
+def server_command(target, port):
+    """(command, extra environment) that starts a server on port"""
+    if target == 'flask':
+        # The Werkzeug server app.py runs, without the debug reloader
+        return [sys.executable, '-c',
+                f"from app import app; app.run(host='127.0.0.1', port={port}, threaded=True)"], {}
+    if target in GUNICORN_WORKER_CLASSES:
+        return [sys.executable, '-m', 'gunicorn', 'app:app'], {
+            'SERVER_BIND': f'127.0.0.1:{port}',
+            'SERVER_WORKER_CLASS': GUNICORN_WORKER_CLASSES[target]
+        }
+    raise ValueError(f"unknown server {target}")
+
+def server_env(db_path, llm_url, tmp, llm_cache=False):
+    """Environment of a server under test: the seeded database and the fake LLM"""
+    return dict(os.environ, DATABASE_URL=f'sqlite:///{db_path}', GROQ_API_URL=llm_url, GROQ_API_KEY='fake',
+                DEBUG='False', LLM_BREAKER_THRESHOLD='1000000', LLM_CACHE_ENABLED=str(llm_cache),
+                LLM_CACHE_PATH=os.path.join(tmp, 'llm_cache.db'))
+
+def seed(args, tmp):
+    """Create and fill the database; returns the ids and names the workloads draw from"""
+    from app import app
+    from models import db, User, Conversation, Message, Product, Order
+    from migrations import run_migrations
+    import load_data
+
+    with app.app_context():
+        db.create_all()
+        run_migrations()
+
+        dataset_dir = os.path.join(tmp, 'dataset')
+        os.makedirs(dataset_dir)
+        started = time.perf_counter()
+        counts = common.write_synthetic_dataset(dataset_dir, args.products, seed=args.seed)
+        for name, loader in [('products.csv', load_data.load_products), ('orders.csv', load_data.load_orders),
+                             ('order_items.csv', load_data.load_order_items),
+                             ('inventory_items.csv', load_data.load_inventory_items),
+                             ('users.csv', load_data.load_users),
+                             ('distribution_centers.csv', load_data.load_distribution_centers)]:
+            loader(os.path.join(dataset_dir, name))
+        db.session.commit()
+
+        rng = random.Random(args.seed)
+        base = datetime.utcnow() - timedelta(days=30)
+        users, conversations, messages = [], [], []
+        for u in range(args.chat_users):
+            user_id = str(uuid.uuid4())
+            users.append({'id': user_id, 'email': f'load{u}@example.com', 'first_name': f'Load{u}',
+                          'created_at': base, 'updated_at': base})
+            for c in range(args.conversations_per_user):
+                conversation_id = str(uuid.uuid4())
+                last = base + timedelta(minutes=rng.randint(0, 40000))
+                content = ''
+                for m in range(args.messages_per_conversation):
+                    content = f"message {m} " + 'lorem ipsum dolor sit amet ' * rng.randint(2, 30)
+                    messages.append({'id': str(uuid.uuid4()), 'conversation_id': conversation_id,
+                                     'role': 'user' if m % 2 == 0 else 'assistant', 'content': content,
+                                     'created_at': last + timedelta(seconds=m)})
+                conversations.append({'id': conversation_id, 'user_id': user_id, 'title': f'Load {u}/{c}',
+                                      'created_at': last, 'updated_at': last, 'is_active': True,
+                                      'message_count': args.messages_per_conversation,
+                                      'last_message_preview': content[:200] or None,
+                                      'summary_message_count': 0})
+        db.session.execute(User.__table__.insert(), users)
+        if conversations:
+            db.session.execute(Conversation.__table__.insert(), conversations)
+        for i in range(0, len(messages), 5000):
+            db.session.execute(Message.__table__.insert(), messages[i:i + 5000])
+        db.session.commit()
+        print(f"Seeded {counts} and {len(conversations)} conversations / {len(messages)} messages "
+              f"in {time.perf_counter() - started:.1f}s")
+
+        return {
+            'counts': dict(counts, chat_users=len(users), conversations=len(conversations), messages=len(messages)),
+            'user_ids': [u['id'] for u in users],
+            'conversation_ids': [c['id'] for c in conversations],
+            'order_ids': [row[0] for row in db.session.query(Order.order_id).limit(1000)],
+            'products': [row[0] for row in db.session.query(Product.name).limit(1000)],
+        }
+
+def chat_message(rng, fixture):
+    template = rng.choice(CHAT_TEMPLATES)
+    return template.format(
+        order_id=rng.choice(fixture['order_ids']) if fixture['order_ids'] else 1,
+        product=rng.choice(fixture['products']) if fixture['products'] else 'T-Shirt'
+    )
+
+def chat_target(rng, fixture):
+    """Continue an existing conversation half of the time, otherwise start one"""
+    if fixture['conversation_ids'] and rng.random() < 0.5:
+        return {'conversation_id': rng.choice(fixture['conversation_ids'])}
+    return {'user_id': rng.choice(fixture['user_ids'])}
+
+async def op_chat(client, rng, fixture, record):
+    response = await client.post('/api/chat', json=dict(chat_target(rng, fixture), message=chat_message(rng, fixture)))
+    return response.status_code == 200 and 'ai_response' in response.json()
+
+async def op_chat_stream(client, rng, fixture, record):
+    started = time.perf_counter()
+    body = dict(chat_target(rng, fixture), message=chat_message(rng, fixture))
+    async with client.stream('POST', '/api/chat/stream', json=body) as response:
+        ok = response.status_code == 200
+        async for line in response.aiter_lines():
+            if line == 'event: delta' and 'ttft' not in record:
+                record['ttft'] = (time.perf_counter() - started) * 1000
+            if line == 'event: done':
+                return ok
+    return False
+
+async def op_chat_batch(client, rng, fixture, record):
+    items = [dict(chat_target(rng, fixture), message=chat_message(rng, fixture)) for _ in range(10)]
+    ok = False
+    async with client.stream('POST', '/api/chat/batch', json={'items': items}) as response:
+        async for line in response.aiter_lines():
+            if line:
+                last = json.loads(line)
+                ok = response.status_code == 200 and last.get('saved') is True
+    return ok
+
+async def op_conversation(client, rng, fixture, record):
+    response = await client.get(f"/api/conversations/{rng.choice(fixture['conversation_ids'])}", params={'limit': 50})
+    return response.status_code == 200
+
+async def op_conversations(client, rng, fixture, record):
+    response = await client.get(f"/api/users/{rng.choice(fixture['user_ids'])}/conversations", params={'limit': 20})
+    return response.status_code == 200
+
+async def op_stats(client, rng, fixture, record):
+    response = await client.get('/api/stats')
+    return response.status_code == 200
+
+OPERATIONS = {
+    'chat': op_chat,
+    'chat_stream': op_chat_stream,
+    'chat_batch': op_chat_batch,
+    'conversation': op_conversation,
+    'conversations': op_conversations,
+    'stats': op_stats,
+}
+
+async def sample_memory(pid, samples, stop):
+    while not stop.is_set():
+        samples.append(common.rss_mb(pid))
+        await asyncio.sleep(0.25)
+
+async def run_phase(base_url, pid, fixture, weights, clients, duration, seed):
+    """Closed loop: each client issues operations back to back for `duration` seconds"""
+    names = list(weights)
+    latencies = {name: [] for name in names}
+    ttfts = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        stop_at = time.monotonic() + duration
+
+        async def run_client(index):
+            rng = random.Random(seed * 1000 + index)
+            while time.monotonic() < stop_at:
+                name = rng.choices(names, weights=[weights[n] for n in names])[0]
+                record = {}
+                started = time.perf_counter()
+                try:
+                    ok = await OPERATIONS[name](client, rng, fixture, record)
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies[name].append((time.perf_counter() - started) * 1000)
+                    if 'ttft' in record:
+                        ttfts[name].append(record['ttft'])
+                else:
+                    errors[name] += 1
+
+        samples, stop = [common.rss_mb(pid)], asyncio.Event()
+        sampler = asyncio.create_task(sample_memory(pid, samples, stop))
+        started = time.perf_counter()
+        await asyncio.gather(*(run_client(i) for i in range(clients)))
+        wall = time.perf_counter() - started
+        stop.set()
+        await sampler
+
+    endpoints = {}
+    for name in names:
+        summary = common.summarize(latencies[name])
+        summary.update(errors=errors[name], throughput_rps=len(latencies[name]) / wall)
+        if ttfts[name]:
+            summary['ttft'] = common.summarize(ttfts[name])
+        endpoints[name] = summary
+    every = [value for name in names for value in latencies[name]]
+    total = common.summarize(every)
+    total.update(errors=sum(errors.values()), throughput_rps=len(every) / wall)
+    return {
+        'clients': clients,
+        'duration_s': wall,
+        'endpoints': endpoints,
+        'total': total,
+        'memory_mb': {'start': samples[0], 'peak': max(samples), 'end': samples[-1]}
+    }
+
+def print_phase(name, phase):
+    memory = phase['memory_mb']
+    print(f"\n{name}: {phase['clients']} clients, {phase['duration_s']:.1f}s, "
+          f"RSS {memory['start']:.0f} -> {memory['end']:.0f} MB (peak {memory['peak']:.0f})")
+    for endpoint, s in list(phase['endpoints'].items()) + [('TOTAL', phase['total'])]:
+        line = (f"  {endpoint:14s} {s['throughput_rps']:8.1f} req/s  n={s['count']:<6d} err={s['errors']:<4d} "
+                f"p50={s['p50_ms']:8.1f}ms p95={s['p95_ms']:8.1f}ms p99={s['p99_ms']:8.1f}ms")
+        if 'ttft' in s:
+            line += f"  ttft p50={s['ttft']['p50_ms']:.1f}ms"
+        print(line)
+
+def compare(current, previous_path):
+    """Print throughput and latency changes against an earlier results file"""
+    with open(previous_path) as f:
+        previous = json.load(f)
+    print(f"\nChange vs {previous_path} ({previous['meta'].get('git_commit')}, {previous['meta']['timestamp']})")
+    for phase_name, phase in current['phases'].items():
+        old_phase = previous['phases'].get(phase_name)
+        if not old_phase:
+            continue
+        print(f"  {phase_name}")
+        for endpoint, s in list(phase['endpoints'].items()) + [('TOTAL', phase['total'])]:
+            old = old_phase['total'] if endpoint == 'TOTAL' else old_phase['endpoints'].get(endpoint)
+            if not old or not old['count']:
+                continue
+            def delta(key):
+                return (s[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+            print(f"    {endpoint:14s} req/s {delta('throughput_rps'):+6.1f}%  p50 {delta('p50_ms'):+6.1f}%  "
+                  f"p95 {delta('p95_ms'):+6.1f}%  p99 {delta('p99_ms'):+6.1f}%")
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=common.BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=5000, help='synthetic catalog size; other tables scale with it')
+    parser.add_argument('--chat-users', type=int, default=50)
+    parser.add_argument('--conversations-per-user', type=int, default=4)
+    parser.add_argument('--messages-per-conversation', type=int, default=40)
+    parser.add_argument('--workloads', nargs='+', choices=sorted(WORKLOADS), default=['mixed'])
+    parser.add_argument('--isolate', action='store_true', help='also run every endpoint of the workloads on its own')
+    parser.add_argument('--clients', type=int, default=10, help='concurrent closed-loop clients')
+    parser.add_argument('--duration', type=float, default=20, help='seconds per phase')
+    parser.add_argument('--warmup', type=float, default=3, help='seconds of mixed load before measuring')
+    parser.add_argument('--llm-latency', type=float, default=0.3, help='fake LLM seconds before the first byte')
+    parser.add_argument('--token-delay', type=float, default=0.01, help='fake LLM seconds between streamed tokens')
+    parser.add_argument('--llm-cache', action='store_true', help='keep the LLM response cache enabled')
+    parser.add_argument('--server', choices=SERVERS, default='flask')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='results file (default: benchmarks/results/loadtest-<time>.json)')
+    parser.add_argument('--compare', metavar='RESULTS', help='earlier results file to compare against')
+    args = parser.parse_args()
+
+    llm_server, llm_url = common.start_fake_llm(args.llm_latency, args.token_delay)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'loadtest.db')
+        common.use_sqlite(db_path)
+        fixture = seed(args, tmp)
+
+        port = common.free_port()
+        command, server_settings = server_command(args.server, port)
+        env = dict(server_env(db_path, llm_url, tmp, args.llm_cache), **server_settings)
+        process = subprocess.Popen(command, cwd=common.BACKEND_DIR, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        base_url = f'http://127.0.0.1:{port}'
+        phases = {}
+        try:
+            common.wait_for(f'{base_url}/api/health')
+            asyncio.run(run_phase(base_url, process.pid, fixture, WORKLOADS['mixed'], args.clients, args.warmup, args.seed))
+
+            plan = {}
+            for workload in args.workloads:
+                if args.isolate:
+                    plan.update({f'only/{name}': {name: 1} for name in WORKLOADS[workload]})
+                plan[workload] = WORKLOADS[workload]
+            for name, weights in plan.items():
+                phases[name] = asyncio.run(run_phase(base_url, process.pid, fixture, weights,
+                                                     args.clients, args.duration, args.seed))
+                print_phase(name, phases[name])
+        finally:
+            common.stop(process)
+            common.stop(llm_server)
+
+    results = {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(),
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'args': vars(args),
+            'dataset': fixture['counts'],
+        },
+        'phases': phases
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"loadtest-{datetime.utcnow():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == '__main__':
+    main()
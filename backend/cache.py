@@ -0,0 +1,138 @@
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import select
+from models import db, CacheVersion
+from db_utils import upsert_statement
+from config import Config
+
+# Version counter bumped whenever the e-commerce dataset changes
+DATASET_VERSION = 'dataset'
+
+class LRUCache:
+    """Thread-safe, size-bounded LRU cache with per-entry TTL and hit/miss counters"""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return (found, value) for a key, dropping it if it has expired"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_build(self, key, builder):
+        """Return the cached value for a key, building and storing it on a miss"""
+        found, value = self.get(key)
+        if found:
+            return value
+        value = builder()
+        self.set(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+class VersionedCache(LRUCache):
+    """
+    Per-process LRU cache that is invalidated across every worker through a
+    version counter in the database. Each process re-reads the counter at most
+    once per check interval and drops its entries when the counter moves.
+    """
+
+    def __init__(self, version_name, max_size, ttl, check_interval=None):
+        super().__init__(max_size, ttl)
+        self.version_name = version_name
+        self.check_interval = Config.CACHE_VERSION_CHECK_INTERVAL if check_interval is None else check_interval
+        self.version = None
+        self._next_check = 0.0
+
+    def get(self, key):
+        self._check_version()
+        return super().get(key)
+
+    def _check_version(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+
+        version = read_version(self.version_name)
+        if version != self.version:
+            self.clear()
+            self.version = version
+
+    def stats(self):
+        stats = super().stats()
+        stats['version'] = self.version
+        return stats
+
+def read_version(name):
+    """
+    Current value of a version counter. Uses its own connection so that it
+    never disturbs (or is rolled back with) the caller's session.
+    """
+    try:
+        with db.engine.connect() as connection:
+            version = connection.execute(
+                select(CacheVersion.version).where(CacheVersion.name == name)
+            ).scalar()
+        return version or 0
+    except Exception as e:
+        print(f"Error reading cache version {name}: {str(e)}")
+        return None
+
+def bump_version(name):
+    """Increment a version counter so every worker drops its cached entries"""
+    table = CacheVersion.__table__
+    with db.engine.begin() as connection:
+        connection.execute(
+            upsert_statement(table, ['name'], set_=lambda excluded: {
+                'version': table.c.version + 1
+            }),
+            {'name': name, 'version': 1}
+        )
+
+# Cache for the database context strings built by ChatService
+context_cache = VersionedCache(DATASET_VERSION, Config.CONTEXT_CACHE_SIZE, Config.CONTEXT_CACHE_TTL)
+
+def invalidate_dataset_caches():
+    """Called by the data loaders after the e-commerce tables change"""
+    bump_version(DATASET_VERSION)
+    context_cache.clear()
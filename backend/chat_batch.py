@@ -0,0 +1,277 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from sqlalchemy import select
+from models import db, User, Conversation, new_id
+from config import Config
+from cache import context_cache
+from history import recent_history
+from persistence import Exchange, save_exchanges, write_behind
+from archive import rehydrate
+from metrics import Counter
+
+chat_batch_items = Counter(
+    'chat_batch_items_total',
+    'Items of batch chat requests by outcome',
+    labelnames=('outcome',)
+)
+
+class BatchItem:
+    """One message of a batch request and, once processed, its reply or error"""
+
+    def __init__(self, index, message, conversation_id=None, user_id=None):
+        self.index = index
+        self.message = message
+        self.conversation_id = conversation_id
+        self.user_id = user_id
+        self.missing_info = None
+        self.context_keys = []
+        self.context = None
+        self.prompt = None
+        self.ai_response = None
+        self.asked_at = None
+        self.answered_at = None
+        self.error = None  # (message, status)
+
+    def fail(self, message, status):
+        self.error = (message, status)
+
+    def result(self):
+        if self.error:
+            return {'index': self.index, 'status': self.error[1], 'error': self.error[0]}
+        return {
+            'index': self.index,
+            'status': 200,
+            'conversation_id': self.conversation_id,
+            'user_message': self.message,
+            'ai_response': self.ai_response,
+            'prompt_tokens': self.prompt.report() if self.prompt else None,
+            'timestamp': self.answered_at.isoformat()
+        }
+
+class ConversationGroup:
+    """
+    Items of a batch that share a conversation. They are answered in order
+    so each one sees the earlier exchanges in its history; the attributes
+    mirror Conversation so ChatService._pack_prompt accepts a group.
+    """
+
+    def __init__(self, conversation_id, user_id=None, conversation=None):
+        self.conversation_id = conversation_id
+        self.user_id = user_id
+        self.is_new = conversation is None
+        self.summary = conversation.summary if conversation else None
+        self.message_count = (conversation.message_count or 0) if conversation else 0
+        self.summary_message_count = (conversation.summary_message_count or 0) if conversation else 0
+        self.summary_source_tokens = (conversation.summary_source_tokens or 0) if conversation else 0
+        self.counts = (self.message_count, self.summary_message_count)
+        self.history = recent_history(conversation_id) if conversation else []
+        self.items = []
+
+def parse_batch(data):
+    """BatchItems of a request body ({"items": [...]}); raises ValueError if the body is unusable"""
+    items = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        raise ValueError('items must be a non-empty list')
+    if len(items) > Config.CHAT_BATCH_MAX_ITEMS:
+        raise ValueError(f'at most {Config.CHAT_BATCH_MAX_ITEMS} items are accepted per batch')
+
+    parsed = []
+    for index, raw in enumerate(items):
+        if not isinstance(raw, dict) or not raw.get('message') or not isinstance(raw['message'], str):
+            item = BatchItem(index, None)
+            item.fail('message is required and must be a string', 400)
+        elif any(raw.get(name) is not None and not isinstance(raw[name], str) for name in ('conversation_id', 'user_id')):
+            # Ids are looked up in sets and bound as UUIDs; anything else would fail the whole batch
+            item = BatchItem(index, None)
+            item.fail('conversation_id and user_id must be strings', 400)
+        else:
+            item = BatchItem(index, raw['message'], raw.get('conversation_id'), raw.get('user_id'))
+            if not item.conversation_id and not item.user_id:
+                item.fail('Either conversation_id or user_id is required', 400)
+        parsed.append(item)
+    return parsed
+
+# Shared by every batch of this process, so concurrent batches together stay within the limit
+_executor = None
+_executor_lock = threading.Lock()
+
+def llm_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=Config.CHAT_BATCH_CONCURRENCY, thread_name_prefix='chat-batch')
+        return _executor
+
+class ChatBatch:
+    """
+    Answers the items of a batch chat request in three phases: one pass over
+    the database for conversations, history and (deduplicated) context; the
+    LLM calls on a bounded thread pool, one conversation per task; then every
+    new conversation and message in a single transaction.
+    """
+
+    def __init__(self, chat_service, items):
+        self.chat_service = chat_service
+        self.llm_service = chat_service.llm_service
+        self.items = items
+        self.groups = []
+
+    def prepare(self):
+        """Resolve conversations and gather history and context for every valid item"""
+        pending = [item for item in self.items if not item.error]
+
+        conversation_ids = {item.conversation_id for item in pending if item.conversation_id}
+        for conversation_id in conversation_ids:
+            write_behind.barrier(conversation_id)
+        conversations = {
+            c.id: c for c in Conversation.query.filter(Conversation.id.in_(conversation_ids)).all()
+        } if conversation_ids else {}
+        for conversation in list(conversations.values()):
+            rehydrate(db.session, conversation)
+        user_ids = {item.user_id for item in pending if not item.conversation_id}
+        known_users = set(db.session.execute(
+            select(User.id).where(User.id.in_(user_ids))
+        ).scalars()) if user_ids else set()
+
+        groups = {}
+        for item in pending:
+            if item.conversation_id:
+                conversation = conversations.get(item.conversation_id)
+                if conversation is None:
+                    item.fail('Conversation not found', 404)
+                    continue
+                group = groups.get(conversation.id)
+                if group is None:
+                    group = groups[conversation.id] = ConversationGroup(conversation.id, conversation=conversation)
+            else:
+                if item.user_id not in known_users:
+                    item.fail('User not found', 404)
+                    continue
+                # Like POST /api/chat, every item without a conversation starts a new one
+                item.conversation_id = new_id()
+                group = groups[item.conversation_id] = ConversationGroup(item.conversation_id, user_id=item.user_id)
+            group.items.append(item)
+
+            item.missing_info = self.chat_service._check_missing_information(item.message)
+            if not item.missing_info:
+                item.context_keys = self.chat_service._context_keys(item.message)
+
+        # Each distinct context part is looked up once for the whole batch
+        keys = {key for group in groups.values() for item in group.items for key in item.context_keys}
+        values = {key: self._context_part(key) for key in keys}
+        for group in groups.values():
+            for item in group.items:
+                item.context = self.chat_service._join_context([values[key] for key in item.context_keys])
+
+        # End the read transaction so no connection is held while the LLM works
+        db.session.rollback()
+        self.groups = list(groups.values())
+
+    def _context_part(self, key):
+        try:
+            return context_cache.get_or_build(key, lambda: self.chat_service._build_context(key))
+        except Exception as e:
+            print(f"Error getting database context: {str(e)}")
+            return None
+
+    def results(self, budget):
+        """
+        Generator of per-item result dicts in completion order, then a final
+        summary line once everything is saved. Each LLM call gets budget
+        seconds from the moment it starts.
+        """
+        for item in self.items:
+            if item.error:
+                chat_batch_items.inc(outcome='rejected')
+                yield item.result()
+
+        done = queue.Queue()
+        executor = llm_executor()
+        for group in self.groups:
+            executor.submit(self._answer_group, group, budget, done)
+
+        remaining = sum(len(group.items) for group in self.groups)
+        summary = None
+        try:
+            while remaining:
+                item = done.get()
+                remaining -= 1
+                chat_batch_items.inc(outcome='failed' if item.error else 'answered')
+                yield item.result()
+            summary = self._save()
+            yield summary
+        finally:
+            if summary is None:
+                # Client went away mid-stream; like the streaming endpoint, keep what was answered
+                for _ in range(remaining):
+                    done.get()
+                self._save()
+
+    def _answer_group(self, group, budget, done):
+        for item in group.items:
+            try:
+                item.asked_at = datetime.utcnow()
+                deadline = time.monotonic() + budget
+                if item.missing_info:
+                    item.ai_response = self.llm_service.ask_clarifying_question(item.message, item.missing_info, deadline=deadline)
+                else:
+                    item.prompt = self.chat_service._pack_prompt(group, item.message, group.history, item.context)
+                    item.ai_response = self.llm_service.generate_response(
+                        user_message=item.message,
+                        conversation_history=group.history,
+                        context=item.context,
+                        deadline=deadline,
+                        prompt=item.prompt
+                    )
+                item.answered_at = datetime.utcnow()
+                group.history = group.history + [
+                    {'role': 'user', 'content': item.message},
+                    {'role': 'assistant', 'content': item.ai_response}
+                ]
+                group.message_count += 2
+            except Exception as e:
+                item.fail(str(e), 500)
+            done.put(item)
+
+    def _save(self):
+        """Write every new conversation and answered exchange in one transaction"""
+        exchanges = {}
+        for group in self.groups:
+            answered = [item for item in group.items if not item.error]
+            if not answered:
+                continue
+            exchanges[group.conversation_id] = [
+                Exchange.build(group.conversation_id, item.message, item.ai_response, item.asked_at, item.answered_at)
+                for item in answered
+            ]
+            if group.is_new:
+                first = exchanges[group.conversation_id][0]
+                first.conversation = {'user_id': group.user_id, 'title': "New Chat", 'created_at': answered[0].asked_at}
+
+        written = [exchange for group_exchanges in exchanges.values() for exchange in group_exchanges]
+        saved = sum(len(exchange.messages) for exchange in written)
+        try:
+            if written:
+                save_exchanges(written)
+        except Exception as e:
+            return {'done': True, 'saved': False, 'messages_written': 0, 'error': str(e)}
+
+        for group in self.groups:
+            if group.conversation_id not in exchanges:
+                continue
+            count = sum(len(exchange.messages) for exchange in exchanges[group.conversation_id])
+            prompts = [item.prompt for item in group.items if item.prompt]
+            self.chat_service._summarize_if_needed(group.conversation_id, group.counts, count, prompts[-1] if prompts else None)
+
+        answered = sum(1 for item in self.items if not item.error)
+        return {
+            'done': True,
+            'saved': True,
+            'items': len(self.items),
+            'answered': answered,
+            'failed': len(self.items) - answered,
+            'messages_written': saved
+        }
@@ -1,7 +1,18 @@
-from models import db, Conversation, Message, Product, Order, OrderItem, InventoryItem, UserData
-from sqlalchemy import func, and_
+from models import db, User, Conversation, Product, Order, OrderItem, UserData
 from llm_service import LLMService
-import re
+import aggregates
+from cache import context_cache
+from product_search import product_search
+from history import recent_history
+from persistence import Exchange, new_conversation, pending_row, save_exchanges, write_behind
+from archive import rehydrate
+from snapshot import analytics_snapshot
+from summaries import summarizer, covered_by_summary, needs_summary
+from metrics import chat_stream_ttft, chat_streams
+from tracing import span, traced
+from intent_router import (route, TOP_PRODUCTS, ORDER_STATUS, INVENTORY, PRODUCT_INFO,
+                           CATEGORY_CONTEXT, INVENTORY_CONTEXT, PRODUCT_MENTION)
+import time
 from datetime import datetime
 
 class ChatService:
@@ -10,71 +21,54 @@ class ChatService:
     def __init__(self):
         self.llm_service = LLMService()
     
-    def process_chat_message(self, user_message, conversation_id=None, user_id=None):
+    def process_chat_message(self, user_message, conversation_id=None, user_id=None, deadline=None):
         """
-        Process a user message and return AI response
+        Process a user message and return AI response.
+        deadline is an optional time.monotonic() value for the LLM call.
         """
         try:
-            # Create conversation if not provided
-            if not conversation_id and user_id:
-                conversation = Conversation(user_id=user_id, title="New Chat")
-                db.session.add(conversation)
-                db.session.commit()
-                conversation_id = conversation.id
-            elif conversation_id:
-                conversation = Conversation.query.get(conversation_id)
-                if not conversation:
-                    return {"error": "Conversation not found"}, 404
-            else:
-                return {"error": "Either conversation_id or user_id is required"}, 400
+            asked_at = datetime.utcnow()
+            conversation, error = self._resolve_conversation(conversation_id, user_id)
+            if error:
+                return error
+            conversation_id = conversation.id
+            counts = self._summary_counts(conversation)
             
             # Get conversation history for context
-            conversation_history = []
-            if conversation.messages:
-                for msg in conversation.messages[-10:]:  # Last 10 messages
-                    conversation_history.append({
-                        'role': msg.role,
-                        'content': msg.content
-                    })
-            
-            # Save user message
-            user_msg = Message(
-                conversation_id=conversation_id,
-                role='user',
-                content=user_message
-            )
-            db.session.add(user_msg)
+            conversation_history = self._conversation_history(conversation)
             
             # Check if we need more information
             missing_info = self._check_missing_information(user_message)
+            prompt = None
             
             if missing_info:
                 # Ask clarifying question
-                ai_response = self.llm_service.ask_clarifying_question(user_message, missing_info)
+                ai_response = self.llm_service.ask_clarifying_question(user_message, missing_info, deadline=deadline)
             else:
                 # Get database context for the query
                 context = self._get_database_context(user_message)
+                prompt = self._pack_prompt(conversation, user_message, conversation_history, context)
                 
                 # Generate AI response with LLM
                 ai_response = self.llm_service.generate_response(
                     user_message=user_message,
                     conversation_history=conversation_history,
-                    context=context
+                    context=context,
+                    deadline=deadline,
+                    prompt=prompt
                 )
             
-            # Save AI response
-            ai_msg = Message(
-                conversation_id=conversation_id,
-                role='assistant',
-                content=ai_response
-            )
-            db.session.add(ai_msg)
-            db.session.commit()
+            # Save user message and AI response
+            exchange = self._save_exchange(conversation, user_message, ai_response, asked_at)
+            self._summarize_if_needed(conversation_id, counts, len(exchange.messages), prompt)
             
             return {
                 "conversation_id": conversation_id,
                 "user_message": user_message,
                 "ai_response": ai_response,
+                "prompt_tokens": prompt.report() if prompt else None,
+                "write_ms": exchange.write_ms,
+                "analytics": analytics_snapshot.report(),
                 "timestamp": datetime.utcnow().isoformat()
             }
             
@@ -82,88 +76,250 @@ class ChatService:
             db.session.rollback()
             return {"error": str(e)}, 500
     
+    def stream_chat_message(self, user_message, conversation_id=None, user_id=None, deadline=None):
+        """
+        Process a user message and stream the AI response.
+        Returns a generator of events ({'type': 'start' | 'delta' | 'done', ...})
+        or an (error, status) tuple. Both messages are saved once the stream
+        completes or the client goes away.
+        """
+        try:
+            started = time.perf_counter()
+            asked_at = datetime.utcnow()
+            conversation, error = self._resolve_conversation(conversation_id, user_id)
+            if error:
+                return error
+            counts = self._summary_counts(conversation)
+            conversation_history = self._conversation_history(conversation)
+            
+            missing_info = self._check_missing_information(user_message)
+            prompt = None
+            if missing_info:
+                chunks = iter([self.llm_service.ask_clarifying_question(user_message, missing_info, deadline=deadline)])
+            else:
+                context = self._get_database_context(user_message)
+                prompt = self._pack_prompt(conversation, user_message, conversation_history, context)
+                chunks = self.llm_service.stream_response(
+                    user_message=user_message,
+                    conversation_history=conversation_history,
+                    context=context,
+                    deadline=deadline,
+                    prompt=prompt
+                )
+            
+            return self._relay_stream(conversation, user_message, chunks, started, prompt, counts, asked_at)
+            
+        except Exception as e:
+            db.session.rollback()
+            return {"error": str(e)}, 500
+    
+    def _relay_stream(self, conversation, user_message, chunks, started, prompt=None, counts=(0, 0), asked_at=None):
+        """Yield stream events for the LLM chunks and persist the exchange at the end"""
+        conversation_id = conversation.id
+        parts = []
+        ttft = None
+        saved = False
+        try:
+            yield {'type': 'start', 'conversation_id': conversation_id}
+            
+            with span('llm.stream'):
+                for delta in chunks:
+                    if ttft is None:
+                        ttft = time.perf_counter() - started
+                        chat_stream_ttft.observe(ttft)
+                    parts.append(delta)
+                    yield {'type': 'delta', 'content': delta}
+            
+            exchange = self._save_exchange(conversation, user_message, ''.join(parts), asked_at)
+            saved = True
+            chat_streams.inc(outcome='completed')
+            self._summarize_if_needed(conversation_id, counts, len(exchange.messages), prompt)
+            
+            yield {
+                'type': 'done',
+                'conversation_id': conversation_id,
+                'ttft_ms': round(ttft * 1000, 1) if ttft is not None else None,
+                'prompt_tokens': prompt.report() if prompt else None,
+                'write_ms': exchange.write_ms,
+                'analytics': analytics_snapshot.report(),
+                'timestamp': datetime.utcnow().isoformat()
+            }
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+            if not saved:
+                # Client disconnected (or the stream failed) before completion; keep what was produced
+                chat_streams.inc(outcome='cancelled')
+                try:
+                    self._save_exchange(conversation, user_message, ''.join(parts), asked_at)
+                except Exception as e:
+                    print(f"Error saving cancelled stream: {str(e)}")
+    
+    @traced('chat.save_exchange')
+    def _save_exchange(self, conversation, user_message, ai_response, asked_at=None):
+        """
+        Persist a user message and the assistant reply (if any), together
+        with the conversation if it is new, in one transaction (or queued
+        for write-behind). Returns the Exchange, with write_ms set.
+        """
+        exchange = Exchange.build(conversation.id, user_message, ai_response, asked_at,
+                                  conversation=pending_row(conversation))
+        exchange.write_ms = round(save_exchanges([exchange]) * 1000, 2)
+        return exchange
+    
+    @traced('chat.resolve_conversation')
+    def _resolve_conversation(self, conversation_id, user_id):
+        """
+        Load the conversation, or start one for the user if no id was given.
+        A new conversation is only written with the first exchange.
+        Returns (conversation, None) or (None, (error, status)).
+        """
+        if not conversation_id and user_id:
+            # Checked before the LLM is called; a write-behind exchange is only validated when flushed
+            if db.session.get(User, user_id) is None:
+                return None, ({"error": "User not found"}, 404)
+            conversation = new_conversation(user_id)
+        elif conversation_id:
+            # Queued write-behind exchanges of this conversation must be visible first
+            write_behind.barrier(conversation_id)
+            conversation = Conversation.query.get(conversation_id)
+            if not conversation:
+                return None, ({"error": "Conversation not found"}, 404)
+            rehydrate(db.session, conversation)
+        else:
+            return None, ({"error": "Either conversation_id or user_id is required"}, 400)
+        return conversation, None
+    
+    @traced('chat.history')
+    def _conversation_history(self, conversation):
+        """Last HISTORY_WINDOW messages of the conversation as role/content dicts"""
+        if pending_row(conversation) is not None:
+            return []
+        return recent_history(conversation.id)
+    
+    def _summary_counts(self, conversation):
+        """(message_count, summary_message_count) of a conversation before this exchange"""
+        return conversation.message_count or 0, conversation.summary_message_count or 0
+    
+    @traced('chat.pack_prompt')
+    def _pack_prompt(self, conversation, user_message, conversation_history, context):
+        """Pack the LLM prompt into the token budget, with the rolling summary standing in for folded messages"""
+        message_count, summary_message_count = self._summary_counts(conversation)
+        summarized = covered_by_summary(conversation_history, message_count, summary_message_count)
+        return self.llm_service.pack_prompt(user_message, conversation_history, context, conversation.summary, summarized,
+                                            conversation.summary_source_tokens or 0)
+    
+    def _summarize_if_needed(self, conversation_id, counts, written, prompt):
+        """Queue a summary update in the background once messages are about to leave the prompt unsummarized"""
+        message_count, summary_message_count = counts
+        dropped = prompt.dropped_messages if prompt else 0
+        if needs_summary(message_count + written, summary_message_count, dropped):
+            summarizer.request(conversation_id)
+    
     def _check_missing_information(self, user_message):
         """
         Check if the user message is missing required information
         """
-        message_lower = user_message.lower()
+        intents = route(user_message)
         
         # Check for order status queries without order ID
-        if any(word in message_lower for word in ['order', 'status', 'track']) and not re.search(r'\d+', user_message):
+        if intents.has(ORDER_STATUS) and intents.order_id is None:
             return "order ID"
         
         # Check for inventory queries without product name
-        if any(word in message_lower for word in ['stock', 'inventory', 'available', 'left']) and not any(word in message_lower for word in ['product', 'item', 't-shirt', 'shirt', 'pants', 'dress']):
+        if intents.has(INVENTORY) and not intents.has(PRODUCT_MENTION):
             return "product name"
         
         return None
     
+    @traced('chat.database_context')
     def _get_database_context(self, user_message):
         """
         Get relevant database context for the user query
         """
-        message_lower = user_message.lower()
-        context_parts = []
-        
         try:
-            # Get top products context
-            if any(word in message_lower for word in ['top', 'best', 'most sold', 'popular']):
-                top_products = db.session.query(
-                    Product.name,
-                    Product.brand,
-                    func.count(OrderItem.id).label('sales_count')
-                ).join(OrderItem, Product.id == OrderItem.product_id)\
-                 .group_by(Product.name, Product.brand)\
-                 .order_by(func.count(OrderItem.id).desc())\
-                 .limit(3).all()
-                
-                if top_products:
-                    context_parts.append("Top selling products: " + ", ".join([f"{p.name} ({p.brand}) - {p.sales_count} sold" for p in top_products]))
-            
-            # Get product categories context
-            if 'product' in message_lower or 'category' in message_lower:
-                categories = db.session.query(
-                    Product.category,
-                    func.count(Product.id).label('count')
-                ).filter(Product.category.isnot(None))\
-                 .group_by(Product.category)\
-                 .order_by(func.count(Product.id).desc())\
-                 .limit(5).all()
-                
-                if categories:
-                    context_parts.append("Product categories: " + ", ".join([f"{c.category} ({c.count} products)" for c in categories]))
-            
-            # Get inventory context
-            if any(word in message_lower for word in ['stock', 'inventory', 'available']):
-                total_products = Product.query.count()
-                total_inventory = InventoryItem.query.count()
-                available_inventory = InventoryItem.query.filter(InventoryItem.sold_at.is_(None)).count()
-                
-                context_parts.append(f"Inventory summary: {total_products} products, {total_inventory} total items, {available_inventory} available")
-            
-            return "; ".join(context_parts) if context_parts else None
+            context_parts = [
+                context_cache.get_or_build(key, lambda key=key: self._build_context(key))
+                for key in self._context_keys(user_message)
+            ]
+            return self._join_context(context_parts)
             
         except Exception as e:
             print(f"Error getting database context: {str(e)}")
             return None
     
+    def _context_keys(self, user_message):
+        """Cache keys of the context parts relevant to a message, e.g. ('top_products', 3)"""
+        intents = route(user_message)
+        keys = []
+        
+        # Top products context
+        if intents.has(TOP_PRODUCTS):
+            keys.append(('top_products', 3))
+        
+        # Product categories context
+        if intents.has(CATEGORY_CONTEXT):
+            keys.append(('categories', 5))
+        
+        # Inventory context
+        if intents.has(INVENTORY_CONTEXT):
+            keys.append(('inventory_summary',))
+        
+        return keys
+    
+    def _analytics(self):
+        """
+        Source of the analytic context: the columnar snapshot when it is
+        enabled and fresh enough, the aggregate tables otherwise. Both answer
+        the same queries with the same row shapes.
+        """
+        return analytics_snapshot.current() or aggregates
+    
+    def _build_context(self, key, analytics=None):
+        """Build the context string for a cache key"""
+        analytics = analytics or self._analytics()
+        kind, *args = key
+        if kind == 'top_products':
+            return self._format_top_products(analytics.top_selling_products(*args))
+        if kind == 'categories':
+            return self._format_categories(analytics.top_categories(*args))
+        return self._format_inventory(analytics.inventory_summary())
+    
+    def _join_context(self, context_parts):
+        context_parts = [part for part in context_parts if part]
+        return "; ".join(context_parts) if context_parts else None
+    
+    def _format_top_products(self, top_products):
+        if not top_products:
+            return None
+        return "Top selling products: " + ", ".join([f"{p.name} ({p.brand}) - {p.sales_count} sold" for p in top_products])
+    
+    def _format_categories(self, categories):
+        if not categories:
+            return None
+        return "Product categories: " + ", ".join([f"{category} ({count} products)" for category, count in categories])
+    
+    def _format_inventory(self, summary):
+        return f"Inventory summary: {summary['products']} products, {summary['inventory_items']} total items, {summary['available']} available"
+    
     def _generate_response(self, user_message):
         """
         Generate AI response based on user message (fallback method)
         """
         message_lower = user_message.lower()
+        intents = route(user_message)
         
         # Check for different types of queries
-        if any(word in message_lower for word in ['top', 'best', 'most sold', 'popular']):
+        if intents.intent == TOP_PRODUCTS:
             return self._handle_top_products_query(message_lower)
         
-        elif any(word in message_lower for word in ['order', 'status', 'track']):
-            return self._handle_order_status_query(message_lower)
+        elif intents.intent == ORDER_STATUS:
+            return self._handle_order_status_query(intents.order_id)
         
-        elif any(word in message_lower for word in ['stock', 'inventory', 'available', 'left']):
+        elif intents.intent == INVENTORY:
             return self._handle_inventory_query(message_lower)
         
-        elif any(word in message_lower for word in ['product', 'item', 'catalog']):
+        elif intents.intent == PRODUCT_INFO:
             return self._handle_product_query(message_lower)
         
         else:
@@ -172,16 +328,8 @@ class ChatService:
     def _handle_top_products_query(self, message):
         """Handle queries about top selling products"""
         try:
-            # Query to get top selling products
-            top_products = db.session.query(
-                Product.name,
-                Product.brand,
-                Product.category,
-                func.count(OrderItem.id).label('sales_count')
-            ).join(OrderItem, Product.id == OrderItem.product_id)\
-             .group_by(Product.name, Product.brand, Product.category)\
-             .order_by(func.count(OrderItem.id).desc())\
-             .limit(5).all()
+            # Read top selling products from the snapshot or the sales aggregate
+            top_products = self._analytics().top_selling_products(5)
             
             if not top_products:
                 return "I couldn't find any sales data for products."
@@ -195,16 +343,12 @@ class ChatService:
         except Exception as e:
             return f"Sorry, I encountered an error while retrieving top products: {str(e)}"
     
-    def _handle_order_status_query(self, message):
-        """Handle queries about order status"""
+    def _handle_order_status_query(self, order_id):
+        """Handle queries about order status, given the order ID extracted by the intent router"""
         try:
-            # Extract order ID from message
-            order_id_match = re.search(r'(\d+)', message)
-            if not order_id_match:
+            if order_id is None:
                 return "Please provide an order ID. For example: 'Show me the status of order ID 12345'"
             
-            order_id = int(order_id_match.group(1))
-            
             # Query order information
             order = Order.query.filter_by(order_id=order_id).first()
             if not order:
@@ -233,44 +377,18 @@ class ChatService:
     def _handle_inventory_query(self, message):
         """Handle queries about inventory/stock levels"""
         try:
-            # Extract product name from message
-            product_name = None
-            
-            # Check for specific product mentions
-            if 'classic t-shirt' in message or 'classic tshirt' in message:
-                product_name = 'Classic T-Shirt'
-            elif 't-shirt' in message or 'tshirt' in message:
-                product_name = 'T-Shirt'
-            else:
-                # Try to extract any product name
-                words = message.split()
-                for word in words:
-                    if len(word) > 3:  # Skip short words
-                        matching_product = Product.query.filter(
-                            Product.name.ilike(f'%{word}%')
-                        ).first()
-                        if matching_product:
-                            product_name = matching_product.name
-                            break
-            
-            if not product_name:
+            # Find the best matching product for the whole message in one pass
+            match = product_search.best_match(message)
+            if not match:
                 return "Please specify which product you'd like to check inventory for. For example: 'How many Classic T-Shirts are left in stock?'"
             
-            # Query inventory information
-            product = Product.query.filter_by(name=product_name).first()
+            product = db.session.get(Product, match.product_id)
             if not product:
-                return f"Product '{product_name}' not found in our inventory."
-            
-            # Count available inventory (not sold)
-            available_inventory = InventoryItem.query.filter(
-                and_(
-                    InventoryItem.product_id == product.id,
-                    InventoryItem.sold_at.is_(None)
-                )
-            ).count()
+                return f"Product '{match.name}' not found in our inventory."
+            product_name = product.name
             
-            # Count total inventory
-            total_inventory = InventoryItem.query.filter_by(product_id=product.id).count()
+            # Read total and available (not sold) inventory from the snapshot or the aggregate
+            total_inventory, available_inventory = self._analytics().product_inventory(product.id)
             
             response = f"Inventory Status for {product_name}:\n"
             response += f"Available in stock: {available_inventory} units\n"
@@ -285,26 +403,11 @@ class ChatService:
     def _handle_product_query(self, message):
         """Handle general product information queries"""
         try:
-            # Get product statistics
-            total_products = Product.query.count()
-            
-            # Get top categories
-            top_categories = db.session.query(
-                Product.category,
-                func.count(Product.id).label('count')
-            ).filter(Product.category.isnot(None))\
-             .group_by(Product.category)\
-             .order_by(func.count(Product.id).desc())\
-             .limit(5).all()
-            
-            # Get top brands
-            top_brands = db.session.query(
-                Product.brand,
-                func.count(Product.id).label('count')
-            ).filter(Product.brand.isnot(None))\
-             .group_by(Product.brand)\
-             .order_by(func.count(Product.id).desc())\
-             .limit(5).all()
+            # Get product statistics, top categories and top brands
+            analytics = self._analytics()
+            total_products = analytics.get_total(Product.__tablename__)
+            top_categories = analytics.top_categories(5)
+            top_brands = analytics.top_brands(5)
             
             response = f"Product Information:\n\n"
             response += f"Total products: {total_products}\n\n"
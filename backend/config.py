@@ -3,6 +3,30 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+def db_pool_size(worker_class, threads, worker_connections, background_threads):
+    """
+    Connections one worker needs: one per request it serves at once (capped
+    for gevent, where extra greenlets wait for a connection) plus the
+    background threads that query the database.
+    """
+    if worker_class == 'sync':
+        concurrency = 1
+    elif worker_class == 'gevent':
+        concurrency = min(worker_connections, 20)
+    else:
+        concurrency = threads
+    return concurrency + background_threads
+
+def engine_options(url, pool_size, max_overflow, pool_timeout, pool_recycle, statement_timeout_ms):
+    """SQLALCHEMY_ENGINE_OPTIONS for a database URL; SQLite keeps its default pool"""
+    options = {'pool_pre_ping': True}
+    if url.startswith('sqlite'):
+        return options
+    options.update(pool_size=pool_size, max_overflow=max_overflow, pool_timeout=pool_timeout, pool_recycle=pool_recycle)
+    if statement_timeout_ms and url.startswith('postgresql'):
+        options['connect_args'] = {'options': f'-c statement_timeout={int(statement_timeout_ms)}'}
+    return options
+
 class Config:
     # Database Configuration
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', 'postgresql://localhost:5432/conversational_ai')
@@ -11,10 +35,126 @@ class Config:
     # Groq API Configuration
     GROQ_API_KEY = os.getenv('GROQ_API_KEY')
     GROQ_MODEL = 'llama3-8b-8192'  # Using Llama3 model
+    GROQ_API_URL = os.getenv('GROQ_API_URL', 'https://api.groq.com/openai/v1/chat/completions')
+    
+    # LLM Client Configuration
+    LLM_POOL_SIZE = int(os.getenv('LLM_POOL_SIZE', '20'))
+    LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '2'))
+    LLM_BACKOFF_BASE = float(os.getenv('LLM_BACKOFF_BASE', '0.25'))
+    LLM_BACKOFF_MAX = float(os.getenv('LLM_BACKOFF_MAX', '2.0'))
+    LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', '3.05'))
+    LLM_BREAKER_THRESHOLD = int(os.getenv('LLM_BREAKER_THRESHOLD', '5'))
+    LLM_BREAKER_RESET = float(os.getenv('LLM_BREAKER_RESET', '30'))
+    CHAT_REQUEST_DEADLINE = float(os.getenv('CHAT_REQUEST_DEADLINE', '25'))
+    CHAT_BATCH_MAX_ITEMS = int(os.getenv('CHAT_BATCH_MAX_ITEMS', '100'))
+    CHAT_BATCH_CONCURRENCY = int(os.getenv('CHAT_BATCH_CONCURRENCY', '8'))  # concurrent LLM calls for batches, per process
+    
+    # Async (ASGI) Serving Configuration
+    ASYNC_LLM_POOL_SIZE = int(os.getenv('ASYNC_LLM_POOL_SIZE', '1000'))
+    ASYNC_DB_POOL_SIZE = int(os.getenv('ASYNC_DB_POOL_SIZE', '20'))
+    ASYNC_DB_MAX_OVERFLOW = int(os.getenv('ASYNC_DB_MAX_OVERFLOW', '10'))
+    
+    # Conversation History Configuration
+    HISTORY_WINDOW = int(os.getenv('HISTORY_WINDOW', '10'))  # messages sent to the LLM as context
+    HISTORY_BUFFER_CONVERSATIONS = int(os.getenv('HISTORY_BUFFER_CONVERSATIONS', '1000'))
+    CONVERSATIONS_PAGE_SIZE = int(os.getenv('CONVERSATIONS_PAGE_SIZE', '20'))
+    CONVERSATIONS_MAX_PAGE_SIZE = int(os.getenv('CONVERSATIONS_MAX_PAGE_SIZE', '100'))
+    MESSAGES_PAGE_SIZE = int(os.getenv('MESSAGES_PAGE_SIZE', '50'))
+    MESSAGES_MAX_PAGE_SIZE = int(os.getenv('MESSAGES_MAX_PAGE_SIZE', '200'))
+    EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '500'))
+    
+    # Message Persistence Configuration
+    MESSAGE_WRITE_BEHIND = os.getenv('MESSAGE_WRITE_BEHIND', 'False').lower() == 'true'  # acknowledge chats once logged locally
+    WRITE_BEHIND_DIR = os.getenv('WRITE_BEHIND_DIR', 'instance/write_behind')  # one log per process; keep it on a persistent volume
+    WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv('WRITE_BEHIND_FLUSH_INTERVAL', '0.05'))  # seconds an exchange may wait for a batch
+    WRITE_BEHIND_BATCH_SIZE = int(os.getenv('WRITE_BEHIND_BATCH_SIZE', '200'))  # exchanges per transaction
+    WRITE_BEHIND_FSYNC = os.getenv('WRITE_BEHIND_FSYNC', 'True').lower() == 'true'
+    WRITE_BEHIND_MAX_LOG_BYTES = int(os.getenv('WRITE_BEHIND_MAX_LOG_BYTES', str(64 * 1024 * 1024)))  # compact the log past this
+    WRITE_BEHIND_BARRIER_TIMEOUT = float(os.getenv('WRITE_BEHIND_BARRIER_TIMEOUT', '5'))  # seconds a read waits for queued writes
+    
+    # Message Archival and Retention Configuration (archive.py)
+    ARCHIVE_IDLE_DAYS = int(os.getenv('ARCHIVE_IDLE_DAYS', '90'))  # archive conversations idle this long; 0 = never
+    ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', '100'))  # conversations per transaction
+    ARCHIVE_COMPRESSION_LEVEL = int(os.getenv('ARCHIVE_COMPRESSION_LEVEL', '6'))
+    RETENTION_DAYS = int(os.getenv('RETENTION_DAYS', '0'))  # delete conversations idle this long; 0 = keep forever
+    PURGE_BATCH_SIZE = int(os.getenv('PURGE_BATCH_SIZE', '1000'))  # rows per delete
+    PURGE_PAUSE = float(os.getenv('PURGE_PAUSE', '0.05'))  # seconds between batches
+    MESSAGE_PARTITION_MONTHS_AHEAD = int(os.getenv('MESSAGE_PARTITION_MONTHS_AHEAD', '3'))  # PostgreSQL
+    
+    # Analytics Snapshot Configuration (snapshot.py)
+    ANALYTICS_SNAPSHOT = os.getenv('ANALYTICS_SNAPSHOT', 'False').lower() == 'true'  # export after loads and answer analytic chat context from it
+    ANALYTICS_SNAPSHOT_DIR = os.getenv('ANALYTICS_SNAPSHOT_DIR', 'instance/analytics_snapshot')  # shared by the workers of a host
+    ANALYTICS_SNAPSHOT_MAX_AGE = float(os.getenv('ANALYTICS_SNAPSHOT_MAX_AGE', '86400'))  # seconds before chats fall back to the database; 0 = no limit
+    ANALYTICS_SNAPSHOT_CHECK_INTERVAL = float(os.getenv('ANALYTICS_SNAPSHOT_CHECK_INTERVAL', '5'))  # seconds between checks for a new snapshot
+    ANALYTICS_SNAPSHOT_BATCH_SIZE = int(os.getenv('ANALYTICS_SNAPSHOT_BATCH_SIZE', '50000'))  # rows per record batch
+    
+    # Prompt Packing Configuration
+    PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '3000'))  # estimated tokens per chat prompt
+    SUMMARY_ENABLED = os.getenv('SUMMARY_ENABLED', 'True').lower() == 'true'
+    SUMMARY_TRIGGER_MESSAGES = int(os.getenv('SUMMARY_TRIGGER_MESSAGES', os.getenv('HISTORY_WINDOW', '10')))  # unsummarized messages before folding
+    SUMMARY_KEEP_MESSAGES = int(os.getenv('SUMMARY_KEEP_MESSAGES', '4'))  # latest messages always kept out of the summary
+    SUMMARY_MAX_BATCH = int(os.getenv('SUMMARY_MAX_BATCH', '40'))  # messages folded per summarization call
+    SUMMARY_MAX_TOKENS = int(os.getenv('SUMMARY_MAX_TOKENS', '300'))
+    SUMMARY_WORKERS = int(os.getenv('SUMMARY_WORKERS', '2'))
+    
+    # Tracing and Query Profiling Configuration
+    TRACE_LOG_PATH = os.getenv('TRACE_LOG_PATH', '')  # JSON lines of slow request traces; empty = off
+    TRACE_SLOW_THRESHOLD_MS = float(os.getenv('TRACE_SLOW_THRESHOLD_MS', '1000'))
+    QUERY_PROFILER_ENABLED = os.getenv('QUERY_PROFILER_ENABLED', 'True').lower() == 'true'
+    QUERY_SLOW_THRESHOLD_MS = float(os.getenv('QUERY_SLOW_THRESHOLD_MS', '200'))
+    QUERY_REPEAT_THRESHOLD = int(os.getenv('QUERY_REPEAT_THRESHOLD', '5'))  # same statement shape per request before it is flagged as N+1
+    QUERY_EXPLAIN_SLOW = os.getenv('QUERY_EXPLAIN_SLOW', 'True').lower() == 'true'
+    QUERY_LOG_PATH = os.getenv('QUERY_LOG_PATH', '')  # JSON lines of slow queries; empty = print them
+    QUERY_LOG_PARAMETERS = os.getenv('QUERY_LOG_PARAMETERS', 'False').lower() == 'true'  # raw bound values in QUERY_LOG_PATH; they include chat messages
+    QUERY_BUDGET = int(os.getenv('QUERY_BUDGET', '0'))  # statements per request; 0 = no budget
+    QUERY_BUDGET_STRICT = os.getenv('QUERY_BUDGET_STRICT', 'False').lower() == 'true'  # fail requests over budget (always on in testing mode)
     
     # Application Configuration
     SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-here')
     DEBUG = os.getenv('DEBUG', 'True').lower() == 'true'
+    ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')  # bearer token for admin endpoints; empty = only in testing mode
+    
+    # Cache Configuration
+    CONTEXT_CACHE_SIZE = int(os.getenv('CONTEXT_CACHE_SIZE', '256'))
+    CONTEXT_CACHE_TTL = float(os.getenv('CONTEXT_CACHE_TTL', '300'))
+    CACHE_VERSION_CHECK_INTERVAL = float(os.getenv('CACHE_VERSION_CHECK_INTERVAL', '1.0'))
+    LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'True').lower() == 'true'
+    LLM_CACHE_SIZE = int(os.getenv('LLM_CACHE_SIZE', '1024'))
+    LLM_CACHE_TTL = float(os.getenv('LLM_CACHE_TTL', '3600'))
+    LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', 'instance/llm_response_cache.db')  # empty = memory only
+    
+    # Statistics Configuration
+    STATS_EXACT_MAX_AGE = float(os.getenv('STATS_EXACT_MAX_AGE', '300'))  # seconds before exact counts are refreshed
+    
+    # Serving Configuration (gunicorn.conf.py)
+    SERVER_BIND = os.getenv('SERVER_BIND', '0.0.0.0:5000')
+    SERVER_WORKER_CLASS = os.getenv('SERVER_WORKER_CLASS', 'threaded')  # sync | threaded | gevent
+    SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', '0'))  # 0 = from the CPU count (1 with MESSAGE_WRITE_BEHIND)
+    SERVER_THREADS = int(os.getenv('SERVER_THREADS', '8'))  # per worker, threaded model
+    SERVER_WORKER_CONNECTIONS = int(os.getenv('SERVER_WORKER_CONNECTIONS', '200'))  # per worker, gevent model
+    SERVER_PRELOAD = os.getenv('SERVER_PRELOAD', 'True').lower() == 'true'
+    SERVER_WARMUP = os.getenv('SERVER_WARMUP', 'True').lower() == 'true'
+    SERVER_TIMEOUT = int(os.getenv('SERVER_TIMEOUT', str(int(CHAT_REQUEST_DEADLINE) + 15)))
+    SERVER_GRACEFUL_TIMEOUT = int(os.getenv('SERVER_GRACEFUL_TIMEOUT', '30'))
+    SERVER_KEEPALIVE = int(os.getenv('SERVER_KEEPALIVE', '5'))
+    SERVER_MAX_REQUESTS = int(os.getenv('SERVER_MAX_REQUESTS', '5000'))  # recycle a worker after this many; 0 = never
+    SERVER_MAX_REQUESTS_JITTER = int(os.getenv('SERVER_MAX_REQUESTS_JITTER', '500'))
+    SERVER_PIDFILE = os.getenv('SERVER_PIDFILE', '')
+    
+    # Database Pool Configuration, per worker process
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '0')) or db_pool_size(
+        SERVER_WORKER_CLASS, SERVER_THREADS, SERVER_WORKER_CONNECTIONS, SUMMARY_WORKERS + 1 + int(MESSAGE_WRITE_BEHIND))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '5'))
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+    DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', '15000'))  # PostgreSQL; 0 = none
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(
+        SQLALCHEMY_DATABASE_URI, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_STATEMENT_TIMEOUT_MS)
+    # Loaders and migrations run long statements on purpose
+    BATCH_ENGINE_OPTIONS = engine_options(
+        SQLALCHEMY_DATABASE_URI, 2, 0, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, 0)
     
     # Dataset Configuration
-    DATASET_PATH = '../ecommerce-dataset/archive' 
\ No newline at end of file
+    DATASET_PATH = '../ecommerce-dataset/archive'
+    LOAD_CHUNK_SIZE = int(os.getenv('LOAD_CHUNK_SIZE', '50000'))
+    SYNC_CHUNK_SIZE = int(os.getenv('SYNC_CHUNK_SIZE', '10000')) 
\ No newline at end of file
@@ -0,0 +1,20 @@
+from models import db
+
+def upsert_statement(table, index_elements, set_=None):
+    """
+    Dialect-specific INSERT ... ON CONFLICT DO UPDATE for a table.
+    By default every non-key column is overwritten with the incoming value;
+    pass set_ to build custom update expressions from the statement's
+    "excluded" row, e.g. for incrementing counters.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+
+    stmt = insert(table)
+    if set_ is None:
+        set_ = {c.name: stmt.excluded[c.name] for c in table.columns if c.name not in index_elements}
+    else:
+        set_ = set_(stmt.excluded)
+    return stmt.on_conflict_do_update(index_elements=index_elements, set_=set_)
@@ -0,0 +1,162 @@
+"""
+Local fake of the Groq/OpenAI chat completions API for development,
+benchmarks and failure testing.
+
+    python fake_llm_server.py --port 8090 --latency 0.5 --token-delay 0.02
+
+then point the backend at it:
+
+    GROQ_API_URL=http://localhost:8090/openai/v1/chat/completions GROQ_API_KEY=fake python app.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = ("Thanks for reaching out! Our top sellers this week are the Classic T-Shirt, "
+                 "the Slim Jeans and the Fleece Hoodie. Is there anything else I can help you with?")
+
+class FakeLLMConfig:
+    """Behaviour knobs of the fake server, adjustable while it is running"""
+
+    def __init__(self, latency=0.0, token_delay=0.0, reply=DEFAULT_REPLY, error_rate=0.0, error_status=503):
+        self.latency = latency          # seconds before the first byte
+        self.token_delay = token_delay  # seconds between streamed tokens
+        self.reply = reply
+        self.error_rate = error_rate    # fraction of requests answered with error_status
+        self.error_status = error_status
+        self.fail_next = 0              # answer this many upcoming requests with error_status
+        self.requests = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    config = None
+
+    def setup(self):
+        super().setup()
+        with self.config.lock:
+            self.config.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        config = self.config
+        with config.lock:
+            config.requests += 1
+            forced_failure = config.fail_next > 0
+            if forced_failure:
+                config.fail_next -= 1
+
+        if not self.path.endswith('/chat/completions'):
+            return self._send_json(404, {'error': {'message': 'not found'}})
+
+        time.sleep(config.latency)
+
+        if forced_failure or (config.error_rate and random.random() < config.error_rate):
+            return self._send_json(config.error_status, {'error': {'message': 'fake upstream error'}})
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        model = payload.get('model', 'fake-model')
+        tokens = [token + ' ' for token in config.reply.split(' ')]
+        tokens[-1] = tokens[-1].rstrip()
+        tokens = tokens[:payload.get('max_tokens') or len(tokens)]
+
+        if not payload.get('stream'):
+            return self._send_json(200, {
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': ''.join(tokens)},
+                    'finish_reason': 'stop'
+                }],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': len(tokens), 'total_tokens': len(tokens)}
+            })
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        try:
+            for token in tokens:
+                self._send_event({
+                    'id': completion_id,
+                    'object': 'chat.completion.chunk',
+                    'model': model,
+                    'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]
+                })
+                time.sleep(config.token_delay)
+            self._send_event({
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'model': model,
+                'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]
+            })
+            self.wfile.write(b'data: [DONE]\n\n')
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _send_event(self, data):
+        self.wfile.write(f"data: {json.dumps(data)}\n\n".encode())
+        self.wfile.flush()
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class FakeLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # load tests open hundreds of connections at once
+
+def start_fake_llm_server(host='127.0.0.1', port=0, **options):
+    """
+    Start the fake server on a background thread.
+    Returns (server, config, url) where url is the chat completions endpoint.
+    """
+    config = FakeLLMConfig(**options)
+    handler = type('ConfiguredFakeLLMHandler', (FakeLLMHandler,), {'config': config})
+    server = FakeLLMServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://{host}:{server.server_address[1]}/openai/v1/chat/completions"
+    return server, config, url
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before the first byte')
+    parser.add_argument('--token-delay', type=float, default=0.0, help='seconds between streamed tokens')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests that fail')
+    parser.add_argument('--error-status', type=int, default=503)
+    args = parser.parse_args()
+
+    server, config, url = start_fake_llm_server(
+        args.host, args.port,
+        latency=args.latency, token_delay=args.token_delay,
+        error_rate=args.error_rate, error_status=args.error_status
+    )
+    print(f"Fake LLM server listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
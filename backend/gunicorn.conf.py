@@ -0,0 +1,69 @@
+"""
+gunicorn settings for the Flask app, read from the environment through Config
+(see the Serving Configuration section there). gunicorn picks this file up
+from the working directory:
+
+    cd backend && gunicorn app:app
+    SERVER_WORKER_CLASS=sync SERVER_WORKERS=9 gunicorn app:app
+
+Worker models: `sync` (one request per process), `threaded` (gthread,
+SERVER_THREADS per process) and `gevent` (needs gevent, and psycogreen for
+PostgreSQL). Reload gracefully with `kill -HUP <master pid>`: new workers are
+started and warmed up, old ones finish their requests. With SERVER_PRELOAD
+the code lives in the master, so deploy new code with USR2 (start a new
+master) followed by QUIT to the old one.
+"""
+import multiprocessing
+import subprocess
+import sys
+from config import Config
+import serving
+
+WORKER_CLASSES = {'sync': 'sync', 'threaded': 'gthread', 'gevent': 'gevent'}
+
+worker_model = Config.SERVER_WORKER_CLASS
+if worker_model not in WORKER_CLASSES:
+    raise ValueError(f"SERVER_WORKER_CLASS must be one of {', '.join(WORKER_CLASSES)}, not {worker_model!r}")
+
+bind = Config.SERVER_BIND
+worker_class = WORKER_CLASSES[worker_model]
+# Read-your-writes of write-behind exchanges only holds within the process that queued them
+workers = Config.SERVER_WORKERS or (1 if Config.MESSAGE_WRITE_BEHIND else
+                                    serving.default_workers(worker_model, multiprocessing.cpu_count()))
+if Config.MESSAGE_WRITE_BEHIND and workers > 1:
+    raise ValueError(f"MESSAGE_WRITE_BEHIND needs a single worker (SERVER_WORKERS=1), not {workers}; "
+                     "use the threaded or gevent worker class for concurrency")
+threads = Config.SERVER_THREADS if worker_model == 'threaded' else 1
+worker_connections = Config.SERVER_WORKER_CONNECTIONS
+# gevent patches the standard library when a worker starts; an app imported
+# before that, in the master, would keep unpatched locks and sockets
+preload_app = Config.SERVER_PRELOAD and worker_model != 'gevent'
+timeout = Config.SERVER_TIMEOUT
+graceful_timeout = Config.SERVER_GRACEFUL_TIMEOUT
+keepalive = Config.SERVER_KEEPALIVE
+max_requests = Config.SERVER_MAX_REQUESTS
+max_requests_jitter = Config.SERVER_MAX_REQUESTS_JITTER
+pidfile = Config.SERVER_PIDFILE or None
+accesslog = '-'
+errorlog = '-'
+
+def on_starting(server):
+    # In a separate process, so the master holds no app state or connections
+    subprocess.run([sys.executable, '-c', 'import serving; serving.prepare_database()'], check=True)
+
+def post_fork(server, worker):
+    if preload_app:
+        from app import app
+        serving.after_fork(app)
+
+def post_worker_init(worker):
+    # Runs before the worker accepts connections
+    if worker_model == 'gevent':
+        serving.patch_for_gevent()
+    if Config.SERVER_WARMUP:
+        from app import app, chat_service
+        serving.warm_up(app, chat_service)
+
+def worker_exit(server, worker):
+    from app import app
+    serving.shutdown(app)
@@ -0,0 +1,164 @@
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+from sqlalchemy import select, update
+from models import db, Conversation, Message
+from config import Config
+from pagination import before, after
+
+# Characters of the latest message kept on the conversation for listings
+PREVIEW_LENGTH = 200
+
+def newest_message_statement(conversation_id):
+    """Id of the latest message of a conversation (one index probe)"""
+    return (
+        select(Message.id)
+        .where(Message.conversation_id == conversation_id)
+        .order_by(Message.created_at.desc(), Message.id.desc())
+        .limit(1)
+    )
+
+def window_statement(conversation_id, limit):
+    """Keyset read of the latest messages of a conversation, newest first"""
+    return (
+        select(Message.id, Message.role, Message.content)
+        .where(Message.conversation_id == conversation_id)
+        .order_by(Message.created_at.desc(), Message.id.desc())
+        .limit(limit)
+    )
+
+def message_position(conversation_id, value):
+    """
+    Keyset position of a before/after parameter: a message id of the
+    conversation, else an ISO timestamp. Returns None if it is neither.
+    """
+    row = db.session.execute(
+        select(Message.created_at, Message.id)
+        .where(Message.id == value, Message.conversation_id == conversation_id)
+    ).first()
+    if row is not None:
+        return row.created_at, row.id
+    try:
+        return datetime.fromisoformat(value), None
+    except ValueError:
+        return None
+
+def message_page_statement(conversation_id, limit, before_position=None, after_position=None):
+    """
+    Keyset page of a conversation's messages. Without after_position the
+    page holds the latest messages (before before_position, if given) in
+    newest-first order; with it, the messages following it oldest-first.
+    """
+    statement = (
+        select(Message.id, Message.role, Message.content, Message.created_at)
+        .where(Message.conversation_id == conversation_id)
+    )
+    if before_position is not None:
+        statement = statement.where(before(Message.created_at, Message.id, before_position))
+    if after_position is not None:
+        statement = statement.where(after(Message.created_at, Message.id, after_position))
+        return statement.order_by(Message.created_at, Message.id).limit(limit)
+    return statement.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit)
+
+def iter_messages(conversation_id, chunk_size):
+    """Every message of a conversation in order, read in keyset chunks so none is held for long"""
+    position = (datetime.min, None)
+    while True:
+        rows = db.session.execute(message_page_statement(conversation_id, chunk_size, after_position=position)).all()
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        position = (rows[-1].created_at, rows[-1].id)
+
+def activity_statement(conversation_id, count, last_content):
+    """Count newly written messages on their conversation and mark it as active"""
+    return (
+        update(Conversation)
+        .where(Conversation.id == conversation_id)
+        .values(
+            message_count=Conversation.message_count + count,
+            last_message_preview=last_content[:PREVIEW_LENGTH],
+            updated_at=datetime.utcnow()
+        )
+    )
+
+def conversation_page_statement(user_id, position, limit):
+    """
+    Keyset page of a user's conversations, most recently active first.
+    position is the (updated_at, id) of the last row of the previous page.
+    """
+    statement = select(Conversation).where(Conversation.user_id == user_id)
+    if position is not None:
+        statement = statement.where(before(Conversation.updated_at, Conversation.id, position))
+    return statement.order_by(Conversation.updated_at.desc(), Conversation.id.desc()).limit(limit)
+
+class HistoryBuffer:
+    """
+    Bounded ring buffer of the latest messages of each active conversation,
+    itself bounded to the most recently used conversations. Writers append
+    to it after committing; readers validate it against the id of the
+    newest stored message, so writes made by other workers are never missed.
+    """
+
+    def __init__(self, window, max_conversations):
+        self.window = window
+        self.max_conversations = max_conversations
+        self._buffers = OrderedDict()  # conversation id -> deque of (id, role, content)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, conversation_id, newest_id):
+        """Buffered messages if the buffer ends with newest_id, else None"""
+        with self._lock:
+            buffer = self._buffers.get(conversation_id)
+            last_id = buffer[-1][0] if buffer else None
+            if buffer is None or last_id != newest_id:
+                self.misses += 1
+                return None
+            self._buffers.move_to_end(conversation_id)
+            self.hits += 1
+            return list(buffer)
+
+    def put(self, conversation_id, rows):
+        """Replace a conversation's buffer with rows in chronological order"""
+        with self._lock:
+            self._buffers[conversation_id] = deque(rows, maxlen=self.window)
+            self._buffers.move_to_end(conversation_id)
+            while len(self._buffers) > self.max_conversations:
+                self._buffers.popitem(last=False)
+
+    def append(self, conversation_id, rows):
+        """Add freshly committed messages to a buffered conversation"""
+        with self._lock:
+            buffer = self._buffers.get(conversation_id)
+            if buffer is not None:
+                buffer.extend(rows)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'conversations': len(self._buffers),
+                'max_conversations': self.max_conversations,
+                'window': self.window,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+def as_history(rows):
+    return [{'role': role, 'content': content} for _, role, content in rows]
+
+def recent_history(conversation_id):
+    """Last HISTORY_WINDOW messages of a conversation as role/content dicts, oldest first"""
+    newest_id = db.session.execute(newest_message_statement(conversation_id)).scalar()
+    if newest_id is None:
+        return []
+    rows = history_buffer.get(conversation_id, newest_id)
+    if rows is None:
+        rows = list(reversed(db.session.execute(window_statement(conversation_id, history_buffer.window)).all()))
+        history_buffer.put(conversation_id, [tuple(row) for row in rows])
+    return as_history(rows)
+
+history_buffer = HistoryBuffer(Config.HISTORY_WINDOW, Config.HISTORY_BUFFER_CONVERSATIONS)
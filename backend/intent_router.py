@@ -0,0 +1,94 @@
+import re
+from functools import lru_cache
+
+# Intents in priority order: a message matching several is routed to the first
+TOP_PRODUCTS = 'top_products'
+ORDER_STATUS = 'order_status'
+INVENTORY = 'inventory'
+PRODUCT_INFO = 'product_info'
+GENERAL = 'general'
+INTENT_PRIORITY = [TOP_PRODUCTS, ORDER_STATUS, INVENTORY, PRODUCT_INFO]
+
+# Extra signals that select database context or detect missing information
+CATEGORY_CONTEXT = 'category_context'
+INVENTORY_CONTEXT = 'inventory_context'
+PRODUCT_MENTION = 'product_mention'
+
+# Keyword rules: signal -> substrings of the lowercased message that raise it
+RULES = {
+    TOP_PRODUCTS: ['top', 'best', 'most sold', 'popular'],
+    ORDER_STATUS: ['order', 'status', 'track'],
+    INVENTORY: ['stock', 'inventory', 'available', 'left'],
+    PRODUCT_INFO: ['product', 'item', 'catalog'],
+    CATEGORY_CONTEXT: ['product', 'category'],
+    INVENTORY_CONTEXT: ['stock', 'inventory', 'available'],
+    PRODUCT_MENTION: ['product', 'item', 't-shirt', 'shirt', 'pants', 'dress'],
+}
+
+class Route:
+    """
+    Everything the chat pipeline needs to know about one message. Routes are
+    cached and shared by every caller with the same text, so every field is
+    immutable.
+    """
+
+    __slots__ = ('intent', 'signals', 'order_id', 'numbers', 'keywords')
+
+    def __init__(self, intent, signals, order_id, numbers, keywords):
+        self.intent = intent        # highest priority intent, or GENERAL
+        self.signals = signals      # frozenset of every intent and signal raised
+        self.order_id = order_id    # first number in the message, as an int
+        self.numbers = numbers      # tuple of every number in the message
+        self.keywords = keywords    # tuple of matched keywords, in message order
+
+    def has(self, signal):
+        return signal in self.signals
+
+    def __repr__(self):
+        return f'<Route {self.intent} {sorted(self.signals)} order_id={self.order_id}>'
+
+class IntentRouter:
+    """
+    Compiles every keyword rule plus number extraction into one regular
+    expression and routes a message with a single scan. Keywords are matched
+    as overlapping substrings through a lookahead, preserving the semantics
+    of the `word in message` checks it replaces.
+    """
+
+    def __init__(self, rules=RULES):
+        keyword_signals = {}
+        for signal, keywords in rules.items():
+            for keyword in keywords:
+                keyword_signals.setdefault(keyword, set()).add(signal)
+
+        # A keyword also raises the signals of any keyword it starts with, since
+        # only the longest alternative is reported at a given position
+        self.keyword_signals = {
+            keyword: frozenset().union(*(signals for other, signals in keyword_signals.items() if keyword.startswith(other)))
+            for keyword in keyword_signals
+        }
+
+        alternatives = '|'.join(re.escape(k) for k in sorted(keyword_signals, key=len, reverse=True))
+        # The first-character class rejects most positions before trying any alternative
+        first_chars = ''.join(sorted({re.escape(k[0]) for k in keyword_signals}))
+        self.pattern = re.compile(rf'(\d+)|(?=[{first_chars}])(?=({alternatives}))')
+
+    def route(self, message):
+        numbers = []
+        keywords = []
+        for number, keyword in self.pattern.findall((message or '').lower()):
+            if number:
+                numbers.append(int(number))
+            else:
+                keywords.append(keyword)
+
+        signals = frozenset().union(*(self.keyword_signals[k] for k in set(keywords)))
+        intent = next((name for name in INTENT_PRIORITY if name in signals), GENERAL)
+        return Route(intent, signals, numbers[0] if numbers else None, tuple(numbers), tuple(keywords))
+
+router = IntentRouter()
+
+@lru_cache(maxsize=4096)
+def route(message):
+    """Route a message; repeated calls for the same text (one per call site) hit the cache"""
+    return router.route(message)
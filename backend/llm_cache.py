@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from cache import LRUCache
+from config import Config
+from metrics import Counter
+
+# Words that do not change what a support question asks for
+FILLER_WORDS = {
+    'a', 'an', 'the', 'please', 'pls', 'can', 'could', 'would', 'you', 'u', 'me', 'i', 'we', 'us',
+    'tell', 'show', 'give', 'list', 'what', 'whats', 'which', 'are', 'is', 'do', 'does', 'your',
+    'our', 'my', 'of', 'hi', 'hello', 'hey', 'thanks', 'thank', 'kindly', 'know', 'like', 'to', 'want',
+}
+
+# Rows of the local store pruned back to max_size every this many writes
+PRUNE_EVERY = 100
+
+llm_cache_lookups = Counter('llm_response_cache_lookups_total', 'LLM response cache lookups by result',
+                            labelnames=('result',))
+llm_cache_saved_seconds = Counter('llm_response_cache_saved_seconds_total',
+                                  'LLM latency avoided by serving cached responses')
+
+def normalize_prompt(text):
+    """
+    Canonical form of a user message: lowercase word tokens without
+    punctuation, filler words or plural "s", deduplicated and sorted, so
+    "What are your top selling products?" and "top selling product" match.
+    """
+    tokens = set()
+    for token in re.findall(r'[a-z0-9]+', (text or '').lower()):
+        if token in FILLER_WORDS:
+            continue
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.add(token)
+    return ' '.join(sorted(tokens))
+
+def _digest(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+class ResponseCache:
+    """
+    Cache of LLM completions keyed on the canonical request: model
+    parameters, a fingerprint of the system prompt (which carries the
+    database context) and the user message, matched first verbatim and then
+    normalized. Entries live in a per-process LRU backed by a local SQLite
+    file shared by every worker, so hits survive restarts.
+    """
+
+    def __init__(self, max_size, ttl, path=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.memory = LRUCache(max_size, ttl)
+        self.hits = {'exact': 0, 'normalized': 0}
+        self.misses = 0
+        self.stores = 0
+        self.saved_seconds = 0.0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def keys(self, payload):
+        """(exact, normalized) keys of a chat completions payload"""
+        messages = payload['messages']
+        params = {name: payload.get(name) for name in ('model', 'max_tokens', 'temperature')}
+        params['system'] = _digest(messages[:-1])
+        user_message = messages[-1]['content']
+        return (
+            _digest({'params': params, 'exact': user_message.strip()}),
+            _digest({'params': params, 'normalized': normalize_prompt(user_message)})
+        )
+
+    def lookup(self, payload):
+        """Cached response text for a payload, or None"""
+        for kind, key in zip(('exact', 'normalized'), self.keys(payload)):
+            entry = self._get(key)
+            if entry is not None:
+                response, latency, _ = entry
+                with self._lock:
+                    self.hits[kind] += 1
+                    self.saved_seconds += latency
+                llm_cache_lookups.inc(result=kind)
+                llm_cache_saved_seconds.inc(latency)
+                return response
+
+        with self._lock:
+            self.misses += 1
+        llm_cache_lookups.inc(result='miss')
+        return None
+
+    def store(self, payload, response, latency):
+        """Remember a completion and how long the LLM took to produce it"""
+        if not response:
+            return
+        now = time.time()
+        entry = (response, latency, now)
+        for key in self.keys(payload):
+            self.memory.set(key, entry)
+
+        if not self.path:
+            return
+        try:
+            connection = self._connection()
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO responses (key, response, latency, created_at) VALUES (?, ?, ?, ?)",
+                    [(key, response, latency, now) for key in self.keys(payload)]
+                )
+            with self._lock:
+                self.stores += 1
+                prune = self.stores % PRUNE_EVERY == 0
+            if prune:
+                self._prune(connection)
+        except sqlite3.Error as e:
+            print(f"Error persisting LLM response cache entry: {str(e)}")
+
+    def _get(self, key):
+        found, entry = self.memory.get(key)
+        if found and entry[2] > time.time() - self.ttl:
+            return entry
+        if not self.path:
+            return None
+
+        try:
+            row = self._connection().execute(
+                "SELECT response, latency, created_at FROM responses WHERE key = ? AND created_at > ?",
+                (key, time.time() - self.ttl)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Error reading LLM response cache: {str(e)}")
+            return None
+        if row is None:
+            return None
+        entry = tuple(row)
+        self.memory.set(key, entry)
+        return entry
+
+    def _prune(self, connection):
+        """Drop expired rows and keep the newest max_size entries"""
+        with connection:
+            connection.execute("DELETE FROM responses WHERE created_at <= ?", (time.time() - self.ttl,))
+            connection.execute(
+                "DELETE FROM responses WHERE key NOT IN "
+                "(SELECT key FROM responses ORDER BY created_at DESC LIMIT ?)",
+                (self.max_size * 2,)  # two keys per response
+            )
+
+    def _connection(self):
+        """SQLite connections cannot be shared between threads; keep one per thread"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, response TEXT NOT NULL, latency REAL NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._local.connection = connection
+        return connection
+
+    def clear(self):
+        self.memory.clear()
+        if self.path:
+            with self._connection() as connection:
+                connection.execute("DELETE FROM responses")
+
+    def stats(self):
+        with self._lock:
+            hits = self.hits['exact'] + self.hits['normalized']
+            lookups = hits + self.misses
+            return {
+                'size': self.memory.stats()['size'],
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'path': self.path,
+                'exact_hits': self.hits['exact'],
+                'normalized_hits': self.hits['normalized'],
+                'misses': self.misses,
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'saved_latency_seconds': round(self.saved_seconds, 3)
+            }
+
+# Shared by every LLMService in the process; None when disabled
+response_cache = ResponseCache(
+    Config.LLM_CACHE_SIZE, Config.LLM_CACHE_TTL, Config.LLM_CACHE_PATH or None
+) if Config.LLM_CACHE_ENABLED else None
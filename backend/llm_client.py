@@ -0,0 +1,291 @@
+import asyncio
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from config import Config
+from metrics import Counter
+from tracing import traced
+
+# Status codes worth retrying: rate limiting and transient upstream failures
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+llm_requests = Counter('llm_requests_total', 'LLM HTTP attempts by outcome', labelnames=('outcome',))
+llm_breaker_transitions = Counter('llm_circuit_breaker_transitions_total', 'Circuit breaker state changes', labelnames=('state',))
+
+class LLMUnavailableError(Exception):
+    """The LLM cannot be called right now; callers should use their fallback"""
+
+class CircuitOpenError(LLMUnavailableError):
+    """Raised without touching the network while the circuit breaker is open"""
+
+class DeadlineExceededError(LLMUnavailableError):
+    """The request's deadline passed before the LLM answered"""
+
+class CircuitBreaker:
+    """
+    Classic three-state breaker. After failure_threshold consecutive failures
+    it opens and rejects calls for reset_timeout seconds, then lets a single
+    trial call through (half-open); its outcome closes or re-opens the circuit.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self._transition(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN:
+                if self._trial_in_flight:
+                    return False
+                self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._trial_in_flight = False
+            if self.state != self.CLOSED:
+                self._transition(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                if self.state != self.OPEN:
+                    self._transition(self.OPEN)
+
+    def _transition(self, state):
+        self.state = state
+        llm_breaker_transitions.inc(state=state)
+
+class BaseLLMClient:
+    """
+    Retry, backoff, circuit breaker and deadline policy shared by the sync
+    and async chat completions clients.
+    """
+
+    def __init__(self, url=None, api_key=None):
+        self.url = url or Config.GROQ_API_URL
+        self.api_key = api_key if api_key is not None else Config.GROQ_API_KEY
+        self.max_retries = Config.LLM_MAX_RETRIES
+        self.backoff_base = Config.LLM_BACKOFF_BASE
+        self.backoff_max = Config.LLM_BACKOFF_MAX
+        self.connect_timeout = Config.LLM_CONNECT_TIMEOUT
+        self.breaker = CircuitBreaker(Config.LLM_BREAKER_THRESHOLD, Config.LLM_BREAKER_RESET)
+        self.headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+    def _begin_attempt(self, timeout, deadline):
+        """Check the deadline and the breaker; returns the read timeout for this attempt"""
+        remaining = self._remaining(deadline)
+        if remaining is not None and remaining <= 0:
+            llm_requests.inc(outcome='deadline')
+            raise DeadlineExceededError("Deadline exceeded before calling the LLM")
+
+        if not self.breaker.allow():
+            llm_requests.inc(outcome='circuit_open')
+            raise CircuitOpenError("LLM circuit breaker is open")
+
+        return timeout if remaining is None else min(timeout, remaining)
+
+    def _record_timeout(self, error, deadline):
+        self.breaker.record_failure()
+        llm_requests.inc(outcome='timeout')
+        if self._expired(deadline):
+            raise DeadlineExceededError("Deadline exceeded waiting for the LLM") from error
+
+    def _record_connection_error(self):
+        self.breaker.record_failure()
+        llm_requests.inc(outcome='connection_error')
+
+    def _record_status(self, status_code, text=''):
+        """
+        Account for a response status. Returns True on success and False for
+        retryable errors; raises for errors that retrying will not fix.
+        """
+        if status_code == 200:
+            self.breaker.record_success()
+            llm_requests.inc(outcome='success')
+            return True
+        if status_code not in RETRYABLE_STATUS:
+            # A client error will not get better by retrying and says nothing about provider health
+            self.breaker.record_success()
+            llm_requests.inc(outcome='client_error')
+            raise LLMUnavailableError(f"LLM API error: {status_code} - {text}")
+
+        self.breaker.record_failure()
+        llm_requests.inc(outcome=f'http_{status_code}')
+        return False
+
+    def _next_delay(self, attempt, retry_after, deadline, last_error):
+        """Backoff before the next attempt, or raise if the deadline leaves no room for it"""
+        delay = self._backoff(attempt, retry_after)
+        remaining = self._remaining(deadline)
+        if remaining is not None and delay >= remaining:
+            raise DeadlineExceededError("Deadline leaves no time for another attempt") from last_error
+        return delay
+
+    def _backoff(self, attempt, retry_after=None):
+        """Full-jitter exponential backoff, honouring Retry-After when the provider sends one"""
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _retry_after(self, response):
+        try:
+            return float(response.headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            return None
+
+    def _remaining(self, deadline):
+        return None if deadline is None else deadline - time.monotonic()
+
+    def _expired(self, deadline):
+        return deadline is not None and time.monotonic() >= deadline
+
+class LLMClient(BaseLLMClient):
+    """
+    HTTP client for the chat completions API with a keep-alive connection
+    pool, bounded retries with jittered exponential backoff on 429/5xx and
+    connection errors, a circuit breaker, and per-request deadlines.
+    """
+
+    def __init__(self, url=None, api_key=None):
+        super().__init__(url, api_key)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=Config.LLM_POOL_SIZE, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update(self.headers)
+
+    @traced('llm.http')
+    def post_completion(self, payload, timeout, deadline=None, stream=False):
+        """
+        POST a completion request and return the successful response.
+        timeout caps each attempt; deadline (a time.monotonic() value) caps the
+        whole call including retries. Raises LLMUnavailableError (or a subclass)
+        when no successful response can be obtained.
+        """
+        last_error = None
+
+        for attempt in range(self.max_retries + 1):
+            read_timeout = self._begin_attempt(timeout, deadline)
+            retry_after = None
+            try:
+                response = self.session.post(
+                    self.url,
+                    json=payload,
+                    timeout=(min(self.connect_timeout, read_timeout), read_timeout),
+                    stream=stream
+                )
+            except requests.Timeout as e:
+                last_error = e
+                self._record_timeout(e, deadline)
+            except requests.RequestException as e:
+                last_error = e
+                self._record_connection_error()
+            else:
+                try:
+                    if self._record_status(response.status_code, response.text if response.status_code != 200 else ''):
+                        return response
+                finally:
+                    if response.status_code != 200:
+                        response.close()
+                retry_after = self._retry_after(response)
+                last_error = LLMUnavailableError(f"LLM API error: {response.status_code}")
+
+            if attempt == self.max_retries:
+                break
+            time.sleep(self._next_delay(attempt, retry_after, deadline, last_error))
+
+        raise LLMUnavailableError(f"LLM request failed after {self.max_retries + 1} attempts: {last_error}")
+
+    def close(self):
+        self.session.close()
+
+class AsyncLLMClient(BaseLLMClient):
+    """
+    asyncio counterpart of LLMClient built on httpx, for the ASGI serving
+    path. One pooled AsyncClient is created lazily on the running loop.
+    """
+
+    def __init__(self, url=None, api_key=None):
+        super().__init__(url, api_key)
+        self._client = None
+
+    def _http(self):
+        if self._client is None:
+            import httpx
+            self._client = httpx.AsyncClient(
+                headers=self.headers,
+                limits=httpx.Limits(
+                    max_connections=Config.ASYNC_LLM_POOL_SIZE,
+                    max_keepalive_connections=Config.ASYNC_LLM_POOL_SIZE
+                )
+            )
+        return self._client
+
+    @traced('llm.http')
+    async def post_completion(self, payload, timeout, deadline=None, stream=False):
+        """
+        Async POST of a completion request with the same retry, breaker and
+        deadline semantics as LLMClient.post_completion. Streaming responses
+        must be closed by the caller with ``await response.aclose()``.
+        """
+        import httpx
+        client = self._http()
+        last_error = None
+
+        for attempt in range(self.max_retries + 1):
+            read_timeout = self._begin_attempt(timeout, deadline)
+            retry_after = None
+            try:
+                request = client.build_request(
+                    'POST', self.url, json=payload,
+                    timeout=httpx.Timeout(read_timeout, connect=min(self.connect_timeout, read_timeout))
+                )
+                # The read timeout is per socket read; bound the whole exchange by the deadline too
+                response = await asyncio.wait_for(client.send(request, stream=stream), read_timeout)
+            except (httpx.TimeoutException, asyncio.TimeoutError) as e:
+                last_error = e
+                self._record_timeout(e, deadline)
+            except httpx.HTTPError as e:
+                last_error = e
+                self._record_connection_error()
+            else:
+                text = ''
+                if response.status_code != 200:
+                    text = (await response.aread()).decode(errors='replace')
+                    await response.aclose()
+                if self._record_status(response.status_code, text):
+                    return response
+                retry_after = self._retry_after(response)
+                last_error = LLMUnavailableError(f"LLM API error: {response.status_code}")
+
+            if attempt == self.max_retries:
+                break
+            await asyncio.sleep(self._next_delay(attempt, retry_after, deadline, last_error))
+
+        raise LLMUnavailableError(f"LLM request failed after {self.max_retries + 1} attempts: {last_error}")
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -1,7 +1,16 @@
 import os
-import requests
 import json
+import time
+import anyio
 from config import Config
+from llm_client import LLMClient, AsyncLLMClient, LLMUnavailableError
+from llm_cache import response_cache
+from intent_router import route, TOP_PRODUCTS, ORDER_STATUS, INVENTORY, PRODUCT_INFO
+from prompt_packer import PromptPacker, truncate_tokens
+from tracing import traced
+
+# Marker returned by _parse_stream_line at the end of a streamed completion
+STREAM_DONE = object()
 
 class LLMService:
     """Service class for integrating with Groq LLM API"""
@@ -9,83 +18,136 @@ class LLMService:
     def __init__(self):
         self.api_key = Config.GROQ_API_KEY
         self.model = Config.GROQ_MODEL
-        self.base_url = "https://api.groq.com/openai/v1/chat/completions"
+        self.base_url = Config.GROQ_API_URL
+        self.client = LLMClient(self.base_url, self.api_key)
+        self.response_cache = response_cache
+        self.packer = PromptPacker(Config.PROMPT_TOKEN_BUDGET, Config.HISTORY_WINDOW)
         
         if not self.api_key:
             print("Warning: GROQ_API_KEY not set. LLM features will be disabled.")
     
-    def generate_response(self, user_message, conversation_history=None, context=None):
+    @traced('llm.generate')
+    def generate_response(self, user_message, conversation_history=None, context=None, deadline=None, prompt=None):
         """
-        Generate AI response using Groq LLM
+        Generate AI response using Groq LLM.
+        deadline is an optional time.monotonic() value bounding the whole call.
         """
         if not self.api_key:
             return self._fallback_response(user_message)
         
         try:
-            # Build conversation context
-            messages = self._build_messages(user_message, conversation_history, context)
-            
-            # Prepare request payload
-            payload = {
-                "model": self.model,
-                "messages": messages,
-                "max_tokens": 1000,
-                "temperature": 0.7,
-                "stream": False
-            }
+            payload = self._response_payload(user_message, conversation_history, context, prompt=prompt)
+            cached = self._cached_response(payload, conversation_history)
+            if cached is not None:
+                return cached
             
-            # Make API request
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            response = requests.post(
-                self.base_url,
-                headers=headers,
-                json=payload,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result['choices'][0]['message']['content']
-            else:
-                print(f"Groq API error: {response.status_code} - {response.text}")
-                return self._fallback_response(user_message)
+            # Make API request over the pooled, retrying client
+            started = time.perf_counter()
+            response = self.client.post_completion(payload, timeout=30, deadline=deadline)
+            result = response.json()
+            content = result['choices'][0]['message']['content']
+            self._cache_response(payload, conversation_history, content, time.perf_counter() - started)
+            return content
                 
+        except LLMUnavailableError as e:
+            print(f"Groq API unavailable: {str(e)}")
+            return self._fallback_response(user_message)
         except Exception as e:
             print(f"Error calling Groq API: {str(e)}")
             return self._fallback_response(user_message)
     
+    def stream_response(self, user_message, conversation_history=None, context=None, deadline=None, prompt=None):
+        """
+        Generate AI response using Groq LLM streaming mode.
+        Yields the response text as it arrives, delta by delta.
+        """
+        if not self.api_key:
+            yield self._fallback_response(user_message)
+            return
+        
+        yielded = False
+        try:
+            payload = self._response_payload(user_message, conversation_history, context, stream=True, prompt=prompt)
+            cached = self._cached_response(payload, conversation_history)
+            if cached is not None:
+                yield cached
+                return
+            
+            started = time.perf_counter()
+            response = self.client.post_completion(payload, timeout=30, deadline=deadline, stream=True)
+            
+            parts = []
+            completed = False
+            try:
+                for line in response.iter_lines(decode_unicode=True):
+                    delta = self._parse_stream_line(line)
+                    if delta is STREAM_DONE:
+                        completed = True
+                        break
+                    if delta:
+                        yielded = True
+                        parts.append(delta)
+                        yield delta
+            finally:
+                response.close()
+            # A stream cut off before [DONE] is a partial reply; never serve it to others
+            if completed:
+                self._cache_response(payload, conversation_history, ''.join(parts), time.perf_counter() - started)
+                
+        except Exception as e:
+            print(f"Error streaming from Groq API: {str(e)}")
+            if not yielded:
+                yield self._fallback_response(user_message)
+    
+    @traced('llm.cache_lookup')
+    def _cached_response(self, payload, conversation_history):
+        """Cached reply for this payload; conversations with history are personal and never shared"""
+        if self.response_cache is None or conversation_history:
+            return None
+        return self.response_cache.lookup(payload)
+    
+    def _cache_response(self, payload, conversation_history, content, latency):
+        if self.response_cache is None or conversation_history:
+            return
+        self.response_cache.store(payload, content, latency)
+    
+    def _response_payload(self, user_message, conversation_history=None, context=None, stream=False, prompt=None):
+        """Request payload for a chat response; prompt is a PackedPrompt from pack_prompt, if already built"""
+        return {
+            "model": self.model,
+            "messages": prompt.messages if prompt else self._build_messages(user_message, conversation_history, context),
+            "max_tokens": 1000,
+            "temperature": 0.7,
+            "stream": stream
+        }
+    
+    def _parse_stream_line(self, line):
+        """
+        Text delta carried by one Server-Sent Events line of a streamed
+        completion ("data: {json}"), STREAM_DONE at "data: [DONE]", else None.
+        """
+        if not line or not line.startswith('data:'):
+            return None
+        data = line[len('data:'):].strip()
+        if data == '[DONE]':
+            return STREAM_DONE
+        return json.loads(data)['choices'][0].get('delta', {}).get('content')
+    
+    def pack_prompt(self, user_message, conversation_history=None, context=None, summary=None, summarized=0,
+                    summary_source_tokens=0):
+        """
+        Messages for a chat response packed into PROMPT_TOKEN_BUDGET, as a
+        PackedPrompt. summary replaces the first `summarized` history messages
+        and every older one, summary_source_tokens in all.
+        """
+        return self.packer.pack(self._get_system_prompt(context), conversation_history, user_message, summary, summarized,
+                                summary_source_tokens)
+    
     def _build_messages(self, user_message, conversation_history=None, context=None):
         """
         Build messages array for the LLM
         """
-        messages = []
-        
-        # System message with context
-        system_message = self._get_system_prompt(context)
-        messages.append({
-            "role": "system",
-            "content": system_message
-        })
-        
-        # Add conversation history
-        if conversation_history:
-            for msg in conversation_history[-10:]:  # Limit to last 10 messages
-                messages.append({
-                    "role": msg['role'],
-                    "content": msg['content']
-                })
-        
-        # Add current user message
-        messages.append({
-            "role": "user",
-            "content": user_message
-        })
-        
-        return messages
+        return self.pack_prompt(user_message, conversation_history, context).messages
     
     def _get_system_prompt(self, context=None):
         """
@@ -117,24 +179,25 @@ Always be helpful, professional, and accurate. If you need more information to a
         """
         Fallback response when LLM is not available
         """
-        message_lower = user_message.lower()
+        intent = route(user_message).intent
         
-        if any(word in message_lower for word in ['top', 'best', 'most sold', 'popular']):
+        if intent == TOP_PRODUCTS:
             return "I can help you find the top-selling products. Let me check our sales data for you."
         
-        elif any(word in message_lower for word in ['order', 'status', 'track']):
+        elif intent == ORDER_STATUS:
             return "I can help you check your order status. Please provide your order ID."
         
-        elif any(word in message_lower for word in ['stock', 'inventory', 'available', 'left']):
+        elif intent == INVENTORY:
             return "I can check inventory levels for you. Which product would you like to know about?"
         
-        elif any(word in message_lower for word in ['product', 'item', 'catalog']):
+        elif intent == PRODUCT_INFO:
             return "I can provide information about our products. What would you like to know?"
         
         else:
             return "I'm here to help with your e-commerce questions! I can assist with product information, order status, inventory levels, and more. What can I help you with today?"
     
-    def ask_clarifying_question(self, user_message, missing_info):
+    @traced('llm.clarify')
+    def ask_clarifying_question(self, user_message, missing_info, deadline=None):
         """
         Generate a clarifying question when information is missing
         """
@@ -142,51 +205,94 @@ Always be helpful, professional, and accurate. If you need more information to a
             return self._simple_clarifying_question(missing_info)
         
         try:
-            clarifying_prompt = f"""The user asked: "{user_message}"
+            payload = self._clarifying_payload(user_message, missing_info)
+            response = self.client.post_completion(payload, timeout=15, deadline=deadline)
+            result = response.json()
+            return result['choices'][0]['message']['content']
+                
+        except Exception as e:
+            print(f"Error generating clarifying question: {str(e)}")
+            return self._simple_clarifying_question(missing_info)
+    
+    def _clarifying_payload(self, user_message, missing_info):
+        """Request payload for a clarifying question"""
+        clarifying_prompt = f"""The user asked: "{user_message}"
 
 I need to ask a clarifying question because I'm missing: {missing_info}
 
 Generate a polite, helpful clarifying question to get the missing information. Keep it short and friendly."""
 
-            messages = [
+        messages = [
+            {
+                "role": "system",
+                "content": "You are a helpful customer support assistant. Generate polite clarifying questions."
+            },
+            {
+                "role": "user",
+                "content": clarifying_prompt
+            }
+        ]
+        
+        return {
+            "model": self.model,
+            "messages": messages,
+            "max_tokens": 150,
+            "temperature": 0.7
+        }
+    
+    @traced('llm.summarize')
+    def summarize(self, previous_summary, messages):
+        """
+        Rolling summary of a conversation: previous_summary extended with
+        messages (role/content dicts, oldest first)
+        """
+        if not self.api_key:
+            return self._simple_summary(previous_summary, messages)
+        
+        try:
+            payload = self._summary_payload(previous_summary, messages)
+            response = self.client.post_completion(payload, timeout=30)
+            return response.json()['choices'][0]['message']['content'].strip()
+        except Exception as e:
+            print(f"Error summarizing conversation: {str(e)}")
+            return self._simple_summary(previous_summary, messages)
+    
+    def _summary_payload(self, previous_summary, messages):
+        """Request payload for a conversation summary"""
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+        summary_prompt = f"""Summary of the conversation so far: {previous_summary or '(none)'}
+
+New messages:
+{transcript}
+
+Update the summary to cover the new messages. Keep order IDs, product names, and any open requests or promises. Answer with the summary only, in at most {Config.SUMMARY_MAX_TOKENS * 3 // 4} words."""
+
+        return {
+            "model": self.model,
+            "messages": [
                 {
                     "role": "system",
-                    "content": "You are a helpful customer support assistant. Generate polite clarifying questions."
+                    "content": "You summarize customer support conversations for an e-commerce clothing website."
                 },
                 {
                     "role": "user",
-                    "content": clarifying_prompt
+                    "content": summary_prompt
                 }
-            ]
-            
-            payload = {
-                "model": self.model,
-                "messages": messages,
-                "max_tokens": 150,
-                "temperature": 0.7
-            }
-            
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            response = requests.post(
-                self.base_url,
-                headers=headers,
-                json=payload,
-                timeout=15
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result['choices'][0]['message']['content']
-            else:
-                return self._simple_clarifying_question(missing_info)
-                
-        except Exception as e:
-            print(f"Error generating clarifying question: {str(e)}")
-            return self._simple_clarifying_question(missing_info)
+            ],
+            "max_tokens": Config.SUMMARY_MAX_TOKENS,
+            "temperature": 0.2
+        }
+    
+    def _simple_summary(self, previous_summary, messages):
+        """
+        Fallback summary: the first sentence of every message, keeping the
+        most recent SUMMARY_MAX_TOKENS tokens
+        """
+        lines = [previous_summary] if previous_summary else []
+        for m in messages:
+            first_sentence = m['content'].strip().split('\n')[0].split('. ')[0]
+            lines.append(f"{m['role']}: {first_sentence[:200]}")
+        return truncate_tokens(" | ".join(lines), Config.SUMMARY_MAX_TOKENS)
     
     def _simple_clarifying_question(self, missing_info):
         """
@@ -199,4 +305,115 @@ Generate a polite, helpful clarifying question to get the missing information. K
         elif 'inventory' in missing_info.lower():
             return "I'd be happy to check inventory levels. Which specific product are you interested in?"
         else:
-            return "I need a bit more information to help you properly. Could you please provide more details?" 
\ No newline at end of file
+            return "I need a bit more information to help you properly. Could you please provide more details?" 
+
+class AsyncLLMService(LLMService):
+    """
+    asyncio variant of LLMService for the ASGI serving path. Prompts, payloads
+    and fallbacks are shared with LLMService; only the network calls differ.
+    """
+    
+    def __init__(self):
+        super().__init__()
+        self.async_client = AsyncLLMClient(self.base_url, self.api_key)
+    
+    @traced('llm.generate')
+    async def generate_response_async(self, user_message, conversation_history=None, context=None, deadline=None, prompt=None):
+        """Async counterpart of generate_response"""
+        if not self.api_key:
+            return self._fallback_response(user_message)
+        
+        try:
+            payload = self._response_payload(user_message, conversation_history, context, prompt=prompt)
+            cached = await self._cached_response_async(payload, conversation_history)
+            if cached is not None:
+                return cached
+            
+            started = time.perf_counter()
+            response = await self.async_client.post_completion(payload, timeout=30, deadline=deadline)
+            content = response.json()['choices'][0]['message']['content']
+            await self._cache_response_async(payload, conversation_history, content, time.perf_counter() - started)
+            return content
+        except LLMUnavailableError as e:
+            print(f"Groq API unavailable: {str(e)}")
+            return self._fallback_response(user_message)
+        except Exception as e:
+            print(f"Error calling Groq API: {str(e)}")
+            return self._fallback_response(user_message)
+    
+    async def stream_response_async(self, user_message, conversation_history=None, context=None, deadline=None, prompt=None):
+        """Async counterpart of stream_response; an async generator of text deltas"""
+        if not self.api_key:
+            yield self._fallback_response(user_message)
+            return
+        
+        yielded = False
+        try:
+            payload = self._response_payload(user_message, conversation_history, context, stream=True, prompt=prompt)
+            cached = await self._cached_response_async(payload, conversation_history)
+            if cached is not None:
+                yield cached
+                return
+            
+            started = time.perf_counter()
+            response = await self.async_client.post_completion(payload, timeout=30, deadline=deadline, stream=True)
+            
+            parts = []
+            completed = False
+            try:
+                async for line in response.aiter_lines():
+                    delta = self._parse_stream_line(line)
+                    if delta is STREAM_DONE:
+                        completed = True
+                        break
+                    if delta:
+                        yielded = True
+                        parts.append(delta)
+                        yield delta
+            finally:
+                await response.aclose()
+            if completed:
+                await self._cache_response_async(payload, conversation_history, ''.join(parts), time.perf_counter() - started)
+        
+        except Exception as e:
+            print(f"Error streaming from Groq API: {str(e)}")
+            if not yielded:
+                yield self._fallback_response(user_message)
+    
+    async def _cached_response_async(self, payload, conversation_history):
+        """_cached_response on a worker thread; the SQLite tier of the cache blocks"""
+        return await anyio.to_thread.run_sync(self._cached_response, payload, conversation_history)
+    
+    async def _cache_response_async(self, payload, conversation_history, content, latency):
+        await anyio.to_thread.run_sync(self._cache_response, payload, conversation_history, content, latency)
+    
+    @traced('llm.clarify')
+    async def ask_clarifying_question_async(self, user_message, missing_info, deadline=None):
+        """Async counterpart of ask_clarifying_question"""
+        if not self.api_key:
+            return self._simple_clarifying_question(missing_info)
+        
+        try:
+            payload = self._clarifying_payload(user_message, missing_info)
+            response = await self.async_client.post_completion(payload, timeout=15, deadline=deadline)
+            return response.json()['choices'][0]['message']['content']
+        except Exception as e:
+            print(f"Error generating clarifying question: {str(e)}")
+            return self._simple_clarifying_question(missing_info)
+    
+    @traced('llm.summarize')
+    async def summarize_async(self, previous_summary, messages):
+        """Async counterpart of summarize"""
+        if not self.api_key:
+            return self._simple_summary(previous_summary, messages)
+        
+        try:
+            payload = self._summary_payload(previous_summary, messages)
+            response = await self.async_client.post_completion(payload, timeout=30)
+            return response.json()['choices'][0]['message']['content'].strip()
+        except Exception as e:
+            print(f"Error summarizing conversation: {str(e)}")
+            return self._simple_summary(previous_summary, messages)
+    
+    async def aclose(self):
+        await self.async_client.aclose()
@@ -1,188 +1,175 @@
 import pandas as pd
+import io
 import os
-from datetime import datetime
+import time
 from models import db, Product, Order, OrderItem, InventoryItem, UserData, DistributionCenter
 from config import Config
-from dateutil import parser
+import aggregates
+from cache import invalidate_dataset_caches
+from snapshot import export_after_load
 
-def parse_datetime(date_str):
-    """Parse datetime string safely"""
-    if pd.isna(date_str) or date_str == '':
-        return None
+def _column_kinds(model):
+    """Map each column of a model to the kind of cleaning it needs"""
+    kinds = {}
+    for column in model.__table__.columns:
+        if isinstance(column.type, db.DateTime):
+            kinds[column.name] = 'datetime'
+        elif isinstance(column.type, db.Integer):
+            kinds[column.name] = 'integer'
+        elif isinstance(column.type, db.Float):
+            kinds[column.name] = 'float'
+        else:
+            kinds[column.name] = 'string'
+    return kinds
+
+def clean_frame(df, model):
+    """
+    Clean a whole DataFrame chunk column by column so it matches the model:
+    NaN becomes NULL, datetimes are parsed in one vectorized pass (naive UTC)
+    and integer columns keep their integer type even when they contain NULLs.
+    """
+    kinds = _column_kinds(model)
+    cleaned = pd.DataFrame(index=df.index)
+
+    for name, kind in kinds.items():
+        if name not in df.columns:
+            cleaned[name] = None
+            continue
+
+        series = df[name]
+        if kind == 'datetime':
+            if pd.api.types.is_string_dtype(series):
+                # The export mixes "+00:00" and " UTC" suffixes
+                series = series.str.replace(r' UTC$', '+00:00', regex=True)
+            series = pd.to_datetime(series, errors='coerce', utc=True, format='ISO8601').dt.tz_localize(None)
+        elif kind == 'integer':
+            series = pd.to_numeric(series, errors='coerce').round().astype('Int64')
+        elif kind == 'float':
+            series = pd.to_numeric(series, errors='coerce')
+        else:
+            series = series.astype(object).where(series.notna(), None)
+        cleaned[name] = series
+
+    return cleaned
+
+def _copy_chunk(cursor, table_name, df):
+    """Stream one cleaned chunk into Postgres with COPY FROM STDIN"""
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False, na_rep='', date_format='%Y-%m-%d %H:%M:%S.%f')
+    buffer.seek(0)
+
+    columns = ', '.join(f'"{name}"' for name in df.columns)
+    cursor.copy_expert(
+        f'COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv, NULL \'\')',
+        buffer
+    )
+
+def _insert_chunk(table, df):
+    """Fallback for backends without COPY (e.g. SQLite): batched executemany"""
+    records = df.astype(object).where(df.notna(), None).to_dict('records')
+    if records:
+        db.session.execute(table.insert(), records)
+
+def bulk_load(csv_path, model, chunk_size=None):
+    """
+    Load a CSV into the model's table in bounded chunks.
+    Uses COPY on PostgreSQL and batched inserts elsewhere, and folds every
+    chunk into the aggregate tables. The whole table is loaded in the
+    caller's transaction; nothing is committed here.
+    Returns the number of rows loaded.
+    """
+    chunk_size = chunk_size or Config.LOAD_CHUNK_SIZE
+    table = model.__table__
+    use_copy = db.engine.dialect.name == 'postgresql'
+    cursor = db.session.connection().connection.cursor() if use_copy else None
+
+    total_rows = 0
+    started = time.perf_counter()
     try:
-        return parser.parse(str(date_str))
-    except:
-        return None
+        for chunk in pd.read_csv(csv_path, chunksize=chunk_size):
+            cleaned = clean_frame(chunk, model)
+            if use_copy:
+                _copy_chunk(cursor, table.name, cleaned)
+            else:
+                _insert_chunk(table, cleaned)
+            aggregates.apply_loaded_chunk(model, cleaned)
+            total_rows += len(cleaned)
+    finally:
+        if cursor is not None:
+            cursor.close()
+
+    elapsed = time.perf_counter() - started
+    rate = total_rows / elapsed if elapsed > 0 else float('inf')
+    print(f"Loaded {total_rows} rows into {table.name} in {elapsed:.2f}s ({rate:,.0f} rows/sec)")
+    return total_rows
 
 def load_products(csv_path):
     """Load products data from CSV"""
     print("Loading products...")
-    df = pd.read_csv(csv_path)
-    
-    for _, row in df.iterrows():
-        product = Product(
-            id=row['id'],
-            cost=row['cost'] if pd.notna(row['cost']) else None,
-            category=row['category'] if pd.notna(row['category']) else None,
-            name=row['name'] if pd.notna(row['name']) else None,
-            brand=row['brand'] if pd.notna(row['brand']) else None,
-            retail_price=row['retail_price'] if pd.notna(row['retail_price']) else None,
-            department=row['department'] if pd.notna(row['department']) else None,
-            sku=row['sku'] if pd.notna(row['sku']) else None,
-            distribution_center_id=row['distribution_center_id'] if pd.notna(row['distribution_center_id']) else None
-        )
-        db.session.add(product)
-    
-    db.session.commit()
-    print(f"Loaded {len(df)} products")
+    return bulk_load(csv_path, Product)
 
 def load_orders(csv_path):
     """Load orders data from CSV"""
     print("Loading orders...")
-    df = pd.read_csv(csv_path)
-    
-    for _, row in df.iterrows():
-        order = Order(
-            order_id=row['order_id'],
-            user_id=row['user_id'] if pd.notna(row['user_id']) else None,
-            status=row['status'] if pd.notna(row['status']) else None,
-            gender=row['gender'] if pd.notna(row['gender']) else None,
-            created_at=parse_datetime(row['created_at']),
-            returned_at=parse_datetime(row['returned_at']),
-            shipped_at=parse_datetime(row['shipped_at']),
-            delivered_at=parse_datetime(row['delivered_at']),
-            num_of_item=row['num_of_item'] if pd.notna(row['num_of_item']) else None
-        )
-        db.session.add(order)
-    
-    db.session.commit()
-    print(f"Loaded {len(df)} orders")
+    return bulk_load(csv_path, Order)
 
 def load_order_items(csv_path):
     """Load order items data from CSV"""
     print("Loading order items...")
-    df = pd.read_csv(csv_path)
-    
-    for _, row in df.iterrows():
-        order_item = OrderItem(
-            id=row['id'],
-            order_id=row['order_id'] if pd.notna(row['order_id']) else None,
-            user_id=row['user_id'] if pd.notna(row['user_id']) else None,
-            product_id=row['product_id'] if pd.notna(row['product_id']) else None,
-            inventory_item_id=row['inventory_item_id'] if pd.notna(row['inventory_item_id']) else None,
-            status=row['status'] if pd.notna(row['status']) else None,
-            created_at=parse_datetime(row['created_at']),
-            shipped_at=parse_datetime(row['shipped_at']),
-            delivered_at=parse_datetime(row['delivered_at']),
-            returned_at=parse_datetime(row['returned_at'])
-        )
-        db.session.add(order_item)
-    
-    db.session.commit()
-    print(f"Loaded {len(df)} order items")
+    return bulk_load(csv_path, OrderItem)
 
 def load_inventory_items(csv_path):
     """Load inventory items data from CSV"""
     print("Loading inventory items...")
-    df = pd.read_csv(csv_path)
-    
-    for _, row in df.iterrows():
-        inventory_item = InventoryItem(
-            id=row['id'],
-            product_id=row['product_id'] if pd.notna(row['product_id']) else None,
-            created_at=parse_datetime(row['created_at']),
-            sold_at=parse_datetime(row['sold_at']),
-            cost=row['cost'] if pd.notna(row['cost']) else None,
-            product_category=row['product_category'] if pd.notna(row['product_category']) else None,
-            product_name=row['product_name'] if pd.notna(row['product_name']) else None,
-            product_brand=row['product_brand'] if pd.notna(row['product_brand']) else None,
-            product_retail_price=row['product_retail_price'] if pd.notna(row['product_retail_price']) else None,
-            product_department=row['product_department'] if pd.notna(row['product_department']) else None,
-            product_sku=row['product_sku'] if pd.notna(row['product_sku']) else None,
-            product_distribution_center_id=row['product_distribution_center_id'] if pd.notna(row['product_distribution_center_id']) else None
-        )
-        db.session.add(inventory_item)
-    
-    db.session.commit()
-    print(f"Loaded {len(df)} inventory items")
+    return bulk_load(csv_path, InventoryItem)
 
 def load_users(csv_path):
     """Load users data from CSV"""
     print("Loading users...")
-    df = pd.read_csv(csv_path)
-    
-    for _, row in df.iterrows():
-        user_data = UserData(
-            id=row['id'],
-            first_name=row['first_name'] if pd.notna(row['first_name']) else None,
-            last_name=row['last_name'] if pd.notna(row['last_name']) else None,
-            email=row['email'] if pd.notna(row['email']) else None,
-            age=row['age'] if pd.notna(row['age']) else None,
-            gender=row['gender'] if pd.notna(row['gender']) else None,
-            state=row['state'] if pd.notna(row['state']) else None,
-            street_address=row['street_address'] if pd.notna(row['street_address']) else None,
-            postal_code=row['postal_code'] if pd.notna(row['postal_code']) else None,
-            city=row['city'] if pd.notna(row['city']) else None,
-            country=row['country'] if pd.notna(row['country']) else None,
-            latitude=row['latitude'] if pd.notna(row['latitude']) else None,
-            longitude=row['longitude'] if pd.notna(row['longitude']) else None,
-            traffic_source=row['traffic_source'] if pd.notna(row['traffic_source']) else None,
-            created_at=parse_datetime(row['created_at'])
-        )
-        db.session.add(user_data)
-    
-    db.session.commit()
-    print(f"Loaded {len(df)} users")
+    return bulk_load(csv_path, UserData)
 
 def load_distribution_centers(csv_path):
     """Load distribution centers data from CSV"""
     print("Loading distribution centers...")
-    df = pd.read_csv(csv_path)
-    
-    for _, row in df.iterrows():
-        distribution_center = DistributionCenter(
-            id=row['id'],
-            name=row['name'] if pd.notna(row['name']) else None,
-            latitude=row['latitude'] if pd.notna(row['latitude']) else None,
-            longitude=row['longitude'] if pd.notna(row['longitude']) else None
-        )
-        db.session.add(distribution_center)
-    
-    db.session.commit()
-    print(f"Loaded {len(df)} distribution centers")
+    return bulk_load(csv_path, DistributionCenter)
 
 def load_all_data():
     """Load all CSV data into the database"""
     dataset_path = Config.DATASET_PATH
-    
+
     # Check if dataset path exists
     if not os.path.exists(dataset_path):
         print(f"Dataset path not found: {dataset_path}")
         return
-    
+
     try:
-        # Load all data
+        # Load all data in a single transaction
         load_products(os.path.join(dataset_path, 'products.csv'))
         load_orders(os.path.join(dataset_path, 'orders.csv'))
         load_order_items(os.path.join(dataset_path, 'order_items.csv'))
         load_inventory_items(os.path.join(dataset_path, 'inventory_items.csv'))
         load_users(os.path.join(dataset_path, 'users.csv'))
         load_distribution_centers(os.path.join(dataset_path, 'distribution_centers.csv'))
-        
+        db.session.commit()
+        export_after_load()
+        invalidate_dataset_caches()
+
         print("✅ All data loaded successfully!")
-        
+
     except Exception as e:
         print(f"❌ Error loading data: {e}")
         db.session.rollback()
 
 if __name__ == "__main__":
     from app import create_app
-    app = create_app()
-    
+    from migrations import run_migrations
+    app = create_app(engine_options=Config.BATCH_ENGINE_OPTIONS)
+
     with app.app_context():
         # Create all tables
         db.create_all()
+        run_migrations()
         print("Database tables created successfully!")
-        
+
         # Load data
-        load_all_data() 
\ No newline at end of file
+        load_all_data()
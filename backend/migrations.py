@@ -0,0 +1,390 @@
+import sys
+import uuid
+from datetime import datetime
+from sqlalchemy import event, text, inspect
+from sqlalchemy.dialects.postgresql import UUID
+from models import db, SchemaMigration
+
+class CreateIndex:
+    """Migration step that builds a (possibly composite or partial) index"""
+
+    def __init__(self, name, table, columns, where=None, using=None, dialect=None):
+        self.name = name
+        self.table = table
+        self.columns = columns
+        self.where = where
+        self.using = using
+        self.dialect = dialect
+
+    def apply(self, connection):
+        if self.dialect and connection.dialect.name != self.dialect:
+            return
+        is_postgres = connection.dialect.name == 'postgresql'
+        if is_postgres:
+            self._drop_if_invalid(connection)
+
+        sql = "CREATE INDEX {concurrently}IF NOT EXISTS {name} ON {table}{using} ({columns})".format(
+            # CONCURRENTLY keeps the table writable while the index is built
+            concurrently='CONCURRENTLY ' if is_postgres else '',
+            name=self.name,
+            table=self.table,
+            using=f" USING {self.using}" if self.using else '',
+            columns=', '.join(self.columns)
+        )
+        if self.where:
+            sql += f" WHERE {self.where}"
+        connection.execute(text(sql))
+
+    def _drop_if_invalid(self, connection):
+        """A failed concurrent build leaves an INVALID index behind that IF NOT EXISTS would skip"""
+        invalid = connection.execute(text(
+            "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = :name AND NOT i.indisvalid"
+        ), {'name': self.name}).first()
+        if invalid:
+            connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {self.name}"))
+
+    def __repr__(self):
+        return f'<CreateIndex {self.name}>'
+
+class RunSQL:
+    """Migration step that runs raw SQL, optionally only on one dialect"""
+
+    def __init__(self, sql, dialect=None):
+        self.sql = sql
+        self.dialect = dialect
+
+    def apply(self, connection):
+        if self.dialect and connection.dialect.name != self.dialect:
+            return
+        connection.execute(text(self.sql))
+
+class AddColumn:
+    """Migration step that adds a column unless create_all already created it"""
+
+    def __init__(self, table, name, definition):
+        self.table = table
+        self.name = name
+        self.definition = definition
+
+    def apply(self, connection):
+        columns = {column['name'] for column in inspect(connection).get_columns(self.table)}
+        if self.name not in columns:
+            connection.execute(text(f"ALTER TABLE {self.table} ADD COLUMN {self.name} {self.definition}"))
+
+    def __repr__(self):
+        return f'<AddColumn {self.table}.{self.name}>'
+
+class ConvertToUUID:
+    """
+    Migration step that moves text UUID columns to native storage: the uuid
+    type on PostgreSQL, with the foreign keys between them dropped and
+    restored around the change; 16-byte values in place on SQLite, whose
+    columns take any type. Ids keep their value, so URLs stay valid.
+    """
+
+    def __init__(self, columns, foreign_keys):
+        self.columns = columns  # (table, column)
+        self.foreign_keys = foreign_keys  # (table, column, referenced table, referenced column)
+
+    def apply(self, connection):
+        if connection.dialect.name == 'postgresql':
+            self._apply_postgres(connection)
+        elif connection.dialect.name == 'sqlite':
+            driver = connection.connection.driver_connection
+            driver.create_function('uuid_bytes', 1, lambda value: uuid.UUID(value).bytes, deterministic=True)
+            for table, column in self.columns:
+                connection.execute(text(f"UPDATE {table} SET {column} = uuid_bytes({column}) WHERE typeof({column}) = 'text'"))
+        else:
+            print(f"Skipping UUID conversion on {connection.dialect.name}; convert the id columns to BINARY(16) by hand")
+
+    def _apply_postgres(self, connection):
+        inspector = inspect(connection)
+        tables = {}
+        for table, column in self.columns:
+            types = {c['name']: c['type'] for c in inspector.get_columns(table)}
+            if not isinstance(types[column], UUID):
+                tables.setdefault(table, []).append(column)
+        if not tables:
+            return
+        for table, column, _, _ in self.foreign_keys:
+            for foreign_key in inspector.get_foreign_keys(table):
+                if foreign_key['constrained_columns'] == [column]:
+                    connection.execute(text(f"ALTER TABLE {table} DROP CONSTRAINT {foreign_key['name']}"))
+        # One rewrite per table; indexes on the columns are rebuilt with it
+        for table, columns in tables.items():
+            connection.execute(text(f"ALTER TABLE {table} " + ', '.join(
+                f"ALTER COLUMN {column} TYPE uuid USING {column}::uuid" for column in columns)))
+        for table, column, referenced_table, referenced_column in self.foreign_keys:
+            connection.execute(text(
+                f"ALTER TABLE {table} ADD CONSTRAINT {table}_{column}_fkey "
+                f"FOREIGN KEY ({column}) REFERENCES {referenced_table} ({referenced_column})"
+            ))
+
+    def __repr__(self):
+        return f'<ConvertToUUID {", ".join(f"{table}.{column}" for table, column in self.columns)}>'
+
+class PartitionMessagesByMonth:
+    """
+    Migration step that rebuilds messages as a table partitioned by month
+    of created_at (PostgreSQL only), with a default partition for anything
+    outside the monthly ones. The primary key becomes (id, created_at), as
+    partitioned tables require. Rows are copied in one transaction, so the
+    table is locked while it runs.
+    """
+
+    def apply(self, connection):
+        from archive import is_partitioned, ensure_partitions
+        if connection.dialect.name != 'postgresql' or is_partitioned(connection):
+            return
+        with connection.engine.connect() as transaction_connection, transaction_connection.begin():
+            run = lambda sql: transaction_connection.execute(text(sql))
+            run("SET LOCAL statement_timeout = 0")
+            run("LOCK TABLE messages IN EXCLUSIVE MODE")
+            first = transaction_connection.execute(text("SELECT MIN(created_at) FROM messages")).scalar()
+            run("CREATE TABLE messages_partitioned (LIKE messages INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)")
+            run("ALTER TABLE messages_partitioned ALTER COLUMN created_at SET NOT NULL")
+            run("ALTER TABLE messages_partitioned ADD CONSTRAINT messages_partitioned_pkey PRIMARY KEY (id, created_at)")
+            ensure_partitions(transaction_connection, first_month=first, table='messages_partitioned')
+            run("CREATE TABLE messages_pdefault PARTITION OF messages_partitioned DEFAULT")
+            run("""
+                INSERT INTO messages_partitioned (id, conversation_id, role, content, created_at)
+                SELECT id, conversation_id, role, content, COALESCE(created_at, now() AT TIME ZONE 'utc') FROM messages
+            """)
+            run("DROP TABLE messages")
+            run("ALTER TABLE messages_partitioned RENAME TO messages")
+            run("ALTER TABLE messages RENAME CONSTRAINT messages_partitioned_pkey TO messages_pkey")
+            run("ALTER TABLE messages ADD CONSTRAINT messages_conversation_id_fkey "
+                "FOREIGN KEY (conversation_id) REFERENCES conversations (id)")
+            run("CREATE INDEX ix_messages_conversation_id_created_at_id ON messages (conversation_id, created_at, id)")
+
+    def __repr__(self):
+        return '<PartitionMessagesByMonth>'
+
+class BackfillAggregates:
+    """
+    Migration step that fills the aggregate tables of a database loaded before
+    they existed; only the loaders maintain them, so they would stay empty
+    """
+
+    def apply(self, connection):
+        from aggregates import COUNTED_TABLES, rebuild_aggregates
+        counters = dict(connection.execute(text("SELECT name, value FROM aggregate_totals")).all())
+        for model in COUNTED_TABLES:
+            name = model.__tablename__
+            if not counters.get(name) and connection.execute(text(f"SELECT 1 FROM {name} LIMIT 1")).first():
+                rebuild_aggregates()
+                return
+
+    def __repr__(self):
+        return '<BackfillAggregates>'
+
+class Migration:
+    """A numbered, named group of schema steps"""
+
+    def __init__(self, version, name, steps):
+        self.version = version
+        self.name = name
+        self.steps = steps
+
+# Ordered list of every schema migration. Never edit an applied migration;
+# append a new one instead.
+MIGRATIONS = [
+    Migration(1, 'Indexes for hot chat query columns', [
+        CreateIndex('ix_order_items_product_id', 'order_items', ['product_id']),
+        CreateIndex('ix_order_items_order_id', 'order_items', ['order_id']),
+        CreateIndex('ix_inventory_items_product_id', 'inventory_items', ['product_id']),
+        CreateIndex('ix_inventory_items_available', 'inventory_items', ['product_id'], where='sold_at IS NULL'),
+        CreateIndex('ix_products_category', 'products', ['category']),
+        CreateIndex('ix_products_brand', 'products', ['brand']),
+        CreateIndex('ix_products_name', 'products', ['name']),
+        CreateIndex('ix_conversations_user_id', 'conversations', ['user_id']),
+        CreateIndex('ix_messages_conversation_id_created_at', 'messages', ['conversation_id', 'created_at']),
+        # Trigram index so the ILIKE '%word%' product lookups can avoid a sequential scan
+        RunSQL("CREATE EXTENSION IF NOT EXISTS pg_trgm", dialect='postgresql'),
+        CreateIndex('ix_products_name_trgm', 'products', ['name gin_trgm_ops'], using='gin', dialect='postgresql'),
+    ]),
+    Migration(2, 'Index for top-N reads of product sales aggregates', [
+        CreateIndex('ix_product_sales_stats_sales_count', 'product_sales_stats', ['sales_count']),
+    ]),
+    Migration(3, 'Conversation message counters and activity-ordered listing index', [
+        AddColumn('conversations', 'message_count', 'INTEGER NOT NULL DEFAULT 0'),
+        AddColumn('conversations', 'last_message_preview', 'VARCHAR(200)'),
+        RunSQL("""
+            UPDATE conversations SET
+                message_count = (SELECT COUNT(*) FROM messages WHERE messages.conversation_id = conversations.id),
+                last_message_preview = (
+                    SELECT SUBSTR(content, 1, 200) FROM messages
+                    WHERE messages.conversation_id = conversations.id
+                    ORDER BY created_at DESC LIMIT 1
+                ),
+                updated_at = COALESCE(
+                    (SELECT MAX(created_at) FROM messages WHERE messages.conversation_id = conversations.id),
+                    updated_at
+                )
+        """),
+        CreateIndex('ix_conversations_user_id_updated_at', 'conversations', ['user_id', 'updated_at', 'id']),
+    ]),
+    Migration(4, 'Message keyset index including the id tie-breaker', [
+        CreateIndex('ix_messages_conversation_id_created_at_id', 'messages', ['conversation_id', 'created_at', 'id']),
+        # Superseded by the index above
+        RunSQL("DROP INDEX CONCURRENTLY IF EXISTS ix_messages_conversation_id_created_at", dialect='postgresql'),
+        RunSQL("DROP INDEX IF EXISTS ix_messages_conversation_id_created_at", dialect='sqlite'),
+    ]),
+    Migration(5, 'Rolling conversation summaries', [
+        AddColumn('conversations', 'summary', 'TEXT'),
+        AddColumn('conversations', 'summary_message_count', 'INTEGER NOT NULL DEFAULT 0'),
+        AddColumn('conversations', 'summary_last_message_id', 'VARCHAR(36)'),
+    ]),
+    Migration(6, 'Native UUID storage for user, conversation and message ids', [
+        ConvertToUUID(
+            [('users', 'id'), ('conversations', 'id'), ('conversations', 'user_id'),
+             ('conversations', 'summary_last_message_id'), ('messages', 'id'), ('messages', 'conversation_id')],
+            [('conversations', 'user_id', 'users', 'id'), ('messages', 'conversation_id', 'conversations', 'id')]
+        ),
+    ]),
+    Migration(7, 'Monthly message partitions and conversation archives', [
+        AddColumn('conversations', 'archived_at', 'TIMESTAMP'),
+        CreateIndex('ix_conversations_idle', 'conversations', ['updated_at'], where='archived_at IS NULL'),
+        PartitionMessagesByMonth(),
+    ]),
+    Migration(8, 'Backfill sales and inventory aggregates of existing databases', [
+        BackfillAggregates(),
+    ]),
+    Migration(9, 'Token count of the messages folded into conversation summaries', [
+        AddColumn('conversations', 'summary_source_tokens', 'INTEGER NOT NULL DEFAULT 0'),
+    ]),
+]
+
+def applied_versions():
+    """Versions already recorded in schema_migrations"""
+    return {m.version for m in SchemaMigration.query.all()}
+
+def run_migrations():
+    """Apply every pending migration in order"""
+    SchemaMigration.__table__.create(db.engine, checkfirst=True)
+    done = applied_versions()
+
+    for migration in MIGRATIONS:
+        if migration.version in done:
+            continue
+
+        print(f"Applying migration {migration.version}: {migration.name}")
+        # Autocommit so that concurrent index builds can run outside a transaction
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            postgres = connection.dialect.name == 'postgresql'
+            if postgres:
+                # Index builds may run past DB_STATEMENT_TIMEOUT_MS, which is meant for requests
+                connection.exec_driver_sql('SET statement_timeout = 0')
+            try:
+                for step in migration.steps:
+                    step.apply(connection)
+            finally:
+                if postgres:
+                    connection.exec_driver_sql('RESET statement_timeout')
+
+        db.session.add(SchemaMigration(version=migration.version, name=migration.name))
+        db.session.commit()
+
+def migration_status():
+    """List every migration with whether it has been applied"""
+    SchemaMigration.__table__.create(db.engine, checkfirst=True)
+    done = applied_versions()
+    return [(m.version, m.name, m.version in done) for m in MIGRATIONS]
+
+# Sample messages that exercise every query issued by ChatService
+CHECK_MESSAGES = [
+    "What are the top 5 best selling products?",
+    "Show me the status of order ID 1",
+    "How many Classic T-Shirts are left in stock?",
+    "Is the cargo pants item still available in inventory?",
+    "Tell me about your product categories",
+]
+
+def _capture_chat_queries():
+    """Run ChatService against the sample messages and record every statement it issues"""
+    from chat_service import ChatService
+    from history import newest_message_statement, window_statement, conversation_page_statement, message_page_statement
+
+    captured = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            captured.append((statement, parameters))
+
+    chat_service = ChatService()
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        for message in CHECK_MESSAGES:
+            chat_service._get_database_context(message)
+            chat_service._generate_response(message)
+        # Conversation history load done by process_chat_message
+        db.session.execute(newest_message_statement('check')).all()
+        db.session.execute(window_statement('check', 10)).all()
+        # Message pages and exports of GET /api/conversations/<id>
+        db.session.execute(message_page_statement('check', 50, before_position=(datetime.utcnow(), 'x'))).all()
+        db.session.execute(message_page_statement('check', 500, after_position=(datetime.min, ''))).all()
+        # First page of a user's conversation listing
+        db.session.execute(conversation_page_statement('check', None, 20)).all()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    unique = {}
+    for statement, parameters in captured:
+        unique.setdefault(statement, parameters)
+    return list(unique.items())
+
+def _uses_full_scan(dialect, plan_lines):
+    if dialect == 'postgresql':
+        return any('Seq Scan' in line for line in plan_lines)
+    # SQLite reports "SCAN <table>" for full scans and "SEARCH"/"USING ... INDEX" otherwise
+    return any(line.startswith('SCAN') and 'INDEX' not in line for line in plan_lines)
+
+def check_query_plans():
+    """
+    EXPLAIN every query ChatService issues and report the ones that need a
+    sequential scan. On PostgreSQL sequential scans are disabled for the check,
+    so the result reflects whether an index is usable rather than what the
+    planner prefers for the current (possibly tiny) table sizes.
+    Returns the list of statements that still fall back to a full scan.
+    """
+    dialect = db.engine.dialect.name
+    failures = []
+
+    with db.engine.connect() as connection:
+        if dialect == 'postgresql':
+            connection.execute(text("SET enable_seqscan = off"))
+        prefix = 'EXPLAIN ' if dialect == 'postgresql' else 'EXPLAIN QUERY PLAN '
+
+        for statement, parameters in _capture_chat_queries():
+            rows = connection.exec_driver_sql(prefix + statement, parameters).all()
+            plan_lines = [str(row[0]) if dialect == 'postgresql' else str(row[-1]) for row in rows]
+            full_scan = _uses_full_scan(dialect, plan_lines)
+
+            print(("❌ FULL SCAN" if full_scan else "✅ INDEXED") + ": " + " ".join(statement.split()))
+            for line in plan_lines:
+                print(f"    {line}")
+            if full_scan:
+                failures.append(statement)
+
+    return failures
+
+if __name__ == "__main__":
+    from app import create_app
+    from config import Config
+    app = create_app(engine_options=Config.BATCH_ENGINE_OPTIONS)
+    command = sys.argv[1] if len(sys.argv) > 1 else 'upgrade'
+
+    with app.app_context():
+        if command == 'upgrade':
+            db.create_all()
+            run_migrations()
+            print("Database schema is up to date")
+        elif command == 'status':
+            for version, name, applied in migration_status():
+                print(f"{version:4d} {'applied' if applied else 'pending':8s} {name}")
+        elif command == 'check':
+            sys.exit(1 if check_query_plans() else 0)
+        else:
+            print("Usage: python migrations.py [upgrade|status|check]")
+            sys.exit(2)
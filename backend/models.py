@@ -1,14 +1,77 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.types import TypeDecorator, BINARY
 from datetime import datetime
+import os
+import threading
+import time
 import uuid
 
 db = SQLAlchemy()
 
+_uuid7_lock = threading.Lock()
+_uuid7_last = [0, 0]  # millisecond timestamp and counter of the last id
+
+def uuid7():
+    """
+    Time-ordered UUID (RFC 9562 version 7): 48 bits of Unix milliseconds,
+    a 12-bit counter that keeps ids from one process ordered within a
+    millisecond, and 62 random bits.
+    """
+    with _uuid7_lock:
+        millis = time.time_ns() // 1_000_000
+        last_millis, counter = _uuid7_last
+        if millis > last_millis:
+            # Start low in the counter space so a burst has room to count up
+            counter = int.from_bytes(os.urandom(2), 'big') & 0x3FF
+        else:
+            millis = last_millis
+            counter += 1
+            if counter > 0xFFF:
+                millis, counter = millis + 1, 0
+        _uuid7_last[:] = [millis, counter]
+    value = (millis << 80) | (0x7 << 76) | (counter << 64) | (0b10 << 62) | (int.from_bytes(os.urandom(8), 'big') >> 2)
+    return uuid.UUID(int=value)
+
+def new_id():
+    """Id for a new user, conversation or message, as the API shows it"""
+    return str(uuid7())
+
+class UUIDString(TypeDecorator):
+    """
+    UUID key stored natively (uuid on PostgreSQL, 16 bytes elsewhere) and
+    read and written as its canonical string. A value that is not a UUID
+    binds as NULL, so looking it up finds nothing instead of failing.
+    """
+    impl = BINARY(16)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(UUID(as_uuid=False))
+        return dialect.type_descriptor(BINARY(16))
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        try:
+            parsed = value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+        except ValueError:
+            return None
+        return str(parsed) if dialect.name == 'postgresql' else parsed.bytes
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, (bytes, memoryview)):
+            return str(uuid.UUID(bytes=bytes(value)))
+        return str(uuid.UUID(str(value)))
+
 class User(db.Model):
     """User model for storing user information"""
     __tablename__ = 'users'
     
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = db.Column(UUIDString, primary_key=True, default=new_id)
     email = db.Column(db.String(120), unique=True, nullable=False)
     first_name = db.Column(db.String(50), nullable=True)
     last_name = db.Column(db.String(50), nullable=True)
@@ -25,12 +88,23 @@ class Conversation(db.Model):
     """Conversation model for storing conversation sessions"""
     __tablename__ = 'conversations'
     
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
+    id = db.Column(UUIDString, primary_key=True, default=new_id)
+    user_id = db.Column(UUIDString, db.ForeignKey('users.id'), nullable=False)
     title = db.Column(db.String(200), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True)
+    # Maintained on every message write so listings need no per-conversation queries
+    message_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    last_message_preview = db.Column(db.String(200), nullable=True)
+    # Rolling summary of the oldest summary_message_count messages, up to summary_last_message_id
+    summary = db.Column(db.Text, nullable=True)
+    summary_message_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    summary_last_message_id = db.Column(UUIDString, nullable=True)
+    # Estimated tokens of the raw messages folded into the summary, the baseline for prompt savings
+    summary_source_tokens = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Set while the messages live compressed in conversation_archives (see archive.py)
+    archived_at = db.Column(db.DateTime, nullable=True)
     
     # Relationship with messages
     messages = db.relationship('Message', backref='conversation', lazy=True, cascade='all, delete-orphan', order_by='Message.created_at')
@@ -42,15 +116,31 @@ class Message(db.Model):
     """Message model for storing individual messages in conversations"""
     __tablename__ = 'messages'
     
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    conversation_id = db.Column(db.String(36), db.ForeignKey('conversations.id'), nullable=False)
+    id = db.Column(UUIDString, primary_key=True, default=new_id)
+    conversation_id = db.Column(UUIDString, db.ForeignKey('conversations.id'), nullable=False)
     role = db.Column(db.String(20), nullable=False)  # 'user' or 'assistant'
     content = db.Column(db.Text, nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Partition key on PostgreSQL, where the table is split by month (migration 7)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     
     def __repr__(self):
         return f'<Message {self.id} - {self.role}>'
 
+class ConversationArchive(db.Model):
+    """Messages of an idle conversation, compressed into one row"""
+    __tablename__ = 'conversation_archives'
+    
+    conversation_id = db.Column(UUIDString, db.ForeignKey('conversations.id'), primary_key=True)
+    message_count = db.Column(db.Integer, nullable=False)
+    first_message_at = db.Column(db.DateTime, nullable=True)
+    last_message_at = db.Column(db.DateTime, nullable=True)
+    codec = db.Column(db.String(20), nullable=False)  # 'zlib-jsonl'
+    payload = db.Column(db.LargeBinary, nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ConversationArchive {self.conversation_id} - {self.message_count} messages>'
+
 # E-commerce data models for storing the CSV data
 class Product(db.Model):
     """Product model for storing e-commerce product data"""
@@ -157,4 +247,84 @@ class DistributionCenter(db.Model):
     longitude = db.Column(db.Float, nullable=True)
     
     def __repr__(self):
-        return f'<DistributionCenter {self.name}>' 
\ No newline at end of file
+        return f'<DistributionCenter {self.name}>' 
+
+class SyncCheckpoint(db.Model):
+    """Progress of the last incremental sync of a CSV into its table"""
+    __tablename__ = 'sync_checkpoints'
+    
+    table_name = db.Column(db.String(100), primary_key=True)
+    run_id = db.Column(db.String(36), nullable=False)
+    file_hash = db.Column(db.String(64), nullable=False)
+    chunks_done = db.Column(db.Integer, default=0, nullable=False)
+    status = db.Column(db.String(20), default='running', nullable=False)  # 'running' or 'complete'
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<SyncCheckpoint {self.table_name} - {self.status}>'
+
+class SyncRowHash(db.Model):
+    """Fingerprint of every synced CSV row, used to detect changed and deleted rows"""
+    __tablename__ = 'sync_row_hashes'
+    
+    table_name = db.Column(db.String(100), primary_key=True)
+    row_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    row_hash = db.Column(db.BigInteger, nullable=False)
+    last_seen_run = db.Column(db.String(36), nullable=False)
+    
+    def __repr__(self):
+        return f'<SyncRowHash {self.table_name}:{self.row_id}>'
+
+class SchemaMigration(db.Model):
+    """Versioned schema migrations that have been applied to this database"""
+    __tablename__ = 'schema_migrations'
+    
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<SchemaMigration {self.version} - {self.name}>'
+
+class ProductSalesStat(db.Model):
+    """Pre-aggregated number of order items sold per product"""
+    __tablename__ = 'product_sales_stats'
+    
+    product_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    sales_count = db.Column(db.Integer, default=0, nullable=False)
+    
+    def __repr__(self):
+        return f'<ProductSalesStat {self.product_id} - {self.sales_count}>'
+
+class ProductInventoryStat(db.Model):
+    """Pre-aggregated total and available (unsold) inventory per product"""
+    __tablename__ = 'product_inventory_stats'
+    
+    product_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    total_count = db.Column(db.Integer, default=0, nullable=False)
+    available_count = db.Column(db.Integer, default=0, nullable=False)
+    
+    def __repr__(self):
+        return f'<ProductInventoryStat {self.product_id} - {self.available_count}/{self.total_count}>'
+
+class AggregateTotal(db.Model):
+    """Named table-wide counters kept alongside the per-product aggregates"""
+    __tablename__ = 'aggregate_totals'
+    
+    name = db.Column(db.String(100), primary_key=True)
+    value = db.Column(db.BigInteger, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<AggregateTotal {self.name}={self.value}>'
+
+class CacheVersion(db.Model):
+    """Version counters used to invalidate per-process caches across workers"""
+    __tablename__ = 'cache_versions'
+    
+    name = db.Column(db.String(100), primary_key=True)
+    version = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<CacheVersion {self.name}={self.version}>'
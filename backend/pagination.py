@@ -0,0 +1,49 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import tuple_
+
+class InvalidCursor(ValueError):
+    """A pagination cursor that was not produced by encode_cursor"""
+
+def encode_cursor(timestamp, row_id):
+    """Opaque cursor for a (timestamp, id) keyset position"""
+    raw = json.dumps([timestamp.isoformat(), row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """(timestamp, id) of a cursor; raises InvalidCursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        timestamp, row_id = json.loads(raw)
+        return datetime.fromisoformat(timestamp), str(row_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+
+def page_size(value, default, maximum):
+    """Requested page size clamped to [1, maximum]; raises ValueError if not a number"""
+    if value in (None, ''):
+        return default
+    return max(1, min(int(value), maximum))
+
+def before(timestamp_column, id_column, position):
+    """
+    Rows strictly before a keyset position in (timestamp, id) order. A
+    position without an id, i.e. (timestamp, None), compares on time only.
+    """
+    timestamp, row_id = position
+    if row_id is None:
+        return timestamp_column < timestamp
+    # Row-value comparison lets the (…, timestamp, id) index serve it as a range scan
+    return tuple_(timestamp_column, id_column) < _position(timestamp_column, id_column, position)
+
+def after(timestamp_column, id_column, position):
+    """Rows strictly after a keyset position in (timestamp, id) order"""
+    timestamp, row_id = position
+    if row_id is None:
+        return timestamp_column > timestamp
+    return tuple_(timestamp_column, id_column) > _position(timestamp_column, id_column, position)
+
+def _position(timestamp_column, id_column, position):
+    # Bound with the columns' types, so ids are converted like the stored ones
+    return tuple_(*position, types=[timestamp_column.type, id_column.type])
@@ -0,0 +1,515 @@
+"""
+Persistence of chat exchanges. An exchange (a user message, the reply and,
+for a first message, its conversation) is written in a single transaction,
+on PostgreSQL in a single statement, with ids and timestamps set here
+instead of by per-row column defaults.
+
+With MESSAGE_WRITE_BEHIND the request only appends the exchange to a local
+log (fsynced) and returns; a background flusher writes the queued exchanges
+of all requests in batches of one transaction each. Every process owns one
+log file in WRITE_BEHIND_DIR, locked while it runs. Logs whose process is
+gone (crashed or killed) are replayed by the next process that starts,
+skipping exchanges that reached the database before the crash.
+"""
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, update, values, column, bindparam, inspect, cast, String, Integer, DateTime
+from sqlalchemy.exc import IntegrityError, DataError
+from models import db, Conversation, Message, UUIDString, new_id
+from config import Config
+from history import PREVIEW_LENGTH, history_buffer
+from metrics import Counter, Gauge, Histogram
+
+chat_write_latency = Histogram(
+    'chat_write_seconds',
+    'Time a chat request spends persisting its exchange',
+    labelnames=('mode',)
+)
+write_behind_flush_seconds = Histogram(
+    'write_behind_flush_seconds',
+    'Duration of one write-behind batch transaction'
+)
+write_behind_lag = Histogram(
+    'write_behind_lag_seconds',
+    'Time from acknowledging an exchange to committing it'
+)
+write_behind_exchanges = Counter(
+    'write_behind_exchanges_total',
+    'Write-behind exchanges by outcome',
+    labelnames=('outcome',)
+)
+write_behind_pending = Gauge(
+    'write_behind_pending',
+    'Acknowledged exchanges not yet in the database'
+)
+
+def new_conversation(user_id, title="New Chat"):
+    """
+    A conversation for a first message. It stays out of the session and is
+    inserted together with its first exchange.
+    """
+    now = datetime.utcnow()
+    return Conversation(id=new_id(), user_id=user_id, title=title, created_at=now, updated_at=now,
+                        is_active=True, message_count=0, summary_message_count=0, summary_source_tokens=0)
+
+def pending_row(conversation):
+    """Columns of a conversation from new_conversation that is not written yet, else None"""
+    if conversation is None or not inspect(conversation).transient:
+        return None
+    return {'user_id': conversation.user_id, 'title': conversation.title, 'created_at': conversation.created_at}
+
+class Exchange:
+    """The rows of one chat exchange, ready to be inserted"""
+
+    def __init__(self, conversation_id, messages, conversation=None, queued_at=None):
+        self.conversation_id = conversation_id
+        self.messages = messages  # dicts of Message columns, oldest first
+        self.conversation = conversation  # dict of Conversation columns if it is new
+        self.queued_at = queued_at
+        self.seq = None
+        self.write_ms = None
+
+    @classmethod
+    def build(cls, conversation_id, user_message, ai_response, asked_at=None, answered_at=None, conversation=None):
+        """
+        Rows for a user message and the reply (if any), plus the pending
+        conversation row if given. The reply is dated after the question even
+        on the same clock tick, so the (created_at, id) order keeps them apart.
+        """
+        answered_at = answered_at or datetime.utcnow()
+        asked_at = asked_at or answered_at
+        if answered_at <= asked_at:
+            answered_at = asked_at + timedelta(microseconds=1)
+        messages = [{'id': new_id(), 'conversation_id': conversation_id, 'role': 'user',
+                     'content': user_message, 'created_at': asked_at}]
+        if ai_response:
+            messages.append({'id': new_id(), 'conversation_id': conversation_id, 'role': 'assistant',
+                             'content': ai_response, 'created_at': answered_at})
+        return cls(conversation_id, messages, conversation)
+
+    def history_rows(self):
+        return [(m['id'], m['role'], m['content']) for m in self.messages]
+
+    def to_record(self):
+        return {
+            'seq': self.seq,
+            'conversation_id': self.conversation_id,
+            'conversation': _dump_dates(self.conversation) if self.conversation else None,
+            'messages': [_dump_dates(m) for m in self.messages],
+        }
+
+    @classmethod
+    def from_record(cls, record):
+        conversation = _load_dates(record['conversation']) if record.get('conversation') else None
+        exchange = cls(record['conversation_id'], [_load_dates(m) for m in record['messages']], conversation)
+        exchange.seq = record.get('seq')
+        return exchange
+
+def _dump_dates(row):
+    return {key: value.isoformat() if isinstance(value, datetime) else value for key, value in row.items()}
+
+def _load_dates(row):
+    return {key: datetime.fromisoformat(row[key]) if key.endswith('_at') and row[key] else row[key] for key in row}
+
+# Core tables: parameter lists run as plain executemany, not ORM bulk operations
+conversations_table = Conversation.__table__
+messages_table = Message.__table__
+
+activity_many_statement = (
+    update(conversations_table)
+    .where(conversations_table.c.id == bindparam('conversation_id'))
+    .values(
+        message_count=conversations_table.c.message_count + bindparam('added'),
+        last_message_preview=bindparam('preview'),
+        updated_at=bindparam('at')
+    )
+)
+
+def exchange_statements(dialect_name, exchanges):
+    """
+    (statement, parameters) pairs that write exchanges: new conversations
+    with their counters already set, all messages in one multi-row insert,
+    and the activity of existing conversations. On PostgreSQL the inserts
+    become CTEs of one statement, so the whole write is one round trip.
+    """
+    activity = {}
+    for exchange in exchanges:
+        entry = activity.setdefault(exchange.conversation_id, {'new': None, 'added': 0})
+        if exchange.conversation:
+            entry['new'] = exchange.conversation
+        entry['added'] += len(exchange.messages)
+        entry['preview'] = exchange.messages[-1]['content'][:PREVIEW_LENGTH]
+        entry['at'] = exchange.messages[-1]['created_at']
+
+    conversations = [
+        dict(entry['new'], id=conversation_id, updated_at=entry['at'], is_active=True,
+             message_count=entry['added'], last_message_preview=entry['preview'], summary_message_count=0)
+        for conversation_id, entry in activity.items() if entry['new']
+    ]
+    existing = [
+        {'conversation_id': conversation_id, 'added': entry['added'], 'preview': entry['preview'], 'at': entry['at']}
+        for conversation_id, entry in activity.items() if not entry['new']
+    ]
+    writes = []
+    if conversations:
+        writes.append(insert(conversations_table).values(conversations))
+    writes.append(insert(messages_table).values([m for exchange in exchanges for m in exchange.messages]))
+
+    if dialect_name != 'postgresql':
+        statements = [(statement, None) for statement in writes]
+        if existing:
+            statements.append((activity_many_statement, existing))
+        return statements
+
+    if existing:
+        changes = values(
+            column('conversation_id', UUIDString()), column('added', Integer), column('preview', String), column('at', DateTime),
+            name='activity'
+        ).data([(row['conversation_id'], row['added'], row['preview'], row['at']) for row in existing])
+        statement = (
+            update(conversations_table)
+            # Untyped VALUES literals are text, and PostgreSQL has no uuid = text operator
+            .where(conversations_table.c.id == cast(changes.c.conversation_id, UUIDString()))
+            .values(
+                message_count=conversations_table.c.message_count + changes.c.added,
+                last_message_preview=changes.c.preview,
+                updated_at=changes.c.at
+            )
+        )
+    else:
+        statement = writes.pop()
+    if writes:
+        statement = statement.add_cte(*[write.cte(f'write_{i}') for i, write in enumerate(writes)])
+    return [(statement, None)]
+
+def execute_exchanges(connection, exchanges):
+    """Run the statements of exchanges on a session or connection; the caller commits"""
+    dialect_name = connection.get_bind().dialect.name if hasattr(connection, 'get_bind') else connection.dialect.name
+    for statement, parameters in exchange_statements(dialect_name, exchanges):
+        connection.execute(statement, parameters)
+
+def save_exchanges(exchanges):
+    """
+    Persist exchanges: in one transaction of the request's session, or
+    queued to the write-behind log. Feeds the history buffer either way.
+    Returns the seconds the caller waited.
+    """
+    started = time.perf_counter()
+    if write_behind.enabled:
+        write_behind.enqueue(exchanges)
+        mode = 'write_behind'
+    else:
+        try:
+            execute_exchanges(db.session, exchanges)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        mode = 'sync'
+    elapsed = time.perf_counter() - started
+    chat_write_latency.observe(elapsed, mode=mode)
+    for exchange in exchanges:
+        history_buffer.append(exchange.conversation_id, exchange.history_rows())
+    return elapsed
+
+class WriteBehindLog:
+    """
+    Write-behind queue of exchanges backed by an append-only log of JSON
+    lines: {"seq": ..., ...} per exchange and {"checkpoint": seq} once the
+    exchanges up to seq are committed. The log is truncated whenever the
+    queue drains and compacted once it grows past max_log_bytes.
+    """
+
+    def __init__(self, enabled, directory, flush_interval, batch_size, fsync=True,
+                 max_log_bytes=64 * 1024 * 1024, barrier_timeout=5.0):
+        self.enabled = enabled
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self.max_log_bytes = max_log_bytes
+        self.barrier_timeout = barrier_timeout
+        self.app = None
+        self.path = None
+        self.last_flush_ms = None
+        self.last_error = None
+        self._fd = None
+        self._pid = None
+        self._queue = []
+        self._pending = {}  # conversation id -> queued exchanges
+        self._seq = 0
+        self._flushed_seq = 0
+        self._urgent = False
+        self._closing = False
+        self._thread = None
+        self._condition = threading.Condition()
+
+    def init_app(self, app):
+        self.app = app
+
+    def enqueue(self, exchanges):
+        """Append exchanges to the log; they are durable locally when this returns"""
+        self._ensure_started()
+        now = time.time()
+        with self._condition:
+            lines = []
+            for exchange in exchanges:
+                self._seq += 1
+                exchange.seq = self._seq
+                exchange.queued_at = now
+                lines.append(json.dumps(exchange.to_record(), separators=(',', ':')) + '\n')
+            os.write(self._fd, ''.join(lines).encode('utf-8'))
+            fd = self._fd
+            for exchange in exchanges:
+                self._queue.append(exchange)
+                self._pending[exchange.conversation_id] = self._pending.get(exchange.conversation_id, 0) + 1
+            write_behind_pending.set(len(self._queue))
+            if len(self._queue) >= self.batch_size:
+                self._condition.notify_all()
+        if self.fsync:
+            # Outside the lock, so concurrent requests share the disk flush
+            os.fsync(fd)
+
+    def barrier(self, conversation_id=None):
+        """
+        Wait until the queued exchanges of a conversation (all of them
+        without an id) are in the database, so reads see this process's
+        acknowledged writes. Returns False on timeout.
+        """
+        if not self.enabled or self._pid != os.getpid():
+            return True
+        with self._condition:
+            if conversation_id is not None and not self._pending.get(conversation_id):
+                return True
+            if not self._queue:
+                return True
+            target = self._queue[-1].seq
+            self._urgent = True
+            self._condition.notify_all()
+            flushed = self._condition.wait_for(lambda: self._flushed_seq >= target, self.barrier_timeout)
+        if not flushed:
+            print(f"Write-behind barrier timed out; reading without exchanges up to {target}")
+        return flushed
+
+    def stats(self):
+        with self._condition:
+            return {
+                'enabled': self.enabled,
+                'log': self.path,
+                'pending': len(self._queue),
+                'queued': self._seq,
+                'flushed': self._flushed_seq,
+                'last_flush_ms': self.last_flush_ms,
+                'last_error': self.last_error,
+            }
+
+    def close(self, timeout=30):
+        """Flush what is queued and stop the flusher; the log is removed once empty"""
+        with self._condition:
+            thread = self._thread if self._pid == os.getpid() else None
+            self._closing = True
+            self._condition.notify_all()
+        if thread is not None:
+            thread.join(timeout)
+        with self._condition:
+            if self._fd is not None and self._pid == os.getpid():
+                os.close(self._fd)
+                if not self._queue:
+                    os.remove(self.path)
+            self._fd = None
+            self._thread = None
+
+    def _ensure_started(self):
+        if self._pid == os.getpid() and not self._closing:
+            return
+        with self._condition:
+            if self._pid == os.getpid() and not self._closing:
+                return
+            if self.app is None:
+                raise RuntimeError("Write-behind is enabled but not initialized with an app")
+            # After a fork the parent's queue, lock and flusher do not belong to this process
+            self._queue, self._pending, self._closing, self._urgent = [], {}, False, False
+            os.makedirs(self.directory, exist_ok=True)
+            self.path = os.path.join(self.directory, f"{os.getpid()}-{uuid.uuid4().hex[:8]}.wal")
+            self._fd = self._open_locked(self.path)
+            self._pid = os.getpid()
+            self.recover(self.app)
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._thread.start()
+
+    def _open_locked(self, path):
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return fd
+
+    def _run(self):
+        backoff = self.flush_interval
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._queue or self._closing)
+                if not self._queue:
+                    return
+                # Gather exchanges of concurrent requests for up to one interval
+                deadline = time.monotonic() + self.flush_interval
+                while len(self._queue) < self.batch_size and not (self._urgent or self._closing):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                self._urgent = False
+                batch = self._queue[:self.batch_size]
+
+            try:
+                rejected = self._write(batch)
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Write-behind flush failed, retrying in {backoff:.2f}s: {str(e)}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 5.0)
+                continue
+            backoff = self.flush_interval
+
+            now = time.time()
+            for exchange in batch:
+                if exchange not in rejected:
+                    write_behind_lag.observe(now - exchange.queued_at)
+            with self._condition:
+                del self._queue[:len(batch)]
+                for exchange in batch:
+                    remaining = self._pending.get(exchange.conversation_id, 1) - 1
+                    if remaining:
+                        self._pending[exchange.conversation_id] = remaining
+                    else:
+                        self._pending.pop(exchange.conversation_id, None)
+                self._flushed_seq = batch[-1].seq
+                self._checkpoint()
+                write_behind_pending.set(len(self._queue))
+                self._condition.notify_all()
+
+    def _write(self, batch):
+        """Commit a batch in one transaction; returns the exchanges rejected by the database"""
+        started = time.perf_counter()
+        with self.app.app_context():
+            rejected = write_exchanges(db.engine, batch, self.path)
+        self.last_flush_ms = round((time.perf_counter() - started) * 1000, 2)
+        self.last_error = None
+        write_behind_flush_seconds.observe(self.last_flush_ms / 1000)
+        write_behind_exchanges.inc(len(batch) - len(rejected), outcome='flushed')
+        return rejected
+
+    def _checkpoint(self):
+        """Record progress in the log; called with the lock held"""
+        if not self._queue:
+            os.ftruncate(self._fd, 0)
+            return
+        os.write(self._fd, f'{{"checkpoint":{self._flushed_seq}}}\n'.encode('utf-8'))
+        if os.fstat(self._fd).st_size > self.max_log_bytes:
+            self._compact()
+
+    def _compact(self):
+        """Rewrite the log with only the queued exchanges, under a lock held throughout"""
+        temporary = self.path + '.tmp'
+        fd = self._open_locked(temporary)
+        lines = ''.join(json.dumps(exchange.to_record(), separators=(',', ':')) + '\n' for exchange in self._queue)
+        os.write(fd, lines.encode('utf-8'))
+        os.fsync(fd)
+        os.replace(temporary, self.path)
+        os.close(self._fd)
+        self._fd = fd
+
+    def recover(self, app):
+        """
+        Replay the logs of processes that are gone. Returns how many
+        exchanges were written.
+        """
+        recovered = 0
+        for path in sorted(glob.glob(os.path.join(self.directory, '*.wal'))):
+            if path == self.path:
+                continue
+            try:
+                fd = self._open_locked(path)
+            except (BlockingIOError, FileNotFoundError):
+                continue  # its process is alive
+            try:
+                exchanges = read_log(path)
+                with app.app_context():
+                    replay = unwritten(exchanges)
+                    for start in range(0, len(replay), self.batch_size):
+                        batch = replay[start:start + self.batch_size]
+                        recovered += len(batch) - len(write_exchanges(db.engine, batch, path))
+                    db.session.remove()
+                if exchanges:
+                    print(f"Write-behind: replayed {len(replay)} of {len(exchanges)} exchanges from {path}")
+                    write_behind_exchanges.inc(len(replay), outcome='recovered')
+                os.remove(path)
+            except Exception as e:
+                print(f"Write-behind: could not replay {path}, keeping it: {str(e)}")
+            finally:
+                os.close(fd)
+        return recovered
+
+def read_log(path):
+    """Exchanges of a log not covered by a checkpoint; a torn last line is ignored"""
+    exchanges = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if 'checkpoint' in record:
+                for seq in [seq for seq in exchanges if seq <= record['checkpoint']]:
+                    del exchanges[seq]
+            else:
+                exchanges[record['seq']] = Exchange.from_record(record)
+    return [exchanges[seq] for seq in sorted(exchanges)]
+
+def unwritten(exchanges):
+    """
+    Exchanges whose messages are not in the database. An exchange commits
+    as a whole, so checking its first message is enough.
+    """
+    found = set()
+    ids = [exchange.messages[0]['id'] for exchange in exchanges]
+    for start in range(0, len(ids), 500):
+        found.update(db.session.execute(select(Message.id).where(Message.id.in_(ids[start:start + 500]))).scalars())
+    return [exchange for exchange in exchanges if exchange.messages[0]['id'] not in found]
+
+def write_exchanges(engine, exchanges, log_path):
+    """
+    Commit exchanges in one transaction. If the database rejects the batch
+    (an unknown user, say), the exchanges are retried one by one and the
+    rejected ones are set aside in <log>.rejected instead of blocking the
+    queue. Returns the rejected exchanges.
+    """
+    try:
+        with engine.begin() as connection:
+            execute_exchanges(connection, exchanges)
+        return []
+    except (IntegrityError, DataError) as e:
+        if len(exchanges) == 1:
+            with open(log_path + '.rejected', 'a', encoding='utf-8') as f:
+                f.write(json.dumps(dict(exchanges[0].to_record(), error=str(e.orig))) + '\n')
+            write_behind_exchanges.inc(outcome='rejected')
+            print(f"Write-behind: rejected an exchange of conversation {exchanges[0].conversation_id}: {str(e.orig)}")
+            return exchanges
+    rejected = []
+    for exchange in exchanges:
+        rejected.extend(write_exchanges(engine, [exchange], log_path))
+    return rejected
+
+write_behind = WriteBehindLog(
+    Config.MESSAGE_WRITE_BEHIND,
+    Config.WRITE_BEHIND_DIR,
+    Config.WRITE_BEHIND_FLUSH_INTERVAL,
+    Config.WRITE_BEHIND_BATCH_SIZE,
+    fsync=Config.WRITE_BEHIND_FSYNC,
+    max_log_bytes=Config.WRITE_BEHIND_MAX_LOG_BYTES,
+    barrier_timeout=Config.WRITE_BEHIND_BARRIER_TIMEOUT
+)
@@ -0,0 +1,165 @@
+import heapq
+import math
+import re
+import threading
+import time
+from collections import defaultdict
+from models import db, Product
+from cache import DATASET_VERSION, read_version
+from config import Config
+
+# Words that say nothing about which product is meant
+STOPWORDS = {
+    'the', 'and', 'for', 'are', 'you', 'your', 'our', 'how', 'many', 'much', 'what', 'which',
+    'have', 'has', 'any', 'there', 'left', 'stock', 'inventory', 'available', 'show', 'tell',
+    'about', 'with', 'still', 'check', 'can', 'please', 'item', 'items', 'product', 'products',
+    'units', 'unit', 'some', 'this', 'that', 'does', 'did', 'want', 'need', 'buy', 'sell',
+}
+
+# Minimum trigram similarity for a fuzzy token match
+FUZZY_THRESHOLD = 0.45
+
+def tokenize(text):
+    """
+    Lowercase word tokens of a text. Hyphenated and split words also yield
+    their concatenation ("t-shirt" gives "t", "shirt" and "tshirt") and a
+    trailing plural "s" is dropped.
+    """
+    words = re.findall(r'[a-z0-9]+(?:-[a-z0-9]+)*', (text or '').lower())
+    tokens = []
+    for word in words:
+        parts = word.split('-')
+        tokens.extend(parts)
+        if len(parts) > 1:
+            tokens.append(''.join(parts))
+    return [t[:-1] if len(t) > 3 and t.endswith('s') and not t.endswith('ss') else t for t in tokens]
+
+def trigrams(token):
+    padded = f'  {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class ProductMatch:
+    """A ranked product search result"""
+
+    def __init__(self, product_id, name, brand, sku, score):
+        self.product_id = product_id
+        self.name = name
+        self.brand = brand
+        self.sku = sku
+        self.score = score
+
+    def __repr__(self):
+        return f'<ProductMatch {self.product_id} {self.name} ({self.score:.2f})>'
+
+class ProductSearchIndex:
+    """Token and trigram inverted index over product names, brands and SKUs"""
+
+    def __init__(self, products):
+        self.products = {}
+        self.postings = defaultdict(set)      # token -> product ids
+        self.token_trigrams = defaultdict(set)  # trigram -> vocabulary tokens
+        self.sku_index = {}                   # lowercased sku -> product id
+
+        for product_id, name, brand, sku in products:
+            self.products[product_id] = (name, brand, sku)
+            for token in set(tokenize(name) + tokenize(brand)):
+                self.postings[token].add(product_id)
+            if sku:
+                self.sku_index[sku.lower()] = product_id
+
+        for token in self.postings:
+            if len(token) >= 3:
+                for gram in trigrams(token):
+                    self.token_trigrams[gram].add(token)
+
+        total = max(len(self.products), 1)
+        self.idf = {token: math.log(1 + total / len(ids)) for token, ids in self.postings.items()}
+
+    @classmethod
+    def from_database(cls):
+        rows = db.session.query(Product.id, Product.name, Product.brand, Product.sku).all()
+        return cls(rows)
+
+    def _similar_tokens(self, token):
+        """Vocabulary tokens with their similarity to a query token: exact, then trigram fuzzy"""
+        if token in self.postings:
+            return [(token, 1.0)]
+        if len(token) < 3:
+            return []
+
+        query = trigrams(token)
+        shared = defaultdict(int)
+        for gram in query:
+            for candidate in self.token_trigrams.get(gram, ()):
+                shared[candidate] += 1
+
+        matches = []
+        for candidate, count in shared.items():
+            similarity = count / (len(query) + len(trigrams(candidate)) - count)
+            if similarity >= FUZZY_THRESHOLD:
+                matches.append((candidate, similarity))
+        return matches
+
+    def search(self, text, limit=5):
+        """Rank products against every meaningful token of a message in one pass"""
+        scores = defaultdict(float)
+
+        for word in re.findall(r'[a-z0-9-]+', (text or '').lower()):
+            product_id = self.sku_index.get(word)
+            if product_id is not None:
+                scores[product_id] += 100.0
+
+        for token in set(tokenize(text)):
+            if token in STOPWORDS or len(token) < 3:
+                continue
+            for candidate, similarity in self._similar_tokens(token):
+                weight = similarity * self.idf[candidate]
+                for product_id in self.postings[candidate]:
+                    scores[product_id] += weight
+
+        # Prefer higher scores, then shorter (more specific) names
+        ranked = heapq.nsmallest(
+            limit,
+            scores.items(),
+            key=lambda item: (-item[1], len(self.products[item[0]][0] or ''), item[0])
+        )
+        return [ProductMatch(product_id, *self.products[product_id], score) for product_id, score in ranked]
+
+class ProductSearchService:
+    """
+    Process-wide product index that rebuilds itself whenever the dataset
+    version changes (i.e. after a load or sync), checked at most once per
+    cache version check interval.
+    """
+
+    def __init__(self, check_interval=None):
+        self.check_interval = Config.CACHE_VERSION_CHECK_INTERVAL if check_interval is None else check_interval
+        self._index = None
+        self._version = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def index(self):
+        now = time.monotonic()
+        if self._index is not None and now < self._next_check:
+            return self._index
+
+        with self._lock:
+            self._next_check = now + self.check_interval
+            version = read_version(DATASET_VERSION)
+            if self._index is None or version != self._version:
+                started = time.perf_counter()
+                self._index = ProductSearchIndex.from_database()
+                self._version = version
+                print(f"Built product search index over {len(self._index.products)} products "
+                      f"in {time.perf_counter() - started:.2f}s")
+        return self._index
+
+    def search(self, text, limit=5):
+        return self.index().search(text, limit)
+
+    def best_match(self, text):
+        matches = self.search(text, limit=1)
+        return matches[0] if matches else None
+
+product_search = ProductSearchService()
@@ -0,0 +1,138 @@
+import re
+from functools import lru_cache
+from metrics import Counter, Histogram
+
+# Word and punctuation pieces; BPE vocabularies cover short English words in one
+# token and split longer ones, so a piece counts one token per started 6 characters
+TOKEN_PIECE = re.compile(r"\w+|[^\w\s]")
+CHARS_PER_TOKEN = 6
+
+# Tokens the chat format adds around every message (role and separators)
+MESSAGE_OVERHEAD = 4
+
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+prompt_tokens = Histogram(
+    'llm_prompt_tokens',
+    'Estimated prompt tokens sent per chat request after packing',
+    buckets=TOKEN_BUCKETS
+)
+prompt_tokens_saved = Counter(
+    'llm_prompt_tokens_saved_total',
+    'Estimated prompt tokens saved by packing compared with sending the raw history (including what the summary replaces)'
+)
+history_messages_dropped = Counter(
+    'llm_prompt_history_messages_dropped_total',
+    'History messages left out of a prompt because they did not fit the token budget'
+)
+
+@lru_cache(maxsize=8192)
+def count_tokens(text):
+    """
+    Local estimate of the tokens in a text. Errs on the high side for long
+    words, so a prompt packed to a budget stays within it.
+    """
+    return sum(1 + (len(piece) - 1) // CHARS_PER_TOKEN for piece in TOKEN_PIECE.findall(text or ''))
+
+def message_tokens(message):
+    return count_tokens(message['content']) + MESSAGE_OVERHEAD
+
+def truncate_tokens(text, max_tokens):
+    """The end of text, cut at a piece boundary to at most max_tokens"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    pieces = list(TOKEN_PIECE.finditer(text))
+    tokens = 0
+    start = len(text)
+    for piece in reversed(pieces):
+        tokens += 1 + (len(piece.group()) - 1) // CHARS_PER_TOKEN
+        if tokens > max_tokens:
+            break
+        start = piece.start()
+    return text[start:]
+
+class PackedPrompt:
+    """Messages of one chat request with the accounting of how they were packed"""
+
+    def __init__(self, messages, tokens, unpacked_tokens, budget, history_messages, dropped_messages, summarized):
+        self.messages = messages
+        self.tokens = tokens
+        self.unpacked_tokens = unpacked_tokens
+        self.budget = budget
+        self.history_messages = history_messages
+        self.dropped_messages = dropped_messages
+        self.summarized = summarized
+
+    @property
+    def saved(self):
+        return self.unpacked_tokens - self.tokens
+
+    def report(self):
+        return {
+            'tokens': self.tokens,
+            'unpacked_tokens': self.unpacked_tokens,
+            'saved': self.saved,
+            'budget': self.budget,
+            'history_messages': self.history_messages,
+            'dropped_messages': self.dropped_messages,
+            'summarized': self.summarized
+        }
+
+class PromptPacker:
+    """
+    Packs the system prompt, an optional conversation summary, history and
+    the user message into a token budget. The system prompt, summary and
+    user message are always sent; history is added newest first until the
+    next message would not fit, so what is sent is always a contiguous tail
+    of the conversation.
+    """
+
+    def __init__(self, budget, window):
+        self.budget = budget
+        self.window = window
+
+    def pack(self, system_prompt, history, user_message, summary=None, summarized=0, summary_source_tokens=0):
+        """
+        history is the recent message window, oldest first; its first
+        `summarized` messages are already covered by summary and left out.
+        summary_source_tokens is the size of all the raw messages the summary
+        stands in for, which the savings are measured against.
+        """
+        system = {"role": "system", "content": system_prompt}
+        user = {"role": "user", "content": user_message}
+        window = history[-self.window:] if history else []
+        candidates = window[summarized:]
+        fixed_tokens = message_tokens(system) + message_tokens(user)
+        unpacked_tokens = fixed_tokens + sum(message_tokens(m) for m in candidates)
+
+        head = [system]
+        if summary:
+            head.append({"role": "system", "content": f"Summary of the earlier conversation: {summary}"})
+            fixed_tokens += message_tokens(head[-1])
+            # Summaries stored before their source was counted fall back to the folded part of the window
+            folded = summary_source_tokens or sum(message_tokens(m) for m in window[:summarized])
+            unpacked_tokens += max(folded, message_tokens(head[-1]))
+
+        remaining = self.budget - fixed_tokens
+        packed = []
+        for message in reversed(candidates):
+            cost = message_tokens(message)
+            if cost > remaining:
+                break
+            remaining -= cost
+            packed.append({"role": message['role'], "content": message['content']})
+        packed.reverse()
+
+        prompt = PackedPrompt(
+            messages=head + packed + [user],
+            tokens=self.budget - remaining,
+            unpacked_tokens=unpacked_tokens,
+            budget=self.budget,
+            history_messages=len(packed),
+            dropped_messages=len(candidates) - len(packed),
+            summarized=bool(summary)
+        )
+        prompt_tokens.observe(prompt.tokens)
+        prompt_tokens_saved.inc(max(prompt.saved, 0))
+        history_messages_dropped.inc(prompt.dropped_messages)
+        return prompt
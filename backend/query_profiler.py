@@ -0,0 +1,317 @@
+import contextvars
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from config import Config
+from metrics import Counter, Histogram
+import tracing
+
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# Stands in for bound parameters in the slow queries kept for GET /api/profiler/queries
+REDACTED = '[redacted]'
+
+query_duration = Histogram(
+    'db_query_duration_seconds',
+    'Duration of database statements by kind',
+    labelnames=('kind',)
+)
+queries_per_request = Histogram(
+    'db_queries_per_request',
+    'Database statements executed per request',
+    labelnames=('route',),
+    buckets=QUERY_COUNT_BUCKETS
+)
+query_time_per_request = Histogram(
+    'db_query_time_per_request_seconds',
+    'Total database time per request',
+    labelnames=('route',)
+)
+repeated_query_requests = Counter(
+    'db_repeated_query_requests_total',
+    'Requests that ran the same statement shape QUERY_REPEAT_THRESHOLD times or more (likely N+1)',
+    labelnames=('route',)
+)
+slow_queries = Counter(
+    'db_slow_queries_total',
+    'Statements slower than QUERY_SLOW_THRESHOLD_MS'
+)
+query_budget_exceeded = Counter(
+    'db_query_budget_exceeded_total',
+    'Requests that ran more statements than their query budget',
+    labelnames=('route',)
+)
+
+class QueryBudgetExceeded(Exception):
+    """A request ran more statements than its query budget allows"""
+
+# Literals and placeholder lists vary between executions of the same query shape
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+PLACEHOLDER = r"(?:\?|%s|%\(\w+\)s|:\w+|\$\d+)"
+PLACEHOLDER_LIST = re.compile(rf"\(\s*{PLACEHOLDER}(?:\s*,\s*{PLACEHOLDER})*\s*\)")
+WHITESPACE = re.compile(r"\s+")
+
+@lru_cache(maxsize=4096)
+def fingerprint(statement):
+    """
+    (id, normalized statement) of a query shape: literals become ? and
+    IN lists of any length one (?), so statements that differ only in
+    their values share an id.
+    """
+    normalized = STRING_LITERAL.sub('?', statement)
+    normalized = NUMBER_LITERAL.sub('?', normalized)
+    normalized = PLACEHOLDER_LIST.sub('(?)', normalized)
+    normalized = WHITESPACE.sub(' ', normalized).strip()
+    return hashlib.sha1(normalized.encode()).hexdigest()[:12], normalized
+
+def statement_kind(statement):
+    word = statement.lstrip()[:6].lower()
+    return word if word in ('select', 'insert', 'update', 'delete') else 'other'
+
+class RequestQueries:
+    """Statements run by one request, grouped by shape"""
+
+    def __init__(self, budget=0, strict=False):
+        self.budget = budget
+        self.strict = strict
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes = {}  # fingerprint -> [normalized statement, count, seconds]
+
+    def add(self, shape, normalized, seconds):
+        self.count += 1
+        self.seconds += seconds
+        entry = self.shapes.get(shape)
+        if entry is None:
+            self.shapes[shape] = [normalized, 1, seconds]
+        else:
+            entry[1] += 1
+            entry[2] += seconds
+
+    def repeated(self, threshold):
+        """Shapes run at least threshold times, most frequent first"""
+        found = [
+            {'fingerprint': shape, 'statement': entry[0], 'count': entry[1], 'time_ms': round(entry[2] * 1000, 3)}
+            for shape, entry in self.shapes.items() if entry[1] >= threshold
+        ]
+        return sorted(found, key=lambda r: r['count'], reverse=True)
+
+    def report(self):
+        return {
+            'count': self.count,
+            'time_ms': round(self.seconds * 1000, 3),
+            'budget': self.budget or None,
+            'repeated': self.repeated(query_profiler.repeat_threshold)
+        }
+
+# Budget set by query_budget() for requests started in this context
+_budget_override = contextvars.ContextVar('query_budget', default=None)
+
+@contextmanager
+def query_budget(max_queries):
+    """
+    Make every request started inside the block fail with
+    QueryBudgetExceeded once it runs more than max_queries statements.
+    Meant for tests:
+
+        with query_budget(5):
+            response = client.get('/api/conversations')
+    """
+    token = _budget_override.set(max_queries)
+    try:
+        yield
+    finally:
+        _budget_override.reset(token)
+
+class QueryProfiler:
+    """
+    Times every statement of every engine through SQLAlchemy cursor events.
+    Inside a request the statements are added to its trace: count, total
+    time and repeated shapes (N+1 patterns) are exported per route when the
+    request finishes. Statements slower than the threshold are logged with
+    their parameters and query plan. All settings can be changed at runtime
+    with configure().
+    """
+
+    SETTINGS = ('enabled', 'slow_query_ms', 'repeat_threshold', 'budget', 'strict', 'explain')
+
+    def __init__(self):
+        self.enabled = Config.QUERY_PROFILER_ENABLED
+        self.slow_query_ms = Config.QUERY_SLOW_THRESHOLD_MS
+        self.repeat_threshold = Config.QUERY_REPEAT_THRESHOLD
+        self.budget = Config.QUERY_BUDGET
+        self.strict = Config.QUERY_BUDGET_STRICT
+        self.explain = Config.QUERY_EXPLAIN_SLOW
+        self.log_path = Config.QUERY_LOG_PATH
+        self.log_parameters = Config.QUERY_LOG_PARAMETERS
+        self.app = None
+        self.recent_slow = deque(maxlen=50)
+        self._reported = set()
+        self._lock = threading.Lock()
+        self._installed = False
+
+    def install(self):
+        """Listen to the cursor events of every engine of this process"""
+        with self._lock:
+            if self._installed:
+                return
+            self._installed = True
+        event.listen(Engine, 'before_cursor_execute', self._before_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_execute)
+        tracing.finish_hooks.append(self._finish_request)
+
+    def init_app(self, app):
+        """Install, and enforce query budgets strictly while the app is in testing mode"""
+        self.app = app
+        self.install()
+
+    def configure(self, **settings):
+        """Change settings at runtime; raises ValueError for unknown or invalid ones"""
+        for name, value in settings.items():
+            if name not in self.SETTINGS:
+                raise ValueError(f'Unknown profiler setting: {name}')
+            if name in ('enabled', 'strict', 'explain'):
+                if not isinstance(value, bool):
+                    raise ValueError(f'{name} must be true or false')
+            elif isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                raise ValueError(f'{name} must be a non-negative number')
+        for name, value in settings.items():
+            setattr(self, name, value)
+        return self.settings()
+
+    def settings(self):
+        return {name: getattr(self, name) for name in self.SETTINGS}
+
+    def _request_queries(self, trace):
+        if trace.queries is None:
+            override = _budget_override.get()
+            if override is not None:
+                trace.queries = RequestQueries(override, strict=True)
+            else:
+                strict = self.strict or (self.app is not None and self.app.testing)
+                trace.queries = RequestQueries(self.budget, strict)
+        return trace.queries
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if not self.enabled:
+            return
+        trace = tracing.current_trace()
+        if trace is not None:
+            queries = self._request_queries(trace)
+            if queries.strict and queries.budget and queries.count >= queries.budget:
+                raise QueryBudgetExceeded(
+                    f'{trace.method} {trace.route} exceeded its budget of {queries.budget} queries; '
+                    f'repeated: {[r["statement"] for r in queries.repeated(2)]}'
+                )
+        context._query_profiler_started = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, '_query_profiler_started', None)
+        if started is None:
+            return
+        seconds = time.perf_counter() - started
+        query_duration.observe(seconds, kind=statement_kind(statement))
+
+        trace = tracing.current_trace()
+        if trace is not None:
+            shape, normalized = fingerprint(statement)
+            self._request_queries(trace).add(shape, normalized, seconds)
+        if seconds * 1000 >= self.slow_query_ms:
+            self._log_slow(conn, statement, parameters, executemany, seconds, trace)
+
+    def _finish_request(self, trace, status):
+        queries = trace.queries
+        if queries is None:
+            if self.enabled:
+                queries_per_request.observe(0, route=trace.route)
+            return
+        queries_per_request.observe(queries.count, route=trace.route)
+        query_time_per_request.observe(queries.seconds, route=trace.route)
+
+        repeated = queries.repeated(self.repeat_threshold)
+        if repeated:
+            repeated_query_requests.inc(route=trace.route)
+            for entry in repeated:
+                key = (trace.route, entry['fingerprint'])
+                if key in self._reported:
+                    continue
+                self._reported.add(key)
+                print(f"Repeated query on {trace.method} {trace.route} ({entry['count']}x in one request): {entry['statement']}")
+        if queries.budget and queries.count > queries.budget:
+            query_budget_exceeded.inc(route=trace.route)
+            print(f"{trace.method} {trace.route} ran {queries.count} queries, over its budget of {queries.budget}")
+
+    def _log_slow(self, conn, statement, parameters, executemany, seconds, trace):
+        slow_queries.inc()
+        entry = {
+            'at': datetime.utcnow().isoformat(),
+            'request_id': trace.request_id if trace else None,
+            'route': trace.route if trace else None,
+            'duration_ms': round(seconds * 1000, 3),
+            'statement': statement,
+            # Bound parameters carry user content such as chat messages
+            'parameters': repr(parameters)[:1000] if self.log_parameters else REDACTED,
+            'plan': self._explain(conn, statement, parameters) if self.explain and not executemany else None
+        }
+        # Served over HTTP, so never with the raw parameters
+        self.recent_slow.append(dict(entry, parameters=REDACTED))
+        if not self.log_path:
+            print(f"Slow query ({entry['duration_ms']} ms) on {entry['route']}: {WHITESPACE.sub(' ', statement)[:500]}")
+            return
+        try:
+            with self._lock:
+                directory = os.path.dirname(self.log_path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.log_path, 'a') as f:
+                    f.write(json.dumps(entry) + '\n')
+        except OSError as e:
+            print(f"Error writing query log: {str(e)}")
+
+    def _explain(self, conn, statement, parameters):
+        """
+        Query plan of a slow SELECT, read on the same connection through a
+        plain DBAPI cursor so the open result and the events are untouched
+        """
+        if statement_kind(statement) != 'select' and not statement.lstrip()[:4].lower() == 'with':
+            return None
+        dialect = conn.dialect.name
+        if dialect == 'sqlite':
+            prefix = 'EXPLAIN QUERY PLAN '
+        elif dialect in ('postgresql', 'mysql', 'mariadb'):
+            prefix = 'EXPLAIN '
+        else:
+            return None
+
+        # On PostgreSQL a failed statement aborts the transaction; contain it in a savepoint
+        savepoint = dialect == 'postgresql'
+        cursor = conn.connection.cursor()
+        try:
+            if savepoint:
+                cursor.execute('SAVEPOINT query_profiler_explain')
+            try:
+                cursor.execute(prefix + statement, parameters)
+                plan = [str(row[-1]) for row in cursor.fetchall()]
+            except Exception as e:
+                if savepoint:
+                    cursor.execute('ROLLBACK TO SAVEPOINT query_profiler_explain')
+                return [f'EXPLAIN failed: {str(e)}']
+            if savepoint:
+                cursor.execute('RELEASE SAVEPOINT query_profiler_explain')
+            return plan
+        except Exception as e:
+            return [f'EXPLAIN failed: {str(e)}']
+        finally:
+            cursor.close()
+
+query_profiler = QueryProfiler()
@@ -0,0 +1,115 @@
+"""
+Process lifecycle of the production server (see gunicorn.conf.py): database
+preparation once per deployment, warmup of every worker before it accepts
+connections, and a clean worker exit.
+"""
+import os
+import time
+from sqlalchemy.pool import QueuePool
+from config import Config
+
+# One message per kind of database context, so every context cache entry a
+# typical chat needs is built before the first request
+WARMUP_MESSAGES = [
+    "What are the top 5 most sold products?",
+    "Tell me about your product categories",
+    "How many items are in stock?",
+]
+
+def default_workers(worker_class, cpus):
+    """Worker processes for a worker model when SERVER_WORKERS is not set"""
+    if worker_class == 'sync':
+        return 2 * cpus + 1
+    # Threads or greenlets already serve many requests per worker
+    return cpus + 1
+
+def prepare_database():
+    """
+    Create tables, apply pending migrations, create upcoming message
+    partitions and replay write-behind logs left by crashed workers
+    """
+    from app import create_app
+    from models import db
+    from migrations import run_migrations
+    from persistence import write_behind
+    from archive import maintain_partitions
+
+    app = create_app(engine_options=Config.BATCH_ENGINE_OPTIONS)
+    with app.app_context():
+        db.create_all()
+        run_migrations()
+        maintain_partitions()
+    if write_behind.enabled:
+        write_behind.recover(app)
+    with app.app_context():
+        db.engine.dispose()
+
+def after_fork(app):
+    """Drop connections inherited from the master; they must not be shared between processes"""
+    from models import db
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+def patch_for_gevent():
+    """Make psycopg2 cooperate with gevent, if psycogreen is installed"""
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        print("Warning: psycogreen is not installed; database calls will block gevent workers")
+        return
+    patch_psycopg()
+
+def warm_up(app, chat_service):
+    """
+    Open the worker's database connections and build the caches the first
+    requests would otherwise build: product search index, chat context and
+    fast statistics. Returns the seconds spent per step.
+    """
+    from models import db
+    from product_search import product_search
+    from stats import fast_stats
+    from intent_router import route
+
+    timings = {}
+    with app.app_context():
+        started = time.perf_counter()
+        pool = db.engine.pool
+        connections = []
+        try:
+            for _ in range(pool.size() if isinstance(pool, QueuePool) else 1):
+                connection = db.engine.connect()
+                connection.exec_driver_sql('SELECT 1')
+                connections.append(connection)
+        finally:
+            for connection in connections:
+                connection.close()
+        timings['connections'] = time.perf_counter() - started
+
+        steps = [
+            ('product_search', product_search.index),
+            ('context', lambda: [chat_service._get_database_context(message) for message in WARMUP_MESSAGES]),
+            ('intent_router', lambda: [route(message) for message in WARMUP_MESSAGES]),
+            ('stats', fast_stats),
+        ]
+        for name, step in steps:
+            started = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                print(f"Warmup step {name} failed: {str(e)}")
+            timings[name] = time.perf_counter() - started
+        db.session.remove()
+
+    print(f"Worker {os.getpid()} warmed up in {sum(timings.values()):.2f}s "
+          f"({', '.join(f'{name} {seconds * 1000:.0f}ms' for name, seconds in timings.items())})")
+    return timings
+
+def shutdown(app):
+    """Let queued background work finish and close the worker's connections"""
+    from models import db
+    from summaries import summarizer
+    from persistence import write_behind
+    summarizer.shutdown()
+    write_behind.close()
+    with app.app_context():
+        db.engine.dispose()
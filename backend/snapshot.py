@@ -0,0 +1,342 @@
+"""
+Columnar snapshot of the sales tables for analytics. export_snapshot writes
+orders, order_items, products and inventory_items to uncompressed Arrow IPC
+files after every load or sync. Workers memory-map those files, so all
+processes on a host share one copy through the page cache, and the chat's
+analytic context (top products, categories, brands, inventory) is answered
+with NumPy/pandas operations on the columns instead of group-bys on the row
+tables the chat writes compete with.
+
+A snapshot is a directory of one file per table plus a manifest.json
+naming the current directory; the manifest is replaced atomically, so
+readers see either the previous or the new snapshot, never a partial one.
+
+    python snapshot.py [export|status]
+"""
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from functools import cached_property
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from sqlalchemy import select
+from sqlalchemy.types import Integer, Float, DateTime
+from models import db, Order, OrderItem, Product, InventoryItem
+from metrics import Gauge, Histogram
+from config import Config
+
+SNAPSHOT_TABLES = [Order, OrderItem, Product, InventoryItem]
+MANIFEST = 'manifest.json'
+
+# Snapshot directories kept besides the current one, for readers still mapping them
+KEEP_PREVIOUS = 1
+
+# Same shapes as the rows aggregates.py returns, so formatting code serves both
+TopProduct = namedtuple('TopProduct', ['name', 'brand', 'category', 'sales_count'])
+ValueCount = namedtuple('ValueCount', ['value', 'count'])
+
+snapshot_age = Gauge(
+    'analytics_snapshot_age_seconds',
+    'Age of the analytics snapshot this process reads'
+)
+snapshot_export_seconds = Histogram(
+    'analytics_snapshot_export_seconds',
+    'Time to export the analytics snapshot',
+    buckets=(0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+)
+
+def _arrow_type(column):
+    if isinstance(column.type, Integer):
+        return pa.int64()
+    if isinstance(column.type, Float):
+        return pa.float64()
+    if isinstance(column.type, DateTime):
+        return pa.timestamp('us')
+    return pa.string()
+
+def _export_table(connection, model, path, batch_size):
+    """Stream a table into an Arrow IPC file, one record batch per batch_size rows; returns the row count"""
+    table = model.__table__
+    schema = pa.schema([pa.field(column.name, _arrow_type(column)) for column in table.columns])
+    primary_key = list(table.primary_key.columns)
+    result = connection.execution_options(stream_results=True, yield_per=batch_size).execute(
+        select(table).order_by(*primary_key)
+    )
+    rows = 0
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+        for chunk in result.partitions():
+            columns = list(zip(*chunk))
+            writer.write_batch(pa.record_batch(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema
+            ))
+            rows += len(chunk)
+    return rows
+
+def _write_manifest(directory, manifest):
+    path = os.path.join(directory, MANIFEST)
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+def read_manifest(directory=None):
+    """The current snapshot's manifest, or None if no snapshot was exported yet"""
+    try:
+        with open(os.path.join(directory or Config.ANALYTICS_SNAPSHOT_DIR, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def _remove_old_snapshots(directory, current):
+    names = sorted(name for name in os.listdir(directory)
+                   if name.startswith('snapshot-') and name != current)
+    for name in names[:max(len(names) - KEEP_PREVIOUS, 0)]:
+        # Workers still mapping these files keep them readable until they reload
+        shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+def export_snapshot(directory=None, batch_size=None):
+    """
+    Write a new snapshot of the sales tables from one consistent read and make
+    it current. Returns the manifest.
+    """
+    directory = directory or Config.ANALYTICS_SNAPSHOT_DIR
+    batch_size = batch_size or Config.ANALYTICS_SNAPSHOT_BATCH_SIZE
+    os.makedirs(directory, exist_ok=True)
+    started = time.perf_counter()
+    created_at = datetime.utcnow()
+    name = f"snapshot-{created_at:%Y%m%d%H%M%S%f}"
+    target = os.path.join(directory, name)
+    os.makedirs(target)
+
+    tables = {}
+    try:
+        with db.engine.connect() as connection:
+            if connection.dialect.name == 'postgresql':
+                # Every table from the same point in time
+                connection.exec_driver_sql('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY')
+            for model in SNAPSHOT_TABLES:
+                file_name = model.__tablename__ + '.arrow'
+                rows = _export_table(connection, model, os.path.join(target, file_name), batch_size)
+                tables[model.__tablename__] = {'file': file_name, 'rows': rows}
+    except Exception:
+        shutil.rmtree(target, ignore_errors=True)
+        raise
+
+    manifest = {'snapshot': name, 'created_at': created_at.isoformat(), 'tables': tables}
+    _write_manifest(directory, manifest)
+    _remove_old_snapshots(directory, name)
+    snapshot_export_seconds.observe(time.perf_counter() - started)
+    return manifest
+
+def export_after_load():
+    """Called by the data loaders before they invalidate the dataset caches"""
+    if not Config.ANALYTICS_SNAPSHOT:
+        return
+    try:
+        manifest = export_snapshot()
+        rows = ', '.join(f"{name} {table['rows']}" for name, table in manifest['tables'].items())
+        print(f"Analytics snapshot exported ({rows})")
+    except Exception as e:
+        # Chats fall back to the database once the previous snapshot is too old
+        print(f"Error exporting analytics snapshot: {str(e)}")
+
+class Snapshot:
+    """
+    One exported snapshot, memory-mapped. Query methods mirror the functions
+    of aggregates.py so ChatService can use either; derived arrays are
+    computed on first use and kept for the life of the snapshot.
+    """
+
+    def __init__(self, directory, manifest):
+        self.name = manifest['snapshot']
+        self.created_at = datetime.fromisoformat(manifest['created_at'])
+        self.tables = {
+            name: pa.ipc.open_file(pa.memory_map(os.path.join(directory, self.name, table['file']))).read_all()
+            for name, table in manifest['tables'].items()
+        }
+
+    def age(self):
+        return (datetime.utcnow() - self.created_at).total_seconds()
+
+    def _column(self, table, column):
+        """A column as a NumPy array; zero-copy over the mapped file for numeric columns without nulls"""
+        values = self.tables[table].column(column)
+        if values.num_chunks == 1:
+            return values.chunk(0).to_numpy(zero_copy_only=False)
+        return values.to_numpy()
+
+    @cached_property
+    def _products(self):
+        """Product attributes indexed by id, sorted for searchsorted lookups"""
+        frame = self.tables[Product.__tablename__].select(['id', 'name', 'brand', 'category']).to_pandas()
+        return frame.sort_values('id', kind='stable').reset_index(drop=True)
+
+    @cached_property
+    def _sales(self):
+        """(product ids, units sold) of known products, best selling first"""
+        product_ids = pd.Series(self._column(OrderItem.__tablename__, 'product_id')).dropna().to_numpy(np.int64)
+        ids, counts = np.unique(product_ids, return_counts=True)
+        known = np.isin(ids, self._products['id'].to_numpy())
+        ids, counts = ids[known], counts[known]
+        order = np.argsort(-counts, kind='stable')
+        return ids[order], counts[order]
+
+    @cached_property
+    def _inventory(self):
+        """(product ids, total items, available items), sorted by product id"""
+        product_ids = pd.Series(self._column(InventoryItem.__tablename__, 'product_id'))
+        available = self.tables[InventoryItem.__tablename__].column('sold_at').is_null().to_numpy(zero_copy_only=False)
+        present = product_ids.notna().to_numpy()
+        ids, inverse = np.unique(product_ids[present].to_numpy(np.int64), return_inverse=True)
+        totals = np.bincount(inverse, minlength=len(ids))
+        available_counts = np.bincount(inverse, weights=available[present], minlength=len(ids)).astype(np.int64)
+        return ids, totals, available_counts
+
+    def top_selling_products(self, limit):
+        ids, counts = self._sales
+        products = self._products
+        positions = np.searchsorted(products['id'].to_numpy(), ids[:limit])
+        rows = products.iloc[positions]
+        return [
+            TopProduct(name, brand, category, int(count))
+            for name, brand, category, count in zip(rows['name'], rows['brand'], rows['category'], counts[:limit])
+        ]
+
+    @cached_property
+    def _product_counts(self):
+        """Products per category and per brand, most common first"""
+        return {column: self._products[column].value_counts(dropna=True) for column in ('category', 'brand')}
+
+    def _value_counts(self, column, limit):
+        counts = self._product_counts[column].head(limit)
+        return [ValueCount(value, int(count)) for value, count in counts.items()]
+
+    def top_categories(self, limit):
+        return self._value_counts('category', limit)
+
+    def top_brands(self, limit):
+        return self._value_counts('brand', limit)
+
+    def product_inventory(self, product_id):
+        ids, totals, available = self._inventory
+        position = np.searchsorted(ids, product_id)
+        if position == len(ids) or ids[position] != product_id:
+            return 0, 0
+        return int(totals[position]), int(available[position])
+
+    def get_total(self, name):
+        table = self.tables.get(name)
+        return table.num_rows if table is not None else 0
+
+    def inventory_summary(self):
+        inventory = self.tables[InventoryItem.__tablename__]
+        return {
+            'products': self.tables[Product.__tablename__].num_rows,
+            'inventory_items': inventory.num_rows,
+            'available': inventory.column('sold_at').null_count
+        }
+
+class AnalyticsSnapshot:
+    """
+    The snapshot a process reads. Checks the manifest at most every
+    ANALYTICS_SNAPSHOT_CHECK_INTERVAL seconds and maps a new snapshot when
+    one was exported.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.snapshot = None
+        self.loads = 0
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return Config.ANALYTICS_SNAPSHOT
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        with self._lock:
+            if now < self._next_check:
+                return
+            try:
+                directory = self.directory or Config.ANALYTICS_SNAPSHOT_DIR
+                manifest = read_manifest(directory)
+                if manifest is None:
+                    self.snapshot = None
+                elif self.snapshot is None or self.snapshot.name != manifest['snapshot']:
+                    self.snapshot = Snapshot(directory, manifest)
+                    self.loads += 1
+            except Exception as e:
+                print(f"Error loading analytics snapshot: {str(e)}")
+            self._next_check = now + Config.ANALYTICS_SNAPSHOT_CHECK_INTERVAL
+
+    def current(self):
+        """The snapshot to answer analytic queries from, or None to use the database"""
+        if not self.enabled:
+            return None
+        self._refresh()
+        snapshot = self.snapshot
+        if snapshot is None:
+            return None
+        age = snapshot.age()
+        snapshot_age.set(age)
+        if Config.ANALYTICS_SNAPSHOT_MAX_AGE and age > Config.ANALYTICS_SNAPSHOT_MAX_AGE:
+            return None
+        return snapshot
+
+    def report(self):
+        """Where analytic context currently comes from, and how old the snapshot is"""
+        if not self.enabled:
+            return None
+        snapshot = self.current()
+        if snapshot is None:
+            return {'source': 'database', 'snapshot': self.snapshot.name if self.snapshot else None}
+        return {
+            'source': 'snapshot',
+            'snapshot': snapshot.name,
+            'as_of': snapshot.created_at.isoformat(),
+            'age_s': round(snapshot.age(), 1)
+        }
+
+analytics_snapshot = AnalyticsSnapshot()
+
+def snapshot_status():
+    """The current manifest with its age and size on disk"""
+    directory = Config.ANALYTICS_SNAPSHOT_DIR
+    manifest = read_manifest(directory)
+    if manifest is None:
+        return None
+    path = os.path.join(directory, manifest['snapshot'])
+    manifest['age_s'] = round((datetime.utcnow() - datetime.fromisoformat(manifest['created_at'])).total_seconds(), 1)
+    manifest['bytes'] = sum(os.path.getsize(os.path.join(path, table['file'])) for table in manifest['tables'].values())
+    return manifest
+
+if __name__ == "__main__":
+    from app import create_app
+    from cache import invalidate_dataset_caches
+    app = create_app(engine_options=Config.BATCH_ENGINE_OPTIONS)
+    command = sys.argv[1] if len(sys.argv) > 1 else 'export'
+
+    with app.app_context():
+        if command == 'export':
+            manifest = export_snapshot()
+            # Workers rebuild their cached chat context from the new snapshot
+            invalidate_dataset_caches()
+            print(f"Exported {manifest['snapshot']}: "
+                  + ', '.join(f"{name} {table['rows']} rows" for name, table in manifest['tables'].items()))
+        elif command == 'status':
+            print(json.dumps(snapshot_status(), indent=2))
+        else:
+            print("Usage: python snapshot.py [export|status]")
+            sys.exit(2)
@@ -0,0 +1,159 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import select, func, text
+from models import (db, User, Conversation, Message, Product, Order, OrderItem, InventoryItem,
+                    UserData, DistributionCenter, AggregateTotal)
+from db_utils import upsert_statement
+from aggregates import COUNTED_TABLES
+from config import Config
+
+# Tables reported by GET /api/stats, in response order
+STATS_TABLES = [User, Conversation, Message, Product, Order, OrderItem, InventoryItem, UserData, DistributionCenter]
+
+# aggregate_totals rows holding the last exact count of each table
+EXACT_PREFIX = 'exact:'
+
+# Where a number came from; a pending table has no number until its first exact count
+COUNTER, ESTIMATE, EXACT, PENDING = 'counter', 'estimate', 'exact', 'pending'
+
+def _estimates(names):
+    """
+    Planner row estimates per table: pg_class.reltuples on PostgreSQL (summed
+    over the partitions of a partitioned table such as messages), the
+    highest rowid on SQLite (exact until rows are deleted). Tables without a
+    usable estimate (never analyzed) are left out.
+    """
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        rows = db.session.execute(text(
+            "SELECT c.relname, (CASE WHEN c.relkind = 'p' THEN COALESCE(("
+            "  SELECT CASE WHEN MAX(p.reltuples) < 0 THEN -1 ELSE SUM(GREATEST(p.reltuples, 0)) END"
+            "  FROM pg_inherits i JOIN pg_class p ON p.oid = i.inhrelid WHERE i.inhparent = c.oid"
+            "), 0) ELSE c.reltuples END)::bigint "
+            "FROM pg_class c "
+            "WHERE c.relkind IN ('r', 'p') AND c.relname = ANY(:names) AND c.relnamespace = 'public'::regnamespace"
+        ), {'names': list(names)}).all()
+        return {name: int(value) for name, value in rows if value >= 0}
+    if dialect == 'sqlite':
+        return {name: db.session.execute(text(f"SELECT COALESCE(MAX(rowid), 0) FROM {name}")).scalar() for name in names}
+    return {}
+
+def _exact_rows():
+    rows = db.session.execute(
+        select(AggregateTotal.name, AggregateTotal.value, AggregateTotal.updated_at)
+        .where(AggregateTotal.name.like(EXACT_PREFIX + '%'))
+    ).all()
+    return {name[len(EXACT_PREFIX):]: (value, updated_at) for name, value, updated_at in rows}
+
+def _entry(value, source, as_of):
+    return {'value': int(value) if value is not None else None, 'source': source, 'as_of': as_of.isoformat() if as_of else None}
+
+def fast_stats():
+    """
+    Every table count without scanning a table: counters maintained by the
+    loaders where they exist, planner estimates for the rest, and the last
+    exact count for tables that have neither. Tables never counted are
+    reported as pending (no value) and start a background count.
+    """
+    names = [model.__tablename__ for model in STATS_TABLES]
+    counted = {model.__tablename__ for model in COUNTED_TABLES}
+    counters = {
+        name: (value, updated_at) for name, value, updated_at in db.session.execute(
+            select(AggregateTotal.name, AggregateTotal.value, AggregateTotal.updated_at)
+            .where(AggregateTotal.name.in_(counted))
+        ).all()
+    }
+    estimates = _estimates([name for name in names if name not in counters])
+    exact = None
+    now = datetime.utcnow()
+
+    stats = {}
+    for name in names:
+        if name in counters:
+            stats[name] = _entry(counters[name][0], COUNTER, counters[name][1])
+        elif name in estimates:
+            stats[name] = _entry(estimates[name], ESTIMATE, now)
+        else:
+            exact = _exact_rows() if exact is None else exact
+            if name in exact:
+                stats[name] = _entry(exact[name][0], EXACT, exact[name][1])
+            else:
+                stats[name] = _entry(None, PENDING, None)
+    if any(entry['source'] == PENDING for entry in stats.values()):
+        exact_refresher.refresh_if_stale(True)
+    return stats
+
+def exact_stats():
+    """
+    Last background COUNT(*) of every table with its freshness. Starts a
+    refresh when the counts are older than STATS_EXACT_MAX_AGE; tables never
+    counted yet fall back to their fast value until it finishes.
+    """
+    exact = _exact_rows()
+    max_age = timedelta(seconds=Config.STATS_EXACT_MAX_AGE)
+    oldest = min((as_of for _, as_of in exact.values() if as_of), default=None)
+    refreshing = exact_refresher.refresh_if_stale(
+        len(exact) < len(STATS_TABLES) or oldest is None or datetime.utcnow() - oldest > max_age
+    )
+
+    stats = {}
+    fast = None
+    for model in STATS_TABLES:
+        name = model.__tablename__
+        if name in exact:
+            stats[name] = _entry(exact[name][0], EXACT, exact[name][1])
+        else:
+            fast = fast_stats() if fast is None else fast
+            stats[name] = fast[name]
+    return stats, refreshing
+
+def count_tables():
+    """COUNT(*) every table and store the results with their time of measurement"""
+    table = AggregateTotal.__table__
+    postgres = db.engine.dialect.name == 'postgresql'
+    for model in STATS_TABLES:
+        if postgres:
+            # Full counts of large tables may run past DB_STATEMENT_TIMEOUT_MS, which is meant for requests
+            db.session.execute(text('SET LOCAL statement_timeout = 0'))
+        value = db.session.execute(select(func.count()).select_from(model)).scalar()
+        db.session.execute(
+            upsert_statement(table, ['name']),
+            {'name': EXACT_PREFIX + model.__tablename__, 'value': value, 'updated_at': datetime.utcnow()}
+        )
+        # One table per transaction, so dashboard reads never wait on the whole pass
+        db.session.commit()
+
+class ExactStatsRefresher:
+    """Runs count_tables on a background thread, at most one pass per process at a time"""
+
+    def __init__(self):
+        self.app = None
+        self.running = False
+        self.last_duration = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+
+    def refresh_if_stale(self, stale):
+        """Start a refresh if stale and none is running; returns whether one is running"""
+        with self._lock:
+            if stale and not self.running and self.app is not None:
+                self.running = True
+                threading.Thread(target=self._run, name='exact-stats', daemon=True).start()
+            return self.running
+
+    def _run(self):
+        started = time.perf_counter()
+        try:
+            with self.app.app_context():
+                count_tables()
+        except Exception as e:
+            print(f"Error refreshing exact stats: {str(e)}")
+        finally:
+            with self._lock:
+                self.running = False
+                self.last_duration = time.perf_counter() - started
+
+exact_refresher = ExactStatsRefresher()
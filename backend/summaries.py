@@ -0,0 +1,155 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from sqlalchemy import select, update
+from models import db, Conversation, Message
+from config import Config
+from history import message_page_statement
+from metrics import Counter
+from prompt_packer import message_tokens
+
+conversation_summaries = Counter(
+    'conversation_summaries_total',
+    'Rolling conversation summary updates by outcome',
+    labelnames=('outcome',)
+)
+
+def covered_by_summary(history, message_count, summary_message_count):
+    """
+    How many of the oldest messages of a history window are already folded
+    into the summary, given the conversation's message counters.
+    """
+    unsummarized = max(message_count - summary_message_count, 0)
+    return max(len(history) - unsummarized, 0)
+
+def needs_summary(message_count, summary_message_count, dropped_messages=0):
+    """Whether messages are about to fall out of the history window (or the budget) unsummarized"""
+    if not Config.SUMMARY_ENABLED:
+        return False
+    pending = message_count - summary_message_count
+    return pending > Config.SUMMARY_TRIGGER_MESSAGES or (dropped_messages > 0 and pending > Config.SUMMARY_KEEP_MESSAGES)
+
+def summary_state_statement(conversation_id):
+    """Counters and summary of a conversation, read as a plain row"""
+    return select(
+        Conversation.id,
+        Conversation.message_count,
+        Conversation.summary,
+        Conversation.summary_message_count,
+        Conversation.summary_last_message_id
+    ).where(Conversation.id == conversation_id)
+
+def summary_position_statement(message_id):
+    """Keyset position of the last summarized message"""
+    return select(Message.created_at, Message.id).where(Message.id == message_id)
+
+def pending_messages_statement(conversation, position):
+    """
+    The oldest unsummarized messages of a conversation that can be folded,
+    keeping its latest SUMMARY_KEEP_MESSAGES raw; at most SUMMARY_MAX_BATCH.
+    """
+    fold = conversation.message_count - conversation.summary_message_count - Config.SUMMARY_KEEP_MESSAGES
+    if fold <= 0:
+        return None
+    return message_page_statement(
+        conversation.id,
+        min(fold, Config.SUMMARY_MAX_BATCH),
+        after_position=position or (datetime.min, None)
+    )
+
+def store_summary_statement(conversation, summary, rows):
+    """
+    Save a summary extended with rows. Only applies if no other worker
+    stored one for the same messages first.
+    """
+    return (
+        update(Conversation)
+        .where(
+            Conversation.id == conversation.id,
+            Conversation.summary_message_count == conversation.summary_message_count
+        )
+        .values(
+            summary=summary,
+            summary_message_count=conversation.summary_message_count + len(rows),
+            summary_last_message_id=rows[-1].id,
+            summary_source_tokens=Conversation.summary_source_tokens + sum(message_tokens(m) for m in as_messages(rows))
+        )
+    )
+
+def as_messages(rows):
+    return [{'role': row.role, 'content': row.content} for row in rows]
+
+class ConversationSummarizer:
+    """
+    Folds the oldest unsummarized messages of a conversation into its rolling
+    summary on a background thread pool, so chat requests never wait for it.
+    At most one update per conversation is queued or running at a time.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.app = None
+        self.llm_service = None
+        self._executor = None
+        self._pending = set()
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def init_app(self, app, llm_service):
+        self.app = app
+        self.llm_service = llm_service
+
+    def request(self, conversation_id):
+        """Queue a summary update; returns False if one is already queued"""
+        with self._lock:
+            if self.app is None or self._closed or conversation_id in self._pending:
+                return False
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='summarizer')
+            self._pending.add(conversation_id)
+        self._executor.submit(self._run, conversation_id)
+        return True
+
+    def shutdown(self, wait=True):
+        """Stop accepting updates and, with wait, finish the queued ones"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self._closed = True
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def _run(self, conversation_id):
+        try:
+            with self.app.app_context():
+                # Catch up in batches until only the kept tail is left
+                while self.summarize(conversation_id):
+                    pass
+        except Exception as e:
+            conversation_summaries.inc(outcome='error')
+            print(f"Error summarizing conversation {conversation_id}: {str(e)}")
+        finally:
+            with self._lock:
+                self._pending.discard(conversation_id)
+
+    def summarize(self, conversation_id):
+        """Fold one batch of messages into the summary; returns whether one was stored"""
+        conversation = db.session.execute(summary_state_statement(conversation_id)).first()
+        if conversation is None:
+            return False
+        position = None
+        if conversation.summary_last_message_id:
+            position = db.session.execute(summary_position_statement(conversation.summary_last_message_id)).first()
+        statement = pending_messages_statement(conversation, position)
+        rows = db.session.execute(statement).all() if statement is not None else []
+        # Release the connection while the LLM works
+        db.session.rollback()
+        if not rows:
+            return False
+
+        summary = self.llm_service.summarize(conversation.summary, as_messages(rows))
+        stored = db.session.execute(store_summary_statement(conversation, summary, rows)).rowcount
+        db.session.commit()
+        conversation_summaries.inc(outcome='stored' if stored else 'conflict')
+        return bool(stored)
+
+summarizer = ConversationSummarizer(Config.SUMMARY_WORKERS)
@@ -0,0 +1,202 @@
+import hashlib
+import os
+import time
+import uuid
+import pandas as pd
+from sqlalchemy import select, update, delete, and_
+from models import db, Product, Order, OrderItem, InventoryItem, SyncCheckpoint, SyncRowHash
+from load_data import clean_frame
+from db_utils import upsert_statement
+from config import Config
+import aggregates
+from cache import invalidate_dataset_caches
+from snapshot import export_after_load
+
+# Tables that support incremental sync, keyed by their CSV file name
+SYNC_TABLES = [
+    ('products.csv', Product),
+    ('orders.csv', Order),
+    ('order_items.csv', OrderItem),
+    ('inventory_items.csv', InventoryItem),
+]
+
+# Ids bound per IN (...) lookup; SYNC_CHUNK_SIZE may exceed SQLite's limit on bound parameters
+LOOKUP_BATCH_SIZE = 500
+
+def id_batches(ids):
+    for start in range(0, len(ids), LOOKUP_BATCH_SIZE):
+        yield ids[start:start + LOOKUP_BATCH_SIZE]
+
+def file_fingerprint(csv_path, block_size=1024 * 1024):
+    """SHA-256 of the file contents, read in fixed-size blocks"""
+    digest = hashlib.sha256()
+    with open(csv_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def row_fingerprints(df):
+    """Vectorized 64-bit hash of every cleaned row, as signed integers for storage"""
+    return pd.util.hash_pandas_object(df, index=False).values.view('int64')
+
+class TableSync:
+    """Applies the delta between one CSV file and its table"""
+
+    def __init__(self, csv_path, model, chunk_size=None):
+        self.csv_path = csv_path
+        self.model = model
+        self.table = model.__table__
+        self.pk = list(self.table.primary_key.columns)[0]
+        self.chunk_size = chunk_size or Config.SYNC_CHUNK_SIZE
+        self.stats = {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+        # Per-product aggregates depend on these tables' product_id column
+        self.tracks_products = model in (OrderItem, InventoryItem)
+
+    def run(self):
+        """Sync the table, resuming an interrupted run for the same file if there is one"""
+        started = time.perf_counter()
+        file_hash = file_fingerprint(self.csv_path)
+        checkpoint = db.session.get(SyncCheckpoint, self.table.name)
+
+        if checkpoint and checkpoint.file_hash == file_hash and checkpoint.status == 'complete':
+            print(f"{self.table.name}: unchanged since last sync, skipping")
+            return self.stats
+
+        if checkpoint and checkpoint.file_hash == file_hash and checkpoint.status == 'running':
+            print(f"{self.table.name}: resuming sync after chunk {checkpoint.chunks_done}")
+        else:
+            if not checkpoint:
+                checkpoint = SyncCheckpoint(table_name=self.table.name)
+                db.session.add(checkpoint)
+            checkpoint.run_id = str(uuid.uuid4())
+            checkpoint.file_hash = file_hash
+            checkpoint.chunks_done = 0
+            checkpoint.status = 'running'
+            db.session.commit()
+
+        for index, chunk in enumerate(pd.read_csv(self.csv_path, chunksize=self.chunk_size)):
+            if index < checkpoint.chunks_done:
+                continue
+            self._sync_chunk(clean_frame(chunk, self.model), checkpoint.run_id)
+            checkpoint.chunks_done = index + 1
+            db.session.commit()
+
+        self._delete_missing(checkpoint.run_id)
+        aggregates.refresh_totals()
+        checkpoint.status = 'complete'
+        db.session.commit()
+
+        elapsed = time.perf_counter() - started
+        print(f"{self.table.name}: {self.stats['inserted']} inserted, {self.stats['updated']} updated, "
+              f"{self.stats['deleted']} deleted, {self.stats['unchanged']} unchanged in {elapsed:.2f}s")
+        return self.stats
+
+    def _sync_chunk(self, df, run_id):
+        """Upsert the new and changed rows of one chunk and mark every row as seen"""
+        df = df.drop_duplicates(subset=[self.pk.name], keep='last')
+        df = df[df[self.pk.name].notna()]
+        hashes = row_fingerprints(df)
+        ids = [int(i) for i in df[self.pk.name]]
+
+        stored = {}
+        for batch in id_batches(ids):
+            stored.update(db.session.execute(
+                select(SyncRowHash.row_id, SyncRowHash.row_hash).where(and_(
+                    SyncRowHash.table_name == self.table.name,
+                    SyncRowHash.row_id.in_(batch)
+                ))
+            ).all())
+
+        changed = [stored.get(row_id) != row_hash for row_id, row_hash in zip(ids, hashes)]
+        delta = df[changed]
+        unchanged_ids = [row_id for row_id, is_changed in zip(ids, changed) if not is_changed]
+
+        if len(delta):
+            changed_ids = [int(i) for i in delta[self.pk.name]]
+            touched_products = set()
+            if self.tracks_products:
+                for batch in id_batches(changed_ids):
+                    touched_products.update(self._product_ids(self.pk.in_(batch)))
+
+            records = delta.astype(object).where(delta.notna(), None).to_dict('records')
+            db.session.execute(upsert_statement(self.table, [self.pk.name]), records)
+
+            if self.tracks_products:
+                touched_products.update(delta['product_id'].dropna())
+                aggregates.refresh_products(touched_products)
+
+            hash_records = [
+                {'table_name': self.table.name, 'row_id': row_id, 'row_hash': int(row_hash), 'last_seen_run': run_id}
+                for row_id, row_hash, is_changed in zip(ids, hashes, changed) if is_changed
+            ]
+            db.session.execute(upsert_statement(SyncRowHash.__table__, ['table_name', 'row_id']), hash_records)
+
+        for batch in id_batches(unchanged_ids):
+            db.session.execute(
+                update(SyncRowHash)
+                .where(and_(SyncRowHash.table_name == self.table.name, SyncRowHash.row_id.in_(batch)))
+                .values(last_seen_run=run_id)
+            )
+
+        inserted = sum(1 for row_id, is_changed in zip(ids, changed) if is_changed and row_id not in stored)
+        self.stats['inserted'] += inserted
+        self.stats['updated'] += len(delta) - inserted
+        self.stats['unchanged'] += len(unchanged_ids)
+
+    def _delete_missing(self, run_id):
+        """Delete rows that were not present in this run's CSV"""
+        seen = select(SyncRowHash.row_id).where(and_(
+            SyncRowHash.table_name == self.table.name,
+            SyncRowHash.last_seen_run == run_id
+        ))
+        missing = self.pk.not_in(seen)
+        touched_products = self._product_ids(missing) if self.tracks_products else set()
+        result = db.session.execute(delete(self.table).where(missing))
+        if touched_products:
+            aggregates.refresh_products(touched_products)
+        db.session.execute(
+            delete(SyncRowHash).where(and_(
+                SyncRowHash.table_name == self.table.name,
+                SyncRowHash.last_seen_run != run_id
+            ))
+        )
+        self.stats['deleted'] = result.rowcount or 0
+
+    def _product_ids(self, condition):
+        """Distinct product ids currently stored for the rows matching a condition"""
+        return set(db.session.execute(
+            select(self.table.c.product_id).where(condition).distinct()
+        ).scalars())
+
+def sync_all_data():
+    """Apply the delta between the dataset CSVs and the existing tables"""
+    dataset_path = Config.DATASET_PATH
+
+    # Check if dataset path exists
+    if not os.path.exists(dataset_path):
+        print(f"Dataset path not found: {dataset_path}")
+        return
+
+    try:
+        for file_name, model in SYNC_TABLES:
+            TableSync(os.path.join(dataset_path, file_name), model).run()
+        export_after_load()
+
+        print("✅ Sync completed successfully!")
+
+    except Exception as e:
+        # Committed chunks are kept; the next run resumes from the checkpoint
+        print(f"❌ Error syncing data: {e}")
+        db.session.rollback()
+
+    finally:
+        # Even a failed sync may have committed chunks that cached context no longer reflects
+        invalidate_dataset_caches()
+
+if __name__ == "__main__":
+    from app import create_app
+    app = create_app(engine_options=Config.BATCH_ENGINE_OPTIONS)
+
+    with app.app_context():
+        db.create_all()
+        sync_all_data()
@@ -0,0 +1,54 @@
+"""
+Test settings. The backend modules are imported flat (as gunicorn and the
+scripts do), and Config is read at import time, so the environment is set
+here before any test module imports them: a throwaway SQLite database and
+write-behind directory, and no LLM provider.
+"""
+import os
+import sys
+import tempfile
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+_tmp = tempfile.mkdtemp(prefix='backend-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_tmp, 'test.db')
+os.environ['WRITE_BEHIND_DIR'] = os.path.join(_tmp, 'write_behind')
+os.environ['MESSAGE_WRITE_BEHIND'] = 'False'
+os.environ['GROQ_API_KEY'] = ''
+
+@pytest.fixture(scope='session')
+def app():
+    """The Flask app on the test database, schema migrated once per run"""
+    from app import app
+    from models import db
+    from migrations import run_migrations
+    app.testing = True
+    with app.app_context():
+        db.create_all()
+        run_migrations()
+    return app
+
+@pytest.fixture
+def db_session(app):
+    """An app context whose chat tables are emptied after the test"""
+    from models import db, User, Conversation, Message
+    with app.app_context():
+        yield db.session
+        db.session.rollback()
+        for model in (Message, Conversation, User):
+            db.session.query(model).delete()
+        db.session.commit()
+
+@pytest.fixture
+def client(app, db_session):
+    return app.test_client()
+
+@pytest.fixture
+def user_id(db_session):
+    from models import User
+    user = User(email='tester@example.com', first_name='Test', last_name='User')
+    db_session.add(user)
+    db_session.commit()
+    return user.id
@@ -0,0 +1,48 @@
+import pytest
+from chat_batch import parse_batch
+from config import Config
+
+@pytest.mark.parametrize('body', [None, [], {}, {'items': []}, {'items': 'hello'}, {'items': {'message': 'hi'}}])
+def test_unusable_body_is_rejected(body):
+    with pytest.raises(ValueError):
+        parse_batch(body)
+
+def test_too_many_items_are_rejected():
+    items = [{'message': 'hi', 'user_id': 'u'}] * (Config.CHAT_BATCH_MAX_ITEMS + 1)
+    with pytest.raises(ValueError):
+        parse_batch({'items': items})
+
+def test_at_most_the_limit_is_accepted():
+    items = [{'message': 'hi', 'user_id': 'u'}] * Config.CHAT_BATCH_MAX_ITEMS
+    assert len(parse_batch({'items': items})) == Config.CHAT_BATCH_MAX_ITEMS
+
+@pytest.mark.parametrize('raw, error', [
+    ('hello', 'message is required and must be a string'),
+    ({}, 'message is required and must be a string'),
+    ({'message': '', 'user_id': 'u'}, 'message is required and must be a string'),
+    ({'message': 42, 'user_id': 'u'}, 'message is required and must be a string'),
+    ({'message': ['hi'], 'user_id': 'u'}, 'message is required and must be a string'),
+    ({'message': 'hi', 'user_id': 7}, 'conversation_id and user_id must be strings'),
+    ({'message': 'hi', 'conversation_id': ['a', 'b']}, 'conversation_id and user_id must be strings'),
+    ({'message': 'hi', 'conversation_id': {'id': 'a'}, 'user_id': 'u'}, 'conversation_id and user_id must be strings'),
+    ({'message': 'hi'}, 'Either conversation_id or user_id is required'),
+    ({'message': 'hi', 'conversation_id': '', 'user_id': None}, 'Either conversation_id or user_id is required'),
+])
+def test_invalid_item_fails_alone_with_400(raw, error):
+    valid = {'message': 'hello', 'user_id': 'u'}
+    items = parse_batch({'items': [valid, raw, valid]})
+
+    assert [item.error for item in items] == [None, (error, 400), None]
+    assert items[1].result() == {'index': 1, 'status': 400, 'error': error}
+
+def test_valid_items_keep_their_fields_and_order():
+    items = parse_batch({'items': [
+        {'message': 'first', 'user_id': 'u1'},
+        {'message': 'second', 'conversation_id': 'c1', 'user_id': None},
+    ]})
+
+    assert [(item.index, item.message, item.conversation_id, item.user_id) for item in items] == [
+        (0, 'first', None, 'u1'),
+        (1, 'second', 'c1', None),
+    ]
+    assert not any(item.error for item in items)
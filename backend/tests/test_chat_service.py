@@ -0,0 +1,30 @@
+import pytest
+from models import new_id
+
+@pytest.fixture
+def llm_calls(app, monkeypatch):
+    """Replies of a fake LLM; records the messages it was asked about"""
+    from app import chat_service
+    calls = []
+
+    def generate_response(user_message, **kwargs):
+        calls.append(user_message)
+        return 'a reply'
+    monkeypatch.setattr(chat_service.llm_service, 'generate_response', generate_response)
+    return calls
+
+@pytest.mark.parametrize('unknown', [new_id(), 'not-a-uuid'])
+def test_unknown_user_is_rejected_before_the_llm(client, llm_calls, unknown):
+    response = client.post('/api/chat', json={'message': 'hello there', 'user_id': unknown})
+
+    assert response.status_code == 404
+    assert response.get_json() == {'error': 'User not found'}
+    assert llm_calls == []
+
+def test_first_message_starts_a_conversation(client, llm_calls, user_id):
+    response = client.post('/api/chat', json={'message': 'hello there', 'user_id': user_id})
+
+    assert response.status_code == 200
+    assert llm_calls == ['hello there']
+    conversation = client.get(f"/api/conversations/{response.get_json()['conversation_id']}").get_json()
+    assert [message['content'] for message in conversation['messages']] == ['hello there', 'a reply']
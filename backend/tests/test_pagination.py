@@ -0,0 +1,126 @@
+import base64
+from datetime import datetime, timedelta
+import pytest
+from models import Conversation, Message, new_id
+from pagination import InvalidCursor, encode_cursor, decode_cursor, page_size
+
+START = datetime(2024, 1, 1, 12, 0, 0)
+
+def test_cursor_round_trip():
+    timestamp = datetime(2024, 5, 6, 7, 8, 9, 123456)
+    row_id = new_id()
+    cursor = encode_cursor(timestamp, row_id)
+
+    assert '=' not in cursor
+    assert decode_cursor(cursor) == (timestamp, row_id)
+
+@pytest.mark.parametrize('cursor', [
+    'not a cursor!',
+    base64.urlsafe_b64encode(b'not json').decode(),
+    base64.urlsafe_b64encode(b'["2024-01-01T00:00:00"]').decode(),
+    base64.urlsafe_b64encode(b'{"at": 1}').decode(),
+    base64.urlsafe_b64encode(b'["yesterday", "abc"]').decode(),
+    base64.urlsafe_b64encode(b'[null, "abc"]').decode(),
+])
+def test_invalid_cursor(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor)
+
+@pytest.mark.parametrize('value, expected', [
+    (None, 20), ('', 20), ('5', 5), ('1', 1), ('0', 1), ('-3', 1), ('100', 100), ('101', 100), ('100000', 100),
+])
+def test_page_size_is_clamped(value, expected):
+    assert page_size(value, 20, 100) == expected
+
+def test_page_size_must_be_a_number():
+    with pytest.raises(ValueError):
+        page_size('ten', 20, 100)
+
+def add_conversation(session, user_id, updated_at, messages=0, same_time=False):
+    conversation = Conversation(id=new_id(), user_id=user_id, title='New Chat', created_at=START,
+                                updated_at=updated_at, message_count=messages)
+    session.add(conversation)
+    for index in range(messages):
+        created_at = START if same_time else START + timedelta(seconds=index)
+        session.add(Message(id=new_id(), conversation_id=conversation.id, role='user',
+                            content=f'message {index}', created_at=created_at))
+    session.commit()
+    return conversation.id
+
+def message_contents(page):
+    return [message['content'] for message in page['messages']]
+
+def test_latest_page_and_has_more(client, db_session, user_id):
+    conversation_id = add_conversation(db_session, user_id, START, messages=5)
+
+    exact = client.get(f'/api/conversations/{conversation_id}?limit=5').get_json()
+    assert message_contents(exact) == [f'message {i}' for i in range(5)]
+    assert exact['page']['has_more'] is False
+
+    short = client.get(f'/api/conversations/{conversation_id}?limit=4').get_json()
+    assert message_contents(short) == [f'message {i}' for i in range(1, 5)]
+    assert short['page']['has_more'] is True
+
+@pytest.mark.parametrize('same_time', [False, True])
+def test_pages_cover_every_message_once(client, db_session, user_id, same_time):
+    # With equal timestamps the message id alone orders the keyset
+    conversation_id = add_conversation(db_session, user_id, START, messages=7, same_time=same_time)
+
+    page = client.get(f'/api/conversations/{conversation_id}?limit=3').get_json()
+    backwards = message_contents(page)
+    while page['page']['has_more']:
+        page = client.get(f"/api/conversations/{conversation_id}?limit=3&before={page['page']['before']}").get_json()
+        backwards = message_contents(page) + backwards
+    assert len(backwards) == 7 and len(set(backwards)) == 7
+
+    page = client.get(f"/api/conversations/{conversation_id}?limit=3&after={START - timedelta(days=1)}").get_json()
+    forwards = message_contents(page)
+    while page['page']['has_more']:
+        page = client.get(f"/api/conversations/{conversation_id}?limit=3&after={page['page']['after']}").get_json()
+        forwards += message_contents(page)
+    assert forwards == backwards
+
+def test_page_past_the_end_is_empty(client, db_session, user_id):
+    conversation_id = add_conversation(db_session, user_id, START, messages=2)
+    last = client.get(f'/api/conversations/{conversation_id}').get_json()['page']['after']
+
+    page = client.get(f'/api/conversations/{conversation_id}?after={last}').get_json()
+    assert page['messages'] == []
+    assert page['page'] == {'limit': page['page']['limit'], 'has_more': False, 'before': None, 'after': None}
+
+def test_invalid_message_position_and_limit(client, db_session, user_id):
+    conversation_id = add_conversation(db_session, user_id, START, messages=1)
+
+    assert client.get(f'/api/conversations/{conversation_id}?before=nonsense').status_code == 400
+    assert client.get(f'/api/conversations/{conversation_id}?limit=many').status_code == 400
+
+def test_conversation_listing_walks_every_page(client, db_session, user_id):
+    # Two pairs share an updated_at, so a page boundary falls between equal timestamps
+    times = [START, START, START + timedelta(minutes=1), START + timedelta(minutes=1), START + timedelta(minutes=2)]
+    created = {add_conversation(db_session, user_id, updated_at) for updated_at in times}
+
+    seen = []
+    cursor = None
+    while True:
+        url = f'/api/users/{user_id}/conversations?limit=2' + (f'&cursor={cursor}' if cursor else '')
+        page = client.get(url).get_json()
+        seen += [conversation['id'] for conversation in page['conversations']]
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+
+    assert len(seen) == len(created) and set(seen) == created
+    everything = client.get(f'/api/users/{user_id}/conversations?limit=10').get_json()['conversations']
+    assert [conversation['id'] for conversation in everything] == seen
+
+def test_last_full_page_has_no_cursor(client, db_session, user_id):
+    for minute in range(2):
+        add_conversation(db_session, user_id, START + timedelta(minutes=minute))
+
+    page = client.get(f'/api/users/{user_id}/conversations?limit=2').get_json()
+    assert len(page['conversations']) == 2
+    assert page['next_cursor'] is None
+
+def test_invalid_listing_cursor(client, db_session, user_id):
+    response = client.get(f'/api/users/{user_id}/conversations?cursor=garbage')
+    assert response.status_code == 400
@@ -0,0 +1,87 @@
+"""
+The exchange writes of persistence.py: several statements on SQLite, a
+single statement on PostgreSQL. The PostgreSQL cases need a server; set
+TEST_POSTGRES_URL to an empty, disposable database to run them. The tables
+are created and dropped around each test.
+"""
+import os
+from datetime import datetime
+import pytest
+from sqlalchemy import create_engine, insert, select
+from models import db, User, Conversation, Message, new_id
+from persistence import Exchange, execute_exchanges
+
+POSTGRES_URL = os.getenv('TEST_POSTGRES_URL')
+
+TABLES = [User.__table__, Conversation.__table__, Message.__table__]
+
+@pytest.fixture(params=['sqlite', 'postgresql'])
+def engine(request, tmp_path):
+    if request.param == 'postgresql':
+        if not POSTGRES_URL:
+            pytest.skip('TEST_POSTGRES_URL is not set')
+        engine = create_engine(POSTGRES_URL)
+    else:
+        engine = create_engine('sqlite:///' + str(tmp_path / 'exchanges.db'))
+    db.metadata.create_all(engine, tables=TABLES)
+    try:
+        yield engine
+    finally:
+        db.metadata.drop_all(engine, tables=TABLES)
+        engine.dispose()
+
+@pytest.fixture
+def user_id(engine):
+    user_id = new_id()
+    with engine.begin() as connection:
+        connection.execute(insert(User.__table__).values(id=user_id, email=f'{user_id}@example.com'))
+    return user_id
+
+def write(engine, exchanges):
+    with engine.begin() as connection:
+        execute_exchanges(connection, exchanges)
+
+def test_first_exchange_creates_the_conversation(engine, user_id):
+    conversation_id = new_id()
+    write(engine, [Exchange.build(conversation_id, 'hello', 'hi', conversation={
+        'user_id': user_id, 'title': 'New Chat', 'created_at': datetime.utcnow()
+    })])
+
+    with engine.connect() as connection:
+        count = connection.execute(select(Conversation.message_count).where(Conversation.id == conversation_id)).scalar()
+    assert count == 2
+
+def test_exchange_of_an_existing_conversation_updates_its_activity(engine, user_id):
+    conversation_id = new_id()
+    write(engine, [Exchange.build(conversation_id, 'hello', 'hi', conversation={
+        'user_id': user_id, 'title': 'New Chat', 'created_at': datetime.utcnow()
+    })])
+    # Joins conversations.id (uuid) with the ids of a VALUES list
+    write(engine, [Exchange.build(conversation_id, 'and then?', 'that is all')])
+
+    with engine.connect() as connection:
+        count, preview = connection.execute(
+            select(Conversation.message_count, Conversation.last_message_preview).where(Conversation.id == conversation_id)
+        ).one()
+        messages = connection.execute(select(Message.id).where(Message.conversation_id == conversation_id)).all()
+    assert count == 4
+    assert preview == 'that is all'
+    assert len(messages) == 4
+
+def test_exchanges_of_several_conversations_in_one_statement(engine, user_id):
+    first, second = new_id(), new_id()
+    write(engine, [Exchange.build(first, 'one', 'reply', conversation={
+        'user_id': user_id, 'title': 'New Chat', 'created_at': datetime.utcnow()
+    })])
+    write(engine, [
+        Exchange.build(first, 'two', 'reply'),
+        Exchange.build(second, 'new', 'reply', conversation={
+            'user_id': user_id, 'title': 'New Chat', 'created_at': datetime.utcnow()
+        }),
+    ])
+
+    with engine.connect() as connection:
+        counts = dict(connection.execute(
+            select(Conversation.id, Conversation.message_count).where(Conversation.id.in_([first, second]))
+        ).all())
+    assert counts == {first: 4, second: 2}
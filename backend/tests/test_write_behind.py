@@ -0,0 +1,127 @@
+import fcntl
+import json
+import os
+import time
+from datetime import datetime
+import pytest
+import persistence
+from models import Conversation, Message, new_id
+from persistence import Exchange, WriteBehindLog, execute_exchanges, read_log
+
+def first_exchange(user_id, message='hello'):
+    return Exchange.build(new_id(), message, 'hi', conversation={
+        'user_id': user_id, 'title': 'New Chat', 'created_at': datetime.utcnow()
+    })
+
+def write_log(path, exchanges, checkpoint=None, torn=False):
+    """A log as a crashed process leaves it: exchanges numbered from 1, then a checkpoint"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for seq, exchange in enumerate(exchanges, start=1):
+            exchange.seq = seq
+            f.write(json.dumps(exchange.to_record()) + '\n')
+        if checkpoint is not None:
+            f.write(json.dumps({'checkpoint': checkpoint}) + '\n')
+        if torn:
+            f.write('{"seq": 99, "conversation_id"')
+
+def stored_messages(session, conversation_id):
+    return session.query(Message).filter(Message.conversation_id == conversation_id).count()
+
+@pytest.fixture
+def log(app, tmp_path):
+    log = WriteBehindLog(True, str(tmp_path), flush_interval=0.01, batch_size=100, fsync=False, barrier_timeout=5)
+    log.init_app(app)
+    yield log
+    log.close(timeout=10)
+
+def test_read_log_skips_checkpointed_exchanges_and_a_torn_line(tmp_path, user_id):
+    first = first_exchange(user_id)
+    rest = [Exchange.build(first.conversation_id, f'message {i}', 'reply') for i in range(2)]
+    path = str(tmp_path / 'old.wal')
+    write_log(path, [first] + rest, checkpoint=1, torn=True)
+
+    replay = read_log(path)
+    assert [exchange.seq for exchange in replay] == [2, 3]
+    assert [exchange.messages[0]['content'] for exchange in replay] == ['message 0', 'message 1']
+    assert all(isinstance(message['created_at'], datetime) for exchange in replay for message in exchange.messages)
+
+def test_recover_replays_only_what_did_not_reach_the_database(app, db_session, log, tmp_path, user_id):
+    checkpointed = first_exchange(user_id)
+    conversation_id = checkpointed.conversation_id
+    committed = Exchange.build(conversation_id, 'committed before the crash', 'reply')
+    lost = Exchange.build(conversation_id, 'lost in the crash', 'reply')
+    execute_exchanges(db_session, [checkpointed, committed])
+    db_session.commit()
+    path = str(tmp_path / '12345-dead.wal')
+    write_log(path, [checkpointed, committed, lost], checkpoint=1)
+
+    assert log.recover(app) == 1
+
+    db_session.expire_all()
+    assert stored_messages(db_session, conversation_id) == 6
+    assert db_session.get(Conversation, conversation_id).message_count == 6
+    assert not os.path.exists(path)
+    assert not os.path.exists(path + '.rejected')  # committed exchanges are skipped, not retried
+
+def test_recover_leaves_the_log_of_a_live_process(app, db_session, log, tmp_path, user_id):
+    exchange = first_exchange(user_id)
+    path = str(tmp_path / '12345-alive.wal')
+    write_log(path, [exchange])
+    fd = os.open(path, os.O_WRONLY)
+    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    try:
+        assert log.recover(app) == 0
+    finally:
+        os.close(fd)
+
+    assert os.path.exists(path)
+    assert stored_messages(db_session, exchange.conversation_id) == 0
+
+def test_barrier_returns_once_the_conversation_is_written(db_session, log, user_id):
+    log.flush_interval = 5  # only the barrier makes the flusher write early
+    exchange = first_exchange(user_id)
+    log.enqueue([exchange])
+
+    started = time.monotonic()
+    assert log.barrier(exchange.conversation_id) is True
+    assert time.monotonic() - started < 2
+
+    assert stored_messages(db_session, exchange.conversation_id) == 2
+    assert log.stats()['pending'] == 0
+    assert os.path.getsize(log.path) == 0  # truncated once the queue drained
+
+def test_barrier_of_a_conversation_without_queued_exchanges_returns_at_once(log, user_id):
+    log.enqueue([first_exchange(user_id)])
+    assert log.barrier(new_id()) is True
+
+def test_barrier_times_out_while_the_database_fails(db_session, log, monkeypatch, user_id):
+    def unavailable(engine, batch, log_path):
+        raise RuntimeError('database unavailable')
+    monkeypatch.setattr(persistence, 'write_exchanges', unavailable)
+    log.barrier_timeout = 0.2
+    exchange = first_exchange(user_id)
+    log.enqueue([exchange])
+
+    assert log.barrier(exchange.conversation_id) is False
+    assert log.stats()['last_error'] == 'database unavailable'
+
+    monkeypatch.undo()
+    log.barrier_timeout = 10
+    assert log.barrier(exchange.conversation_id) is True
+    assert stored_messages(db_session, exchange.conversation_id) == 2
+
+def test_barrier_is_a_no_op_when_disabled(app, tmp_path):
+    log = WriteBehindLog(False, str(tmp_path), flush_interval=0.01, batch_size=100)
+    log.init_app(app)
+    assert log.barrier(new_id()) is True
+    assert log.barrier() is True
+
+def test_close_flushes_and_removes_the_log(db_session, log, user_id):
+    exchange = first_exchange(user_id)
+    log.enqueue([exchange])
+    path = log.path
+
+    log.close(timeout=10)
+
+    assert stored_messages(db_session, exchange.conversation_id) == 2
+    assert not os.path.exists(path)
@@ -0,0 +1,239 @@
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from config import Config
+from metrics import Counter, Gauge, Histogram
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+http_request_duration = Histogram(
+    'http_request_duration_seconds',
+    'Time from receiving a request to sending the last byte of its response',
+    labelnames=('method', 'route', 'status')
+)
+http_requests_in_flight = Gauge(
+    'http_requests_in_flight',
+    'Requests currently being served',
+    labelnames=('route',)
+)
+http_request_errors = Counter(
+    'http_request_errors_total',
+    'Requests answered with a 5xx status',
+    labelnames=('method', 'route', 'status')
+)
+span_duration = Histogram(
+    'trace_span_duration_seconds',
+    'Duration of traced stages of request handling',
+    labelnames=('span',)
+)
+spans_in_flight = Gauge(
+    'trace_spans_in_flight',
+    'Traced stages currently running',
+    labelnames=('span',)
+)
+span_errors = Counter(
+    'trace_span_errors_total',
+    'Traced stages that raised an exception',
+    labelnames=('span',)
+)
+
+_current = contextvars.ContextVar('trace', default=None)
+
+# Called with (trace, status) when a request is finished
+finish_hooks = []
+
+class Trace:
+    """The timed spans of one request, in the order they started"""
+
+    def __init__(self, request_id, method, route, path):
+        self.request_id = request_id
+        self.method = method
+        self.route = route
+        self.path = path
+        self.received_at = datetime.utcnow()
+        self.started = time.perf_counter()
+        self.spans = []
+        self.depth = 0
+        self.queries = None  # RequestQueries, filled in by the query profiler
+
+    def to_dict(self, status, duration):
+        return {
+            'request_id': self.request_id,
+            'method': self.method,
+            'route': self.route,
+            'path': self.path,
+            'status': status,
+            'received_at': self.received_at.isoformat(),
+            'duration_ms': round(duration * 1000, 3),
+            'spans': self.spans,
+            'queries': self.queries.report() if self.queries else None
+        }
+
+def current_trace():
+    return _current.get()
+
+def clear_trace():
+    """Detach the current context from any trace (for background work started by a request)"""
+    _current.set(None)
+
+def current_request_id():
+    trace = _current.get()
+    return trace.request_id if trace else None
+
+@contextmanager
+def span(name):
+    """
+    Time a stage of request handling. Every span feeds the stage histograms;
+    inside a request it is also added to the request's trace, nested under
+    the spans that are open around it.
+    """
+    trace = _current.get()
+    record = None
+    if trace is not None:
+        record = {'name': name, 'start_ms': round((time.perf_counter() - trace.started) * 1000, 3), 'depth': trace.depth}
+        trace.spans.append(record)
+        trace.depth += 1
+    spans_in_flight.inc(span=name)
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        span_errors.inc(span=name)
+        if record is not None:
+            record['error'] = type(e).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        spans_in_flight.dec(span=name)
+        span_duration.observe(duration, span=name)
+        if record is not None:
+            record['duration_ms'] = round(duration * 1000, 3)
+            trace.depth -= 1
+
+def traced(name):
+    """Decorator form of span for functions and coroutine functions"""
+    def decorate(function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                with span(name):
+                    return await function(*args, **kwargs)
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with span(name):
+                    return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+class SlowTraceLog:
+    """Appends the traces of requests slower than a threshold to a JSON lines file"""
+
+    def __init__(self, path, threshold_ms):
+        self.path = path
+        self.threshold_ms = threshold_ms
+        self._lock = threading.Lock()
+
+    def record(self, trace, status, duration):
+        if not self.path or duration * 1000 < self.threshold_ms:
+            return
+        line = json.dumps(trace.to_dict(status, duration))
+        try:
+            with self._lock:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.path, 'a') as f:
+                    f.write(line + '\n')
+        except OSError as e:
+            print(f"Error writing trace log: {str(e)}")
+
+slow_trace_log = SlowTraceLog(Config.TRACE_LOG_PATH, Config.TRACE_SLOW_THRESHOLD_MS)
+
+def start_trace(request_id, method, route, path):
+    """Begin the trace of a request and make it current"""
+    trace = Trace(request_id or uuid.uuid4().hex, method, route, path)
+    _current.set(trace)
+    http_requests_in_flight.inc(route=route)
+    return trace
+
+def finish_trace(trace, status):
+    """Record the request metrics of a trace once its response is complete"""
+    duration = time.perf_counter() - trace.started
+    http_requests_in_flight.dec(route=trace.route)
+    http_request_duration.observe(duration, method=trace.method, route=trace.route, status=str(status))
+    if status >= 500:
+        http_request_errors.inc(method=trace.method, route=trace.route, status=str(status))
+    for hook in finish_hooks:
+        hook(trace, status)
+    slow_trace_log.record(trace, status, duration)
+
+def init_app(app):
+    """
+    Trace every request of a Flask app. The request ID comes from the
+    X-Request-ID header when the client sends one and is echoed in the
+    response. A request is finished when its response is closed, so
+    streamed responses are timed to their last byte.
+    """
+    from flask import g, request
+
+    @app.before_request
+    def begin_request_trace():
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        g.trace = start_trace(request.headers.get(REQUEST_ID_HEADER), request.method, route, request.path)
+
+    @app.after_request
+    def end_request_trace(response):
+        trace = g.pop('trace', None)
+        if trace is not None:
+            response.headers[REQUEST_ID_HEADER] = trace.request_id
+            status = response.status_code
+            response.call_on_close(lambda: finish_trace(trace, status))
+        return response
+
+    @app.teardown_request
+    def clear_request_trace(exception=None):
+        # Worker threads are reused; work outside a request must not land in an old trace
+        _current.set(None)
+
+class TracingMiddleware:
+    """
+    ASGI middleware with the same tracing as init_app. Paths that are not
+    in routes are counted as 'unmatched' to keep the metric labels bounded.
+    """
+
+    def __init__(self, app, routes=()):
+        self.app = app
+        self.routes = set(routes)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope['headers'])
+        request_id = headers.get(REQUEST_ID_HEADER.lower().encode(), b'').decode('latin-1')
+        route = scope['path'] if scope['path'] in self.routes else 'unmatched'
+        trace = start_trace(request_id, scope['method'], route, scope['path'])
+        status = 500
+
+        async def send_with_request_id(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                message['headers'] = list(message.get('headers', [])) + [
+                    (REQUEST_ID_HEADER.lower().encode(), trace.request_id.encode('latin-1'))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            finish_trace(trace, status)
@@ -10,6 +10,7 @@ WHERE NOT EXISTS (SELECT FROM pg_database WHERE datname = 'conversational_ai')\g
 
 -- Create extensions if needed
 CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
 
 -- The actual tables will be created by SQLAlchemy when the backend starts
 -- This script ensures the database exists and is ready for the application 
\ No newline at end of file